@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, cast
+
+from fastapi import Depends, Header
+from sqlalchemy import ColumnElement, event, inspect
+from sqlalchemy.orm import Session
+
+from backend_server.database import AnySession, run_in_session
+from backend_server.models import User
+
+AUTH_CACHE_SIZE = int(os.environ.get('AUTH_CACHE_SIZE', '10000'))
+AUTH_CACHE_TTL = float(os.environ.get('AUTH_CACHE_TTL', '300'))
+# Неизвестные ключи кэшируются на меньший срок
+AUTH_CACHE_NEGATIVE_TTL = float(os.environ.get('AUTH_CACHE_NEGATIVE_TTL',
+                                               '30'))
+
+_resolvers: 'weakref.WeakSet[ApiKeyResolver]' = weakref.WeakSet()
+
+
+class ApiKeyResolver:
+    """
+    Ограниченный по размеру кэш соответствия api_key -> id пользователя
+    со сроком жизни записей. Отсутствие пользователя тоже кэшируется.
+    Записи сбрасываются явно при изменении или удалении ключа.
+    """
+
+    def __init__(
+            self,
+            max_size: int = AUTH_CACHE_SIZE,
+            ttl: float = AUTH_CACHE_TTL,
+            negative_ttl: float = AUTH_CACHE_NEGATIVE_TTL,
+    ) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, Tuple[float, Optional[int]]] = \
+            OrderedDict()
+        self._lock = threading.Lock()
+        _resolvers.add(self)
+
+    def cached(self, api_key: str) -> Tuple[bool, Optional[int]]:
+        """
+        Ищет ключ в кэше. Возвращает признак попадания и id пользователя
+        (None для закэшированного неизвестного ключа).
+        """
+        with self._lock:
+            entry = self._entries.get(api_key)
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            self._entries.move_to_end(api_key)
+            return True, entry[1]
+
+    def load(self, my_session: Session, api_key: str) -> Optional[int]:
+        """Находит id пользователя в БД и кэширует результат"""
+        user_id: Optional[int] = my_session.query(User.id).filter(
+            cast(ColumnElement[bool], api_key == User.api_key)).scalar()
+        ttl = self.ttl if user_id is not None else self.negative_ttl
+        with self._lock:
+            self._entries[api_key] = (time.monotonic() + ttl, user_id)
+            self._entries.move_to_end(api_key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return user_id
+
+    def resolve(self, my_session: Session, api_key: str) -> Optional[int]:
+        """Возвращает id пользователя по api_key, обращаясь к БД при промахе"""
+        found, user_id = self.cached(api_key)
+        if found:
+            return user_id
+        return self.load(my_session, api_key)
+
+    def invalidate(self, api_key: str) -> None:
+        """Сбрасывает запись ключа"""
+        with self._lock:
+            self._entries.pop(api_key, None)
+
+    def clear(self) -> None:
+        """Сбрасывает все записи"""
+        with self._lock:
+            self._entries.clear()
+
+    def statistics(self) -> Dict[str, int]:
+        """Возвращает счётчики попаданий и заполненность кэша"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+            }
+
+
+def user_id_dependency(
+        resolver: ApiKeyResolver,
+        get_session: Callable[..., Any],
+) -> Callable[..., Awaitable[Optional[int]]]:
+    """
+    Создаёт зависимость FastAPI, возвращающую id пользователя
+    по заголовку api-key или None для неизвестного ключа.
+    """
+
+    async def get_user_id(
+            api_key: str = Header(...),
+            session: AnySession = Depends(get_session),
+    ) -> Optional[int]:
+        found, user_id = resolver.cached(api_key)
+        if found:
+            return user_id
+        return await run_in_session(session, resolver.load, api_key)
+
+    return get_user_id
+
+
+def _invalidate_api_keys(*api_keys: Optional[str]) -> None:
+    """Сбрасывает ключи во всех кэшах процесса"""
+    for resolver in list(_resolvers):
+        for api_key in api_keys:
+            if api_key is not None:
+                resolver.invalidate(api_key)
+
+
+@event.listens_for(User, 'after_update')
+def _api_key_updated(mapper: Any, connection: Any, target: User) -> None:
+    """Сбрасывает старый и новый ключ при смене api_key пользователя"""
+    history = inspect(target, raiseerr=True).attrs.api_key.history
+    if history.has_changes():
+        _invalidate_api_keys(*history.deleted, *history.added)
+
+
+@event.listens_for(User, 'after_insert')
+def _user_inserted(mapper: Any, connection: Any, target: User) -> None:
+    """Сбрасывает закэшированное отсутствие ключа нового пользователя"""
+    _invalidate_api_keys(target.api_key)
+
+
+@event.listens_for(User, 'after_delete')
+def _user_deleted(mapper: Any, connection: Any, target: User) -> None:
+    """Сбрасывает ключ удалённого пользователя"""
+    _invalidate_api_keys(target.api_key)
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple, cast
+
+from sqlalchemy import ColumnElement, func, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import InstrumentedAttribute, Session
+
+from backend_server.database import (
+    SessionSource,
+    any_session_scope,
+    run_in_session,
+)
+from backend_server.models import Follow, Like, Tweet, User
+
+logger = logging.getLogger(__name__)
+
+# Как часто накопленные приращения счётчиков записываются в БД, секунды
+COUNTERS_FLUSH_INTERVAL = float(os.environ.get('COUNTERS_FLUSH_INTERVAL',
+                                               '1'))
+# Сколько разных счётчиков можно накопить до внеочередной записи
+COUNTERS_MAX_PENDING = int(os.environ.get('COUNTERS_MAX_PENDING', '1000'))
+
+# Денормализованный счётчик: (модель, столбец)
+Counter = Tuple[Any, str]
+LIKE_COUNT: Counter = (Tweet, 'like_count')
+FOLLOWERS_COUNT: Counter = (User, 'followers_count')
+FOLLOWING_COUNT: Counter = (User, 'following_count')
+
+
+class CounterAggregator:
+    """
+    Накопитель приращений денормализованных счётчиков (write-behind).
+    Лайки и подписки не обновляют строку твита или пользователя сразу:
+    приращения суммируются в памяти процесса и периодически
+    записываются в БД одним UPDATE на каждый изменённый счётчик:
+    при очередной записи лайка или подписки и по таймеру, запущенному
+    через start, чтобы приращения не ждали следующей записи.
+    Ещё не записанные приращения учитываются при чтении через pending.
+    """
+
+    def __init__(
+            self,
+            flush_interval: float = COUNTERS_FLUSH_INTERVAL,
+            max_pending: int = COUNTERS_MAX_PENDING,
+    ) -> None:
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.flushes = 0
+        self.updates = 0
+        self._pending: Dict[Tuple[Counter, int], int] = {}
+        self._flushed_at = time.monotonic()
+        self._timer: Optional['asyncio.Task[None]'] = None
+        self._lock = threading.Lock()
+
+    def add(self, counter: Counter, key: Optional[int], delta: int) -> None:
+        """Добавляет приращение счётчика строки с id key"""
+        if key is None:
+            return
+        with self._lock:
+            total = self._pending.get((counter, key), 0) + delta
+            if total:
+                self._pending[(counter, key)] = total
+            else:
+                self._pending.pop((counter, key), None)
+
+    def pending(self, counter: Counter, key: int) -> int:
+        """Возвращает ещё не записанное в БД приращение счётчика"""
+        with self._lock:
+            return self._pending.get((counter, key), 0)
+
+    def pending_by_key(self, counter: Counter) -> Dict[int, int]:
+        """Возвращает все ещё не записанные приращения одного счётчика"""
+        with self._lock:
+            return {key: delta for (pending_counter, key), delta
+                    in self._pending.items() if pending_counter == counter}
+
+    def flush_due(self, my_session: Session) -> int:
+        """
+        Записывает приращения, если истёк интервал записи
+        или накопилось слишком много счётчиков.
+        Ошибка записи не прерывает вызывающую операцию:
+        приращения остаются в накопителе до следующей записи.
+        """
+        with self._lock:
+            due = len(self._pending) >= self.max_pending or \
+                time.monotonic() - self._flushed_at >= self.flush_interval
+        if not due:
+            return 0
+        try:
+            return self.flush(my_session)
+        except SQLAlchemyError:
+            logger.exception('Failed to flush counters')
+            return 0
+
+    def flush(self, my_session: Session) -> int:
+        """
+        Записывает все накопленные приращения в одной транзакции.
+        При ошибке приращения возвращаются в накопитель.
+        Возвращает число выполненных UPDATE.
+        """
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            self._flushed_at = time.monotonic()
+        if not batch:
+            return 0
+        try:
+            for ((model, column), key), delta in batch.items():
+                attribute: InstrumentedAttribute[int] = getattr(model, column)
+                my_session.execute(
+                    update(model)
+                    .where(cast(ColumnElement[bool], model.id == key))
+                    .values({column: attribute + delta})
+                )
+            my_session.commit()
+        except Exception:
+            my_session.rollback()
+            with self._lock:
+                for pending_key, delta in batch.items():
+                    self._pending[pending_key] = \
+                        self._pending.get(pending_key, 0) + delta
+            raise
+        with self._lock:
+            self.flushes += 1
+            self.updates += len(batch)
+        return len(batch)
+
+    async def start(self, my_session: SessionSource) -> None:
+        """
+        Запускает в текущем цикле событий запись приращений
+        раз в flush_interval секунд
+        """
+        if self.flush_interval > 0 and self._timer is None:
+            self._timer = asyncio.ensure_future(
+                self._flush_periodically(my_session))
+
+    async def stop(self) -> None:
+        """Останавливает запись по таймеру"""
+        if self._timer is not None:
+            self._timer.cancel()
+            await asyncio.gather(self._timer, return_exceptions=True)
+            self._timer = None
+
+    async def _flush_periodically(self, my_session: SessionSource) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                async with any_session_scope(my_session) as session:
+                    await run_in_session(session, self.flush_due)
+            except Exception:
+                logger.exception('Failed to flush counters')
+
+    def statistics(self) -> Dict[str, int]:
+        """Возвращает число накопленных счётчиков и выполненных записей"""
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'flushes': self.flushes,
+                'updates': self.updates,
+            }
+
+
+def reconcile_counters(my_session: Session) -> int:
+    """
+    Пересчитывает денормализованные счётчики по таблицам like и follow.
+    Обновляет только расходящиеся строки. Возвращает их число.
+    """
+    like_count = select(func.count()).where(
+        Like.tweet_id == Tweet.id).scalar_subquery()
+    followers_count = select(func.count()).where(
+        Follow.following_id == User.id).scalar_subquery()
+    following_count = select(func.count()).where(
+        Follow.follower_id == User.id).scalar_subquery()
+    fixed = my_session.execute(
+        update(Tweet).where(Tweet.like_count != like_count)
+        .values(like_count=like_count)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    fixed += my_session.execute(
+        update(User)
+        .where(cast(ColumnElement[bool],
+                    (User.followers_count != followers_count)
+                    | (User.following_count != following_count)))
+        .values(followers_count=followers_count,
+                following_count=following_count)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    my_session.commit()
+    return fixed
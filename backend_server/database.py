@@ -1,9 +1,304 @@
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Concatenate,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    ParamSpec,
+    TypeVar,
+    Union,
+)
+
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+from sqlalchemy.orm import Session as OrmSession
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import (
+    AsyncAdaptedQueuePool,
+    ConnectionPoolEntry,
+    QueuePool,
+)
+from sqlalchemy.util.concurrency import await_only, in_greenlet
+from starlette.concurrency import run_in_threadpool
 
-engine = create_engine(
-    'postgresql+psycopg2://admin:admin@db_postgres:5432/postgres'
+DATABASE_URL = os.environ.get(
+    'DATABASE_URL',
+    'postgresql+psycopg2://admin:admin@db_postgres:5432/postgres',
+)
+DATABASE_ASYNC_URL = os.environ.get(
+    'DATABASE_ASYNC_URL',
+    'postgresql+asyncpg://admin:admin@db_postgres:5432/postgres',
 )
+# Обслуживать запросы через AsyncSession вместо пула потоков
+DB_ASYNC = os.environ.get('DB_ASYNC', '0') == '1'
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '20'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '30'))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '1800'))
+# Таймаут выполнения одного запроса в Postgres, мс (0 - без ограничения)
+DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', '5000'))
+
+SessionSource = Union[
+    OrmSession,
+    sessionmaker[OrmSession],
+    AsyncSession,
+    async_sessionmaker[AsyncSession],
+]
+AnySession = Union[OrmSession, AsyncSession]
+
+P = ParamSpec('P')
+T = TypeVar('T')
+ThreadWrapper = Callable[[Callable[..., Any]], Callable[..., Any]]
+
+# Обёртки функций, передаваемых в пул потоков. Профилирование
+# запросов подключает свою через wrap_threads
+_thread_wrappers: List[ThreadWrapper] = []
+
+
+class InstrumentedQueuePool(QueuePool):
+    """Пул соединений, собирающий статистику выдачи и ожидания соединений"""
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.checkins = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self._stats_lock = threading.Lock()
+
+    def statistics(self) -> Dict[str, Union[int, float]]:
+        """Возвращает снимок статистики пула"""
+        with self._stats_lock:
+            return {
+                'size': self.size(),
+                'checked_out': self.checkedout(),
+                'overflow': self.overflow(),
+                'checked_in': self.checkedin(),
+                'checkouts_total': self.checkouts,
+                'checkins_total': self.checkins,
+                'wait_seconds_total': self.wait_time_total,
+                'wait_seconds_max': self.wait_time_max,
+            }
+
+    def _do_get(self) -> ConnectionPoolEntry:
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_time_total += waited
+                self.wait_time_max = max(self.wait_time_max, waited)
+
+    def _do_return_conn(self, record: ConnectionPoolEntry) -> None:
+        with self._stats_lock:
+            self.checkins += 1
+        super()._do_return_conn(record)
+
+
+class InstrumentedAsyncQueuePool(InstrumentedQueuePool, AsyncAdaptedQueuePool):
+    """Пул соединений асинхронного двигателя со статистикой"""
+
+
+def _pool_options() -> Dict[str, Any]:
+    """Возвращает настройки пула соединений из окружения"""
+    return {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+        'pool_recycle': DB_POOL_RECYCLE,
+    }
+
+
+def make_engine(url: str = DATABASE_URL) -> Engine:
+    """Создаёт двигатель БД с пулом соединений по настройкам окружения"""
+    connect_args: Dict[str, Any] = {}
+    if make_url(url).get_backend_name() == 'postgresql' \
+            and DB_STATEMENT_TIMEOUT:
+        connect_args['options'] = \
+            f'-c statement_timeout={DB_STATEMENT_TIMEOUT}'
+    return create_engine(
+        url,
+        poolclass=InstrumentedQueuePool,
+        connect_args=connect_args,
+        **_pool_options(),
+    )
+
+
+def make_async_engine(url: str = DATABASE_ASYNC_URL) -> AsyncEngine:
+    """
+    Создаёт асинхронный двигатель БД (asyncpg, aiosqlite)
+    с пулом соединений по настройкам окружения
+    """
+    connect_args: Dict[str, Any] = {}
+    if make_url(url).get_backend_name() == 'postgresql' \
+            and DB_STATEMENT_TIMEOUT:
+        connect_args['server_settings'] = {
+            'statement_timeout': str(DB_STATEMENT_TIMEOUT),
+        }
+    return create_async_engine(
+        url,
+        poolclass=InstrumentedAsyncQueuePool,
+        connect_args=connect_args,
+        **_pool_options(),
+    )
+
+
+def pool_statistics(sqlalchemy_engine: Engine) -> Dict[str, Union[int, float]]:
+    """Возвращает статистику пула соединений двигателя"""
+    pool = sqlalchemy_engine.pool
+    if isinstance(pool, InstrumentedQueuePool):
+        return pool.statistics()
+    return {'checked_out': getattr(pool, 'checkedout', lambda: 0)()}
+
+
+def source_engine(my_session: SessionSource) -> Optional[Engine]:
+    """
+    Возвращает синхронный двигатель источника сессий
+    (для асинхронного - его sync_engine) или None, если он не задан.
+    """
+    if isinstance(my_session, (OrmSession, AsyncSession)):
+        bind = my_session.bind
+    else:
+        bind = my_session.kw.get('bind')
+    if isinstance(bind, AsyncEngine):
+        return bind.sync_engine
+    return bind if isinstance(bind, Engine) else None
+
+
+@contextmanager
+def session_scope(
+        my_session: Union[OrmSession, sessionmaker[OrmSession]],
+) -> Iterator[OrmSession]:
+    """
+    Выдаёт сессию ORM на время блока.
+    Общая сессия отдаётся как есть, фабрика сессий создаёт новую сессию,
+    которая закрывается по выходу из блока.
+    """
+    if isinstance(my_session, OrmSession):
+        yield my_session
+        return
+    with my_session() as new_session:
+        yield new_session
+
+
+@asynccontextmanager
+async def async_session_scope(
+        my_session: Union[AsyncSession, async_sessionmaker[AsyncSession]],
+) -> AsyncIterator[AsyncSession]:
+    """Асинхронный аналог session_scope для AsyncSession"""
+    if isinstance(my_session, AsyncSession):
+        yield my_session
+        return
+    async with my_session() as new_session:
+        yield new_session
+
+
+@asynccontextmanager
+async def any_session_scope(
+        my_session: SessionSource) -> AsyncIterator[AnySession]:
+    """
+    Выдаёт сессию любого режима на время блока вне запроса:
+    для фоновых задач и обработчиков запуска и остановки приложения.
+    """
+    if isinstance(my_session, (AsyncSession, async_sessionmaker)):
+        async with async_session_scope(my_session) as async_session:
+            yield async_session
+        return
+    with session_scope(my_session) as sync_session:
+        yield sync_session
+
+
+def session_dependency(
+        my_session: SessionSource) -> Callable[..., Any]:
+    """
+    Создаёт зависимость FastAPI, выдающую сессию на время запроса.
+    Для асинхронного источника зависимость выдаёт AsyncSession.
+    """
+    if isinstance(my_session, (AsyncSession, async_sessionmaker)):
+        async_source = my_session
+
+        async def get_async_session() -> AsyncIterator[AsyncSession]:
+            async with async_session_scope(async_source) as request_session:
+                yield request_session
+
+        return get_async_session
+    sync_source = my_session
+
+    def get_session() -> Iterator[OrmSession]:
+        with session_scope(sync_source) as request_session:
+            yield request_session
+
+    return get_session
+
+
+def wrap_threads(wrapper: ThreadWrapper) -> None:
+    """
+    Добавляет обёртку функций, которые run_in_session
+    и run_cpu_bound передают в пул потоков
+    """
+    if wrapper not in _thread_wrappers:
+        _thread_wrappers.append(wrapper)
+
+
+def _wrapped(func: Callable[P, T]) -> Callable[P, T]:
+    for wrapper in _thread_wrappers:
+        func = wrapper(func)
+    return func
+
+
+async def run_in_session(
+        my_session: AnySession,
+        func: Callable[Concatenate[OrmSession, P], T],
+        *args: P.args,
+        **kwargs: P.kwargs,
+) -> T:
+    """
+    Выполняет синхронную функцию работы с БД.
+    Для Session функция выполняется в пуле потоков и не блокирует
+    цикл событий. Для AsyncSession - через run_sync в потоке цикла
+    событий: он освобождается только на время ожидания
+    асинхронного драйвера, поэтому вычисления, занимающие процессор,
+    функция передаёт в run_cpu_bound.
+    """
+    if isinstance(my_session, AsyncSession):
+        return await my_session.run_sync(func, *args, **kwargs)
+    return await run_in_threadpool(_wrapped(func), my_session,
+                                   *args, **kwargs)
+
+
+def run_cpu_bound(func: Callable[P, T],
+                  *args: P.args, **kwargs: P.kwargs) -> T:
+    """
+    Выполняет вычисление, занимающее процессор, из функции,
+    переданной в run_in_session. Под AsyncSession вычисление уходит
+    в пул потоков, а цикл событий тем временем обслуживает другие
+    запросы. В синхронном режиме функция уже выполняется в пуле
+    потоков, и вычисление идёт на месте. Вычисление не должно
+    обращаться к сессии.
+    """
+    if in_greenlet():
+        return await_only(run_in_threadpool(_wrapped(func), *args, **kwargs))
+    return func(*args, **kwargs)
+
+
+engine = make_engine()
 Session = sessionmaker(engine)
-session = Session()
 Base = declarative_base()
@@ -0,0 +1,174 @@
+"""
+Потоковая выгрузка твитов, лайков и подписок в NDJSON.
+
+Строки читаются серверным курсором пачками по EXPORT_BATCH_SIZE,
+поэтому память не зависит от размера таблиц. Строки упорядочены
+по первичному ключу, и выгрузку можно продолжить с ключа последней
+полученной строки:
+
+    python -m backend_server.export tweets --output tweets.ndjson.gz \\
+        --gzip --after 1000
+"""
+import argparse
+import gzip
+import os
+import sys
+import zlib
+from contextlib import ExitStack
+from typing import (
+    Any,
+    AsyncIterator,
+    BinaryIO,
+    Dict,
+    FrozenSet,
+    Iterator,
+    Optional,
+    Sequence,
+    Tuple,
+    cast,
+)
+
+from sqlalchemy import Select, literal, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import InstrumentedAttribute, Session
+from starlette.concurrency import iterate_in_threadpool
+
+from backend_server.database import (
+    DATABASE_URL,
+    AnySession,
+    SessionSource,
+    any_session_scope,
+    make_engine,
+)
+from backend_server.models import Follow, Like, Tweet
+from backend_server.serializers import dumps
+
+# Сколько строк читается из курсора за раз
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '1000'))
+# api-key через запятую, которым разрешена выгрузка по HTTP
+EXPORT_ADMIN_KEYS: FrozenSet[str] = frozenset(
+    key for key in os.environ.get('EXPORT_ADMIN_KEYS', '').split(',') if key)
+
+Columns = Tuple[InstrumentedAttribute[Any], ...]
+# Таблица -> (столбцы строки, столбцы первичного ключа)
+EXPORTS: Dict[str, Tuple[Columns, Columns]] = {
+    'tweets': ((Tweet.id, Tweet.user_id, Tweet.content,
+                Tweet.media_ids, Tweet.like_count), (Tweet.id, )),
+    'likes': ((Like.tweet_id, Like.user_id),
+              (Like.tweet_id, Like.user_id)),
+    'follows': ((Follow.follower_id, Follow.following_id),
+                (Follow.follower_id, Follow.following_id)),
+}
+
+
+def parse_after(table: str, after: Optional[str]) -> Tuple[int, ...]:
+    """
+    Разбирает ключ, после которого продолжается выгрузка:
+    значения столбцов первичного ключа через запятую.
+    Возбуждает ValueError для ключа неверного вида.
+    """
+    if not after:
+        return ()
+    key = tuple(int(value) for value in after.split(','))
+    if len(key) != len(EXPORTS[table][1]):
+        raise ValueError(f'{table} key has {len(EXPORTS[table][1])} columns')
+    return key
+
+
+def export_statement(table: str, after: Sequence[int] = (),
+                     batch_size: int = EXPORT_BATCH_SIZE) -> Select[Any]:
+    """Запрос строк таблицы по возрастанию ключа после ключа after"""
+    columns, key = EXPORTS[table]
+    statement = select(*columns).order_by(*key).execution_options(
+        yield_per=batch_size, stream_results=True)
+    if after:
+        statement = statement.where(tuple_(*key) > tuple_(*map(literal, after)))
+    return statement
+
+
+def encode_rows(table: str, rows: Sequence[Sequence[Any]]) -> bytes:
+    """Кодирует пачку строк в NDJSON"""
+    names = [column.key for column in EXPORTS[table][0]]
+    return b''.join(dumps(dict(zip(names, row))) + b'\n' for row in rows)
+
+
+def iter_export(my_session: Session, table: str, after: Sequence[int] = (),
+                batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """Выдаёт выгрузку таблицы пачками строк NDJSON"""
+    result = my_session.execute(export_statement(table, after, batch_size))
+    for rows in result.partitions():
+        yield encode_rows(table, rows)
+
+
+async def stream_export(
+        my_session: SessionSource, table: str, after: Sequence[int] = (),
+        batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[bytes]:
+    """
+    Асинхронный вариант iter_export для StreamingResponse.
+    Сессия открывается на время выгрузки, а не запроса:
+    зависимости FastAPI закрываются до отправки тела ответа.
+    """
+    async with any_session_scope(my_session) as session:
+        async for chunk in _session_chunks(session, table, after, batch_size):
+            yield chunk
+
+
+async def _session_chunks(session: AnySession, table: str,
+                          after: Sequence[int],
+                          batch_size: int) -> AsyncIterator[bytes]:
+    if isinstance(session, AsyncSession):
+        result = await session.stream(
+            export_statement(table, after, batch_size))
+        async for rows in result.partitions():
+            yield encode_rows(table, rows)
+        return
+    async for chunk in iterate_in_threadpool(
+            iter_export(session, table, after, batch_size)):
+        yield chunk
+
+
+async def gzip_chunks(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Сжимает поток в формат gzip, не накапливая его целиком"""
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def write_export(my_session: Session, table: str, output: BinaryIO,
+                 after: Sequence[int] = (),
+                 batch_size: int = EXPORT_BATCH_SIZE) -> int:
+    """Записывает выгрузку таблицы в файл. Возвращает число байт"""
+    written = 0
+    for chunk in iter_export(my_session, table, after, batch_size):
+        written += output.write(chunk)
+    return written
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """Точка входа выгрузки из командной строки"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('table', choices=sorted(EXPORTS))
+    parser.add_argument('--url', default=DATABASE_URL)
+    parser.add_argument('--after', help='ключ последней выгруженной строки')
+    parser.add_argument('--batch-size', type=int, default=EXPORT_BATCH_SIZE)
+    parser.add_argument('--gzip', action='store_true')
+    parser.add_argument('--output', help='файл выгрузки, по умолчанию stdout')
+    args = parser.parse_args(argv)
+    after = parse_after(args.table, args.after)
+
+    with ExitStack() as stack:
+        output: BinaryIO = sys.stdout.buffer if args.output is None \
+            else stack.enter_context(open(args.output, 'wb'))
+        if args.gzip:
+            output = cast(BinaryIO, stack.enter_context(
+                gzip.GzipFile(fileobj=output, mode='wb')))
+        session = stack.enter_context(Session(make_engine(args.url)))
+        write_export(session, args.table, output, after, args.batch_size)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
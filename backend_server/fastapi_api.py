@@ -1,4 +1,5 @@
 import logging
+from typing import Optional
 
 from fastapi import FastAPI
 from sqlalchemy import exc
@@ -6,15 +7,28 @@ from sqlalchemy.engine.base import Engine
 from sqlalchemy.orm import Session
 from sqlalchemy.orm.decl_api import DeclarativeMeta
 
+from backend_server.database import SessionSource
+from backend_server.media_storage import MediaStorage
 from backend_server.models import Follow, Media, Tweet, User
+from backend_server.routes import connect_routes
 
 logging.basicConfig()
 logger = logging.getLogger(__name__)
 
 
-def create_app() -> FastAPI:
-    """Инициализация приложения"""
+def create_app(
+        my_session: Optional[SessionSource] = None,
+        media_storage: Optional[MediaStorage] = None,
+) -> FastAPI:
+    """
+    Инициализация приложения.
+    Если передан источник сессий, подключает к приложению роуты:
+    sessionmaker выбирает синхронный режим, async_sessionmaker - асинхронный.
+    """
     _app = FastAPI()
+    if my_session is not None:
+        connect_routes(app=_app, my_session=my_session,
+                       media_storage=media_storage)
     return _app
 
 
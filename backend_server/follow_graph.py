@@ -0,0 +1,243 @@
+import os
+import threading
+from itertools import chain
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import numpy.typing as npt
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from backend_server.database import run_cpu_bound
+from backend_server.models import Follow
+
+# Сколько изменений подписок копится до пересборки массивов графа
+FOLLOW_GRAPH_COMPACT_EDGES = int(
+    os.environ.get('FOLLOW_GRAPH_COMPACT_EDGES', '10000'))
+FOLLOW_GRAPH_BATCH_SIZE = 50000
+
+IdArray = npt.NDArray[np.int32]
+OffsetArray = npt.NDArray[np.int64]
+
+
+class Adjacency:
+    """
+    Подписки всех пользователей в формате CSR: подписки
+    пользователя u - отсортированный срез
+    targets[offsets[u]:offsets[u + 1]]. Ребро занимает 4 байта,
+    пользователь - 8 байт смещения.
+    """
+
+    def __init__(self, offsets: OffsetArray, targets: IdArray) -> None:
+        self.offsets = offsets
+        self.targets = targets
+
+    @classmethod
+    def from_edges(cls, followers: IdArray,
+                   following: IdArray) -> 'Adjacency':
+        """Строит граф из пар (подписчик, автор) в любом порядке"""
+        order = np.lexsort((following, followers))
+        followers, following = followers[order], following[order]
+        users = int(followers.max(initial=-1)) + 1
+        offsets = np.zeros(users + 1, np.int64)
+        np.cumsum(np.bincount(followers, minlength=users), out=offsets[1:])
+        return cls(offsets, following.astype(np.int32))
+
+    def row(self, user_id: int) -> IdArray:
+        """Отсортированные id авторов, на которых подписан пользователь"""
+        if not 0 <= user_id < len(self.offsets) - 1:
+            return self.targets[:0]
+        return self.targets[self.offsets[user_id]:self.offsets[user_id + 1]]
+
+    def edges(self) -> Tuple[IdArray, IdArray]:
+        """Все пары (подписчик, автор)"""
+        followers = np.repeat(np.arange(len(self.offsets) - 1,
+                                        dtype=np.int32),
+                              np.diff(self.offsets))
+        return followers, self.targets
+
+    def nbytes(self) -> int:
+        """Объём массивов графа в байтах"""
+        return int(self.offsets.nbytes + self.targets.nbytes)
+
+
+def _discard(changes: Dict[int, Set[int]], follower_id: int,
+             following_id: int) -> None:
+    """Убирает подписку из изменений пользователя, удаляя пустые наборы"""
+    targets = changes.get(follower_id)
+    if targets is not None:
+        targets.discard(following_id)
+        if not targets:
+            del changes[follower_id]
+
+
+def load_adjacency(session: Session) -> Adjacency:
+    """Строит граф подписок из таблицы follow"""
+    rows = session.execute(
+        select(Follow.follower_id, Follow.following_id)
+        .execution_options(yield_per=FOLLOW_GRAPH_BATCH_SIZE)).tuples()
+    pairs = np.fromiter(chain.from_iterable(rows), dtype=np.int32)
+    return run_cpu_bound(Adjacency.from_edges, pairs[0::2], pairs[1::2])
+
+
+class FollowGraph:
+    """
+    Граф подписок в памяти процесса для рекомендаций и проверки
+    подписки без обращения к БД. Строится из БД при запуске или
+    первом обращении. Подписки и отписки копятся в небольших
+    множествах поверх массивов CSR и переносятся в массивы
+    пересборкой, когда их становится больше compact_edges.
+    """
+
+    def __init__(
+            self,
+            compact_edges: int = FOLLOW_GRAPH_COMPACT_EDGES) -> None:
+        self.compact_edges = compact_edges
+        self._adjacency = Adjacency(np.zeros(1, np.int64),
+                                    np.zeros(0, np.int32))
+        self._loaded = False
+        self._added: Dict[int, Set[int]] = {}
+        self._removed: Dict[int, Set[int]] = {}
+        self._changes = 0
+        # Изменения во время построения: (подписчик, автор, подписка)
+        self._pending: List[Tuple[int, int, bool]] = []
+        self._building = 0
+        self._builds = 0
+        self._compactions = 0
+        self._lock = threading.Lock()
+
+    def follow(self, follower_id: int, following_id: int,
+               following: bool) -> None:
+        """Учитывает подписку (following=True) или отписку"""
+        with self._lock:
+            if not self._loaded:
+                if self._building:
+                    self._pending.append(
+                        (follower_id, following_id, following))
+                return
+            self._apply(follower_id, following_id, following)
+
+    def _apply(self, follower_id: int, following_id: int,
+               following: bool) -> None:
+        in_base = self._in_base(follower_id, following_id)
+        if following:
+            _discard(self._removed, follower_id, following_id)
+            if not in_base:
+                self._added.setdefault(follower_id, set()).add(following_id)
+        else:
+            _discard(self._added, follower_id, following_id)
+            if in_base:
+                self._removed.setdefault(follower_id, set()).add(following_id)
+        self._changes += 1
+
+    def _in_base(self, follower_id: int, following_id: int) -> bool:
+        row = self._adjacency.row(follower_id)
+        position = int(np.searchsorted(row, following_id))
+        return position < len(row) and int(row[position]) == following_id
+
+    def load(self, session: Session) -> None:
+        """
+        Строит граф из БД, если он ещё не построен, или переносит
+        накопленные изменения в массивы. Построение идёт без
+        блокировки, из одновременных используется первое.
+        """
+        if self._loaded:
+            if self._changes >= self.compact_edges:
+                run_cpu_bound(self.compact)
+            return
+        with self._lock:
+            self._building += 1
+        adjacency: Optional[Adjacency] = None
+        try:
+            adjacency = load_adjacency(session)
+        finally:
+            with self._lock:
+                self._building -= 1
+                if adjacency is not None and not self._loaded:
+                    self._adjacency = adjacency
+                    self._loaded = True
+                    self._builds += 1
+                    for change in self._pending:
+                        self._apply(*change)
+                if not self._building:
+                    self._pending.clear()
+
+    def compact(self) -> None:
+        """Пересобирает массивы CSR с накопленными изменениями"""
+        with self._lock:
+            followers, following = self._adjacency.edges()
+            keep = np.ones(len(following), bool)
+            users = len(self._adjacency.offsets) - 1
+            for follower_id, removed in self._removed.items():
+                # Новые пользователи есть только среди добавленных подписок
+                if not 0 <= follower_id < users:
+                    continue
+                start = self._adjacency.offsets[follower_id]
+                row = self._adjacency.row(follower_id)
+                keep[start:start + len(row)] &= ~np.isin(row, list(removed))
+            added = [(follower_id, following_id)
+                     for follower_id, targets in self._added.items()
+                     for following_id in targets]
+            extra = np.array(added, np.int32).reshape(-1, 2)
+            self._adjacency = Adjacency.from_edges(
+                np.concatenate([followers[keep], extra[:, 0]]),
+                np.concatenate([following[keep], extra[:, 1]]))
+            self._added, self._removed = {}, {}
+            self._changes = 0
+            self._compactions += 1
+
+    def _following(self, user_id: int) -> IdArray:
+        """Отсортированные подписки пользователя с учётом изменений"""
+        row = self._adjacency.row(user_id)
+        removed = self._removed.get(user_id)
+        if removed:
+            row = row[~np.isin(row, list(removed))]
+        added = self._added.get(user_id)
+        if added:
+            row = np.union1d(row, np.fromiter(added, np.int32))
+        return row
+
+    def _check_loaded(self) -> None:
+        if not self._loaded:
+            raise RuntimeError('Follow graph is not loaded')
+
+    def follows(self, follower_id: int, following_id: int) -> bool:
+        """Подписан ли follower_id на following_id"""
+        with self._lock:
+            self._check_loaded()
+            if following_id in self._added.get(follower_id, ()):
+                return True
+            if following_id in self._removed.get(follower_id, ()):
+                return False
+            return self._in_base(follower_id, following_id)
+
+    def suggest(self, user_id: int, limit: int) -> List[Tuple[int, int]]:
+        """
+        Друзья друзей: авторы, на которых подписаны подписки
+        пользователя, кроме него самого и его подписок,
+        по убыванию числа общих подписок, при равенстве - по id.
+        Возвращает пары (id, число общих подписок).
+        """
+        with self._lock:
+            self._check_loaded()
+            mine = self._following(user_id)
+            if not len(mine):
+                return []
+            candidates = np.concatenate(
+                [self._following(int(followee)) for followee in mine])
+        candidates = candidates[(candidates != user_id)
+                                & ~np.isin(candidates, mine)]
+        ids, mutual = np.unique(candidates, return_counts=True)
+        top = np.lexsort((ids, -mutual))[:limit]
+        return list(zip(ids[top].tolist(), mutual[top].tolist()))
+
+    def statistics(self) -> Dict[str, int]:
+        """Возвращает размер графа, число изменений и пересборок"""
+        with self._lock:
+            return {
+                'edges': len(self._adjacency.targets),
+                'bytes': self._adjacency.nbytes(),
+                'changes': self._changes,
+                'builds': self._builds,
+                'compactions': self._compactions,
+            }
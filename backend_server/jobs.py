@@ -0,0 +1,447 @@
+"""
+Очередь фоновых задач в БД.
+
+Задача - строка таблицы job с видом и параметрами в JSON.
+Она добавляется в той же транзакции, что и изменение, которое
+её породило, поэтому не теряется при перезапуске процесса.
+Диспетчер в цикле событий забирает готовые задачи одним
+UPDATE ... RETURNING: в Postgres строки выбираются
+через FOR UPDATE SKIP LOCKED, и несколько процессов не мешают
+друг другу, в SQLite выборки одного процесса идут под блокировкой,
+а между процессами их упорядочивает блокировка записи самой БД.
+Не больше JOBS_WORKERS задач выполняются одновременно:
+синхронные обработчики через run_in_session, асинхронные -
+в цикле событий. Упавшая задача повторяется с экспоненциальной
+задержкой, после JOBS_MAX_ATTEMPTS попыток остаётся в таблице
+в состоянии failed. Задачу, не завершённую за JOBS_LEASE секунд
+(процесс упал), забирает другой исполнитель, поэтому обработчики
+должны допускать повторное выполнение.
+
+Вычисления, занимающие процессор, асинхронные обработчики
+передают в compute: они выполняются в пуле процессов или потоков
+по JOBS_EXECUTOR, не занимая цикл событий, а пул процессов -
+и GIL процесса приложения. Так масштабируются варианты
+изображений задачи media_variants.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import (
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from contextlib import nullcontext
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    TypeVar,
+    Union,
+    cast,
+)
+
+from sqlalchemy import (
+    ColumnElement,
+    and_,
+    delete,
+    func,
+    insert,
+    or_,
+    select,
+    update,
+)
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.dml import ReturningUpdate
+
+from backend_server.database import (
+    AnySession,
+    SessionSource,
+    any_session_scope,
+    run_in_session,
+)
+from backend_server.models import Job
+
+logger = logging.getLogger(__name__)
+
+# Фоновые задачи включаются явно
+JOBS = os.environ.get('JOBS', '0') == '1'
+# Сколько задач выполняется одновременно
+JOBS_WORKERS = int(os.environ.get('JOBS_WORKERS', '4'))
+# Пул вычислений обработчиков: process или thread
+JOBS_EXECUTOR = os.environ.get('JOBS_EXECUTOR', 'process')
+JOBS_EXECUTOR_WORKERS = int(os.environ.get('JOBS_EXECUTOR_WORKERS',
+                                           str(os.cpu_count() or 1)))
+# Как часто искать задачи без сигнала о новых, секунды
+JOBS_POLL_INTERVAL = float(os.environ.get('JOBS_POLL_INTERVAL', '1'))
+JOBS_MAX_ATTEMPTS = int(os.environ.get('JOBS_MAX_ATTEMPTS', '5'))
+# Задержка первого повтора, удваивается с каждой попыткой
+JOBS_BACKOFF = float(os.environ.get('JOBS_BACKOFF', '1'))
+JOBS_BACKOFF_MAX = float(os.environ.get('JOBS_BACKOFF_MAX', '300'))
+JOBS_LEASE = float(os.environ.get('JOBS_LEASE', '300'))
+MAX_ERROR_LENGTH = 1000
+
+# Виды задач
+DELETE_TWEET = 'delete_tweet'
+MEDIA_VARIANTS = 'media_variants'
+
+QUEUED = 'queued'
+RUNNING = 'running'
+FAILED = 'failed'
+
+Handler = Callable[[Session, Dict[str, Any]], Any]
+AsyncHandler = Callable[[AnySession, Dict[str, Any]], Awaitable[Any]]
+T = TypeVar('T')
+
+
+class ClaimedJob(NamedTuple):
+    """Задача, забранная исполнителем"""
+    id: int
+    kind: str
+    payload: Dict[str, Any]
+    attempts: int
+    created_at: float
+
+
+class JobQueue:
+    """
+    Очередь задач в таблице job и пул их исполнителей.
+    Обработчик вида задачи получает сессию и параметры задачи
+    и сам фиксирует свои изменения.
+    """
+
+    def __init__(
+            self,
+            my_session: SessionSource,
+            workers: int = JOBS_WORKERS,
+            executor: str = JOBS_EXECUTOR,
+            executor_workers: int = JOBS_EXECUTOR_WORKERS,
+            poll_interval: float = JOBS_POLL_INTERVAL,
+            max_attempts: int = JOBS_MAX_ATTEMPTS,
+            backoff: float = JOBS_BACKOFF,
+            backoff_max: float = JOBS_BACKOFF_MAX,
+            lease: float = JOBS_LEASE,
+            clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.my_session = my_session
+        self.workers = workers
+        self.executor_kind = executor
+        self.executor_workers = executor_workers
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.lease = lease
+        self.clock = clock
+        self.handlers: Dict[str, Handler] = {}
+        self.async_handlers: Dict[str, AsyncHandler] = {}
+        self._stats = dict.fromkeys(
+            ('enqueued', 'completed', 'retried', 'failed', 'ready',
+             'computed', 'wait_ms_total', 'wait_ms_max', 'run_ms_total'),
+            0)
+        self._executor: Optional[Executor] = None
+        self._running: Set['asyncio.Task[None]'] = set()
+        self._dispatcher: Optional['asyncio.Task[None]'] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._claim_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    def register(self, kind: str, handler: Handler) -> None:
+        """Назначает обработчик задач вида kind"""
+        self.handlers[kind] = handler
+
+    def register_async(self, kind: str, handler: AsyncHandler) -> None:
+        """
+        Назначает асинхронный обработчик задач вида kind.
+        Он выполняется в цикле событий с сессией любого режима
+        и сам передаёт работу с БД в run_in_session, а ввод-вывод
+        и вычисления - в пулы потоков и процессов. Такие задачи
+        выполняет только запущенный диспетчер, не run_pending.
+        """
+        self.async_handlers[kind] = handler
+
+    def enqueue(self, my_session: Session, kind: str,
+                payload: Dict[str, Any], delay: float = 0) -> None:
+        """
+        Добавляет задачу в сессию. Задача появится в очереди
+        вместе с фиксацией транзакции вызывающего.
+        """
+        now = self.clock()
+        my_session.execute(insert(Job).values(
+            kind=kind, payload=payload, state=QUEUED,
+            created_at=now, run_at=now + delay))
+        self._count('enqueued')
+
+    def wake(self) -> None:
+        """Сообщает диспетчеру о новых задачах. Вызывается из любого потока"""
+        loop, wakeup = self._loop, self._wakeup
+        if loop is not None and wakeup is not None:
+            loop.call_soon_threadsafe(wakeup.set)
+
+    def executor(self) -> Executor:
+        """
+        Пул вычислений, создаётся при первом обращении. Процессы
+        пула запускаются через forkserver: fork многопоточного
+        процесса приложения может зависнуть.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    self.executor_workers,
+                    mp_context=multiprocessing.get_context('forkserver'),
+                ) if self.executor_kind == 'process' \
+                    else ThreadPoolExecutor(self.executor_workers)
+            return self._executor
+
+    async def compute(self, func: Callable[..., T], *args: Any) -> T:
+        """
+        Выполняет func(*args) в пуле вычислений, не занимая цикл
+        событий. Для пула процессов функция и аргументы должны
+        сериализоваться pickle.
+        """
+        self._count('computed')
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor(), func, *args)
+
+    def claim(self, my_session: Session, limit: int) -> List[ClaimedJob]:
+        """
+        Забирает до limit готовых задач, включая задачи с истёкшим
+        сроком выполнения, и обновляет число оставшихся готовых задач
+        """
+        now = self.clock()
+        postgres = my_session.get_bind().dialect.name == 'postgresql'
+        # Postgres пропускает строки, забираемые другими исполнителями
+        lock: Union[threading.Lock, nullcontext[None]] = \
+            nullcontext() if postgres else self._claim_lock
+        with lock:
+            rows = my_session.execute(self.claim_statement(
+                now, limit, skip_locked=postgres)).all()
+            my_session.commit()
+        ready = my_session.scalar(
+            select(func.count()).select_from(Job).where(self._due(now))) \
+            if len(rows) == limit else 0
+        with self._lock:
+            self._stats['ready'] = ready or 0
+        return [ClaimedJob(*row) for row in rows]
+
+    def claim_statement(self, now: float, limit: int,
+                        skip_locked: bool) -> ReturningUpdate[Any]:
+        """
+        UPDATE, переводящий до limit готовых задач в running
+        и возвращающий их. skip_locked пропускает строки,
+        заблокированные другими транзакциями.
+        """
+        candidates = select(Job.id).where(self._due(now)) \
+            .order_by(Job.run_at, Job.id).limit(limit)
+        if skip_locked:
+            candidates = candidates.with_for_update(skip_locked=True)
+        return update(Job).where(Job.id.in_(candidates)) \
+            .values(state=RUNNING, locked_at=now,
+                    attempts=Job.attempts + 1) \
+            .returning(Job.id, Job.kind, Job.payload, Job.attempts,
+                       Job.created_at) \
+            .execution_options(synchronize_session=False)
+
+    def _due(self, now: float) -> ColumnElement[bool]:
+        """Условие готовности задачи к выполнению"""
+        return or_(and_(Job.state == QUEUED, Job.run_at <= now),
+                   and_(Job.state == RUNNING,
+                        Job.locked_at < now - self.lease))
+
+    def process(self, my_session: Session, job: ClaimedJob) -> bool:
+        """
+        Выполняет задачу синхронным обработчиком и удаляет её
+        из очереди. При ошибке назначает повтор.
+        Возвращает признак успеха.
+        """
+        started = self._begin(job)
+        try:
+            self._check_attempts(job)
+            self.handlers[job.kind](my_session, job.payload)
+            self._complete(my_session, job)
+        except Exception as exc:
+            self._fail(my_session, job, exc)
+            return False
+        finally:
+            self._count('run_ms_total', (self.clock() - started) * 1000)
+        self._count('completed')
+        return True
+
+    async def process_async(self, my_session: AnySession,
+                            job: ClaimedJob) -> bool:
+        """
+        Выполняет задачу асинхронным обработчиком, если он назначен,
+        иначе синхронным через run_in_session
+        """
+        handler = self.async_handlers.get(job.kind)
+        if handler is None:
+            return await run_in_session(my_session, self.process, job)
+        started = self._begin(job)
+        try:
+            self._check_attempts(job)
+            await handler(my_session, job.payload)
+            await run_in_session(my_session, self._complete, job)
+        except Exception as exc:
+            await run_in_session(my_session, self._fail, job, exc)
+            return False
+        finally:
+            self._count('run_ms_total', (self.clock() - started) * 1000)
+        self._count('completed')
+        return True
+
+    def _begin(self, job: ClaimedJob) -> float:
+        """Учитывает ожидание задачи и возвращает момент начала"""
+        started = self.clock()
+        self._observe_wait(started - job.created_at)
+        return started
+
+    def _check_attempts(self, job: ClaimedJob) -> None:
+        if job.attempts > self.max_attempts:
+            raise TimeoutError('Job lease expired too many times')
+
+    def _complete(self, my_session: Session, job: ClaimedJob) -> None:
+        """Удаляет выполненную задачу из очереди"""
+        my_session.execute(
+            delete(Job).where(cast(ColumnElement[bool], job.id == Job.id))
+            .execution_options(synchronize_session=False))
+        my_session.commit()
+
+    def _fail(self, my_session: Session, job: ClaimedJob,
+              exc: Exception) -> None:
+        """Откатывает изменения упавшей задачи и назначает повтор"""
+        my_session.rollback()
+        logger.error('Job %s (%s) failed', job.id, job.kind, exc_info=exc)
+        self._retry(my_session, job, exc)
+
+    def _retry(self, my_session: Session, job: ClaimedJob,
+               exc: Exception) -> None:
+        """Возвращает задачу в очередь с задержкой или помечает failed"""
+        error = f'{type(exc).__name__}: {exc}'[:MAX_ERROR_LENGTH]
+        if job.attempts >= self.max_attempts:
+            values: Dict[str, Any] = {'state': FAILED}
+            self._count('failed')
+        else:
+            delay = min(self.backoff * 2 ** (job.attempts - 1),
+                        self.backoff_max)
+            values = {'state': QUEUED, 'run_at': self.clock() + delay}
+            self._count('retried')
+        my_session.execute(
+            update(Job).where(cast(ColumnElement[bool], job.id == Job.id))
+            .values(last_error=error, locked_at=None, **values)
+            .execution_options(synchronize_session=False))
+        my_session.commit()
+
+    def run_pending(self, my_session: Session) -> int:
+        """Выполняет готовые задачи по одной, пока они есть"""
+        processed = 0
+        while True:
+            jobs = self.claim(my_session, 1)
+            if not jobs:
+                return processed
+            self.process(my_session, jobs[0])
+            processed += 1
+
+    async def start(self) -> None:
+        """Запускает диспетчер задач в текущем цикле событий"""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+    async def stop(self) -> None:
+        """
+        Останавливает диспетчер и дожидается выполняющихся задач.
+        Задачи, не начатые до остановки, остаются в очереди.
+        """
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+        await asyncio.gather(*self._running, return_exceptions=True)
+        self._loop = self._wakeup = None
+        self.close()
+
+    def close(self) -> None:
+        """Останавливает пул вычислений"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _dispatch(self) -> None:
+        """
+        Забирает задачи по числу свободных исполнителей и ждёт
+        сигнала или интервала опроса, когда задач или исполнителей нет
+        """
+        wakeup = self._wakeup
+        assert wakeup is not None
+        while True:
+            wakeup.clear()
+            free = self.workers - len(self._running)
+            # Забраны задачи на всех свободных исполнителей:
+            # в очереди могут быть ещё задачи
+            if free > 0 and await self._claim_and_run(free) == free:
+                continue
+            await _wait(wakeup, self.poll_interval)
+
+    async def _claim_and_run(self, limit: int) -> int:
+        """Забирает задачи и запускает их выполнение"""
+        try:
+            async with any_session_scope(self.my_session) as session:
+                jobs = await run_in_session(session, self.claim, limit)
+        except Exception:
+            logger.exception('Failed to claim jobs')
+            return 0
+        for job in jobs:
+            task = asyncio.ensure_future(self._run(job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+        return len(jobs)
+
+    async def _run(self, job: ClaimedJob) -> None:
+        """Выполняет задачу в отдельной сессии и будит диспетчер"""
+        try:
+            async with any_session_scope(self.my_session) as session:
+                await self.process_async(session, job)
+        except Exception:
+            logger.exception('Job %s (%s) was not finished', job.id, job.kind)
+        finally:
+            if self._wakeup is not None:
+                self._wakeup.set()
+
+    def _observe_wait(self, seconds: float) -> None:
+        milliseconds = int(max(seconds, 0) * 1000)
+        with self._lock:
+            self._stats['wait_ms_total'] += milliseconds
+            self._stats['wait_ms_max'] = max(self._stats['wait_ms_max'],
+                                             milliseconds)
+
+    def _count(self, name: str, delta: float = 1) -> None:
+        with self._lock:
+            self._stats[name] += int(delta)
+
+    def statistics(self) -> Dict[str, int]:
+        """
+        Возвращает число добавленных, выполненных, повторённых
+        и окончательно упавших задач, число готовых задач
+        при последней выборке, выполняющихся задач, вычислений
+        в пуле и время ожидания и выполнения задач в миллисекундах
+        """
+        with self._lock:
+            return dict(self._stats, running=len(self._running))
+
+
+async def _wait(event: asyncio.Event, timeout: float) -> None:
+    """Ждёт события не дольше timeout секунд"""
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
@@ -1,11 +1,32 @@
 from fastapi import FastAPI
+from sqlalchemy.ext.asyncio import async_sessionmaker
 
-from backend_server.database import Base, engine, session
+from backend_server.counters import reconcile_counters
+from backend_server.database import (
+    DB_ASYNC,
+    Base,
+    Session,
+    engine,
+    make_async_engine,
+    session_scope,
+)
 from backend_server.fastapi_api import create_app, input_test_data
-from backend_server.routes import connect_routes
+from backend_server.media_storage import (
+    make_media_storage,
+    migrate_legacy_media,
+)
+from backend_server.migrations import upgrade_schema
 
-application: FastAPI = create_app()
-connect_routes(app=application, my_session=session)
-input_test_data(base=Base,
-                sqlalchemy_session=session,
-                sqlalchemy_engine=engine)
+media_storage = make_media_storage()
+upgrade_schema(engine)
+with session_scope(Session) as seed_session:
+    input_test_data(base=Base,
+                    sqlalchemy_session=seed_session,
+                    sqlalchemy_engine=engine)
+    migrate_legacy_media(seed_session, media_storage)
+    reconcile_counters(seed_session)
+application: FastAPI = create_app(
+    my_session=async_sessionmaker(make_async_engine()) if DB_ASYNC
+    else Session,
+    media_storage=media_storage,
+)
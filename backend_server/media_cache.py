@@ -0,0 +1,127 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple, Union
+
+from backend_server.media_storage import MediaFile, MediaStorage, etag_for
+
+MEDIA_CACHE_BYTES = int(os.environ.get('MEDIA_CACHE_BYTES', 64 * 1024 ** 2))
+MEDIA_CACHE_ITEM_BYTES = int(os.environ.get('MEDIA_CACHE_ITEM_BYTES',
+                                            1024 ** 2))
+# Сколько ETag медиафайлов помнить отдельно от кэша содержимого
+MEDIA_ETAG_ENTRIES = int(os.environ.get('MEDIA_ETAG_ENTRIES', '65536'))
+# Учитываемый размер записи без содержимого (только метаданные)
+ENTRY_OVERHEAD = 128
+
+# Ключ записи: id медиафайла или (id, имя варианта изображения)
+MediaKey = Union[int, Tuple[int, str]]
+
+
+class MediaCache:
+    """
+    LRU-кэш медиафайлов в памяти процесса с ограничением по байтам.
+    Медиафайлы неизменяемы, поэтому записи не нужно инвалидировать.
+    Содержимое больших файлов не кэшируется, для них хранятся только
+    метаданные, чтобы отвечать на условные запросы без обращения к БД.
+    Большие файлы, ещё не перенесённые в хранилище, не кэшируются.
+    ETag отдельно помнятся для большего числа файлов, чем
+    умещается в бюджет байтов, чтобы условные запросы к вытесненным
+    файлам не читали БД и содержимое.
+    """
+
+    def __init__(self, max_bytes: int = MEDIA_CACHE_BYTES,
+                 max_item_bytes: int = MEDIA_CACHE_ITEM_BYTES,
+                 max_etags: int = MEDIA_ETAG_ENTRIES) -> None:
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self.max_etags = max_etags
+        self.hits = 0
+        self.misses = 0
+        self.etag_hits = 0
+        self._entries: OrderedDict[MediaKey, MediaFile] = OrderedDict()
+        # Ключ записи -> sha256 содержимого
+        self._etags: OrderedDict[MediaKey, str] = OrderedDict()
+        self._used_bytes = 0
+        self._lock = threading.Lock()
+
+    def etag(self, media_id: MediaKey) -> Optional[str]:
+        """Возвращает ETag медиафайла, если он известен"""
+        with self._lock:
+            sha256 = self._etags.get(media_id)
+            if sha256 is None:
+                return None
+            self.etag_hits += 1
+            self._etags.move_to_end(media_id)
+            return etag_for(sha256)
+
+    def remember(self, media_id: MediaKey, sha256: str) -> None:
+        """Запоминает ETag медиафайла, вытесняя давно не использованные"""
+        with self._lock:
+            self._remember(media_id, sha256)
+
+    def _remember(self, media_id: MediaKey, sha256: str) -> None:
+        self._etags[media_id] = sha256
+        self._etags.move_to_end(media_id)
+        while len(self._etags) > self.max_etags:
+            self._etags.popitem(last=False)
+
+    def get(self, media_id: MediaKey) -> Optional[MediaFile]:
+        """Возвращает запись кэша и отмечает её как недавно использованную"""
+        with self._lock:
+            media = self._entries.get(media_id)
+            if media is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(media_id)
+            return media
+
+    def fill(self, media_id: MediaKey, media: MediaFile,
+             storage: MediaStorage) -> MediaFile:
+        """
+        Дочитывает содержимое небольшого файла из хранилища
+        и помещает запись в кэш. Возвращает дополненную запись.
+        """
+        if media.content is None and media.size <= self.max_item_bytes:
+            media = media._replace(content=b''.join(
+                storage.read_range(media.sha256, 0, media.size)))
+        if media.content is None or len(media.content) \
+                <= self.max_item_bytes:
+            self.put(media_id, media)
+        elif media.stored:
+            self.put(media_id, media._replace(content=None))
+        return media
+
+    def put(self, media_id: MediaKey, media: MediaFile) -> None:
+        """Добавляет запись, вытесняя давно не использованные записи"""
+        size = self._entry_size(media)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(media_id, None)
+            if previous is not None:
+                self._used_bytes -= self._entry_size(previous)
+            self._entries[media_id] = media
+            self._used_bytes += size
+            self._remember(media_id, media.sha256)
+            while self._used_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._used_bytes -= self._entry_size(evicted)
+
+    def statistics(self) -> Dict[str, int]:
+        """Возвращает счётчики попаданий и заполненность кэша и ETag"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'etag_hits': self.etag_hits,
+                'etags': len(self._etags),
+                'bytes': self._used_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+    @staticmethod
+    def _entry_size(media: MediaFile) -> int:
+        """Размер записи, учитываемый в бюджете кэша"""
+        return ENTRY_OVERHEAD + len(media.content or b'')
@@ -0,0 +1,317 @@
+import hashlib
+import os
+import re
+import tempfile
+from abc import ABC, abstractmethod
+from typing import Any, Iterator, Mapping, NamedTuple, Optional, Tuple
+
+from fastapi import Response
+from fastapi.responses import FileResponse, StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from backend_server.models import Media
+
+MEDIA_STORAGE = os.environ.get('MEDIA_STORAGE', 'local')
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', '/backend_server/media')
+MEDIA_S3_BUCKET = os.environ.get('MEDIA_S3_BUCKET', 'media')
+MEDIA_S3_ENDPOINT = os.environ.get('MEDIA_S3_ENDPOINT')
+MEDIA_S3_PREFIX = os.environ.get('MEDIA_S3_PREFIX', 'media/')
+
+CHUNK_SIZE = 64 * 1024
+# Медиафайлы неизменяемы: клиенты и CDN могут хранить их сколь угодно долго
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class MediaFile(NamedTuple):
+    """Метаданные медиафайла, нужные для его отдачи"""
+    sha256: str
+    size: int
+    # Содержимое, если оно уже в памяти: из кэша процесса
+    # или из столбца media.file у ещё не перенесённых записей
+    content: Optional[bytes] = None
+    # Лежит ли содержимое в хранилище (False для не перенесённых записей)
+    stored: bool = True
+    # Тип содержимого, если он определён при загрузке
+    mime: Optional[str] = None
+
+
+def blob_key(data: bytes) -> str:
+    """Возвращает ключ блоба - sha256 его содержимого"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def etag_for(key: str) -> str:
+    """Строгий ETag медиафайла по ключу его содержимого"""
+    return f'"{key}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Проверяет, совпадает ли ETag с одним из тегов If-None-Match"""
+    if not if_none_match:
+        return False
+    tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    return etag in tags or '*' in tags
+
+
+def parse_range(
+        range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Разбирает заголовок Range с одним диапазоном байт.
+    Возвращает полуоткрытый интервал [start, end) или None,
+    если заголовок отсутствует, содержит несколько диапазонов
+    или не может быть удовлетворён.
+    """
+    match = RANGE_PATTERN.match(range_header.strip()) if range_header \
+        else None
+    if match is None or match.groups() == ('', ''):
+        return None
+    start_text, end_text = match.groups()
+    if not start_text:
+        start, end = max(size - int(end_text), 0), size
+    else:
+        start = int(start_text)
+        end = min(int(end_text) + 1, size) if end_text else size
+    if start >= end:
+        return None
+    return start, end
+
+
+class MediaStorage(ABC):
+    """
+    Хранилище содержимого медиафайлов с адресацией по sha256.
+    Одинаковые загрузки хранятся в единственном экземпляре,
+    таблица media хранит только метаданные.
+    """
+
+    def put(self, data: bytes) -> str:
+        """Сохраняет содержимое, если его ещё нет. Возвращает ключ"""
+        key = blob_key(data)
+        if not self.exists(key):
+            self._write(key, data)
+        return key
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        """Проверяет наличие блоба в хранилище"""
+
+    @abstractmethod
+    def read_range(self, key: str, start: int, end: int) -> Iterator[bytes]:
+        """Читает байты блоба из интервала [start, end) частями"""
+
+    @abstractmethod
+    def _write(self, key: str, data: bytes) -> None:
+        """Записывает блоб под ключом"""
+
+    def response(
+            self,
+            media: MediaFile,
+            media_type: str,
+            request_headers: Mapping[str, str],
+            headers: Mapping[str, str],
+    ) -> Response:
+        """
+        Возвращает потоковый ответ с содержимым блоба.
+        Поддерживает запросы одного диапазона байт (Range).
+        """
+        byte_range = parse_range(request_headers.get('range'), media.size)
+        if request_headers.get('if-range', etag_for(media.sha256)) \
+                != etag_for(media.sha256):
+            byte_range = None
+        response_headers = {**headers, 'Accept-Ranges': 'bytes'}
+        if byte_range is None:
+            response_headers['Content-Length'] = str(media.size)
+            return StreamingResponse(
+                self.read_range(media.sha256, 0, media.size),
+                media_type=media_type, headers=response_headers,
+            )
+        start, end = byte_range
+        response_headers['Content-Range'] = \
+            f'bytes {start}-{end - 1}/{media.size}'
+        response_headers['Content-Length'] = str(end - start)
+        return StreamingResponse(
+            self.read_range(media.sha256, start, end),
+            status_code=206, media_type=media_type, headers=response_headers,
+        )
+
+
+def content_response(
+        media: MediaFile,
+        media_type: str,
+        request_headers: Mapping[str, str],
+        headers: Mapping[str, str],
+) -> Response:
+    """Отдаёт содержимое, уже прочитанное в память, с поддержкой Range"""
+    content = media.content or b''
+    byte_range = parse_range(request_headers.get('range'), len(content))
+    if byte_range is None:
+        return Response(content=content, media_type=media_type,
+                        headers={**headers, 'Accept-Ranges': 'bytes'})
+    start, end = byte_range
+    return Response(
+        content=content[start:end], status_code=206, media_type=media_type,
+        headers={**headers, 'Accept-Ranges': 'bytes',
+                 'Content-Range': f'bytes {start}-{end - 1}/{len(content)}'},
+    )
+
+
+def not_modified(etag: str) -> Response:
+    """Ответ 304 на условный запрос медиафайла"""
+    return Response(status_code=304, headers={'ETag': etag,
+                                              'Cache-Control': CACHE_CONTROL})
+
+
+def media_response(
+        media: MediaFile,
+        storage: MediaStorage,
+        media_type: str,
+        request_headers: Mapping[str, str],
+) -> Response:
+    """
+    Формирует ответ с медиафайлом: 304 на совпадающий If-None-Match,
+    содержимое из памяти, если оно есть, иначе поток из хранилища.
+    """
+    etag = etag_for(media.sha256)
+    if etag_matches(request_headers.get('if-none-match'), etag):
+        return not_modified(etag)
+    headers = {'ETag': etag, 'Cache-Control': CACHE_CONTROL}
+    if media.content is not None:
+        return content_response(media, media_type, request_headers, headers)
+    return storage.response(media, media_type, request_headers, headers)
+
+
+class LocalMediaStorage(MediaStorage):
+    """Хранилище блобов в каталоге локального диска"""
+
+    def __init__(self, root: str = MEDIA_ROOT) -> None:
+        self.root = root
+
+    def path(self, key: str) -> str:
+        """Путь к файлу блоба, разложенный по подкаталогам"""
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def read_range(self, key: str, start: int, end: int) -> Iterator[bytes]:
+        with open(self.path(key), 'rb') as blob:
+            blob.seek(start)
+            while start < end:
+                chunk = blob.read(min(CHUNK_SIZE, end - start))
+                if not chunk:
+                    break
+                start += len(chunk)
+                yield chunk
+
+    def response(
+            self,
+            media: MediaFile,
+            media_type: str,
+            request_headers: Mapping[str, str],
+            headers: Mapping[str, str],
+    ) -> Response:
+        """Отдаёт файл блоба с диска, Range обрабатывает FileResponse"""
+        return FileResponse(self.path(media.sha256),
+                            media_type=media_type, headers=headers)
+
+    def _write(self, key: str, data: bytes) -> None:
+        """Пишет во временный файл и атомарно переименовывает его"""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+class S3MediaStorage(MediaStorage):
+    """
+    Хранилище блобов в S3-совместимом объектном хранилище.
+    Принимает клиент с интерфейсом boto3 (put_object, head_object,
+    get_object), что позволяет подменить его локальной реализацией.
+    """
+
+    def __init__(self, client: Any, bucket: str = MEDIA_S3_BUCKET,
+                 prefix: str = MEDIA_S3_PREFIX) -> None:
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket,
+                                    Key=self.prefix + key)
+        except Exception as exc:
+            if _is_not_found(exc):
+                return False
+            raise
+        return True
+
+    def read_range(self, key: str, start: int, end: int) -> Iterator[bytes]:
+        if start >= end:
+            return
+        blob = self.client.get_object(
+            Bucket=self.bucket, Key=self.prefix + key,
+            Range=f'bytes={start}-{end - 1}',
+        )
+        body = blob['Body']
+        try:
+            while True:
+                chunk = body.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
+
+    def _write(self, key: str, data: bytes) -> None:
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + key,
+                               Body=data)
+
+
+def _is_not_found(exc: Exception) -> bool:
+    """Проверяет, что ошибка клиента S3 означает отсутствие объекта"""
+    error = getattr(exc, 'response', {}).get('Error', {})
+    return str(error.get('Code')) in {'404', 'NoSuchKey', 'NotFound'}
+
+
+def make_media_storage() -> MediaStorage:
+    """Создаёт хранилище медиафайлов по настройкам окружения"""
+    if MEDIA_STORAGE == 's3':
+        try:
+            import boto3  # type: ignore[import-not-found]
+        except ImportError:
+            raise RuntimeError('MEDIA_STORAGE=s3 requires boto3')
+        return S3MediaStorage(
+            boto3.client('s3', endpoint_url=MEDIA_S3_ENDPOINT))
+    return LocalMediaStorage()
+
+
+def migrate_legacy_media(
+        my_session: Session, storage: MediaStorage,
+        batch_size: int = 100) -> int:
+    """
+    Переносит содержимое медиафайлов из столбца media.file в хранилище.
+    Обрабатывает записи пачками, после переноса очищает столбец.
+    Возвращает число перенесённых записей.
+    """
+    migrated = 0
+    while True:
+        medias = my_session.scalars(
+            select(Media).where(Media.sha256.is_(None))
+            .order_by(Media.id).limit(batch_size)
+        ).all()
+        if not medias:
+            return migrated
+        for media in medias:
+            content = media.file or b''
+            media.sha256 = storage.put(content)
+            media.size = len(content)
+            media.file = None
+        my_session.commit()
+        migrated += len(medias)
@@ -0,0 +1,289 @@
+"""
+Тип, размеры и уменьшенные копии изображений.
+
+При загрузке по заголовку файла определяются его тип и размеры,
+они хранятся в таблице media. Уменьшенные копии (варианты)
+строятся после ответа на загрузку в пуле процессов: декодирование
+и масштабирование не занимают GIL процесса приложения и цикл
+событий. Вариант кладётся в то же хранилище, что и оригинал,
+и описывается строкой media_variant. Пока варианта нет, а также
+для изображений, которые не больше варианта, по ссылке варианта
+отдаётся оригинал. С очередью задач варианты строятся задачей
+media_variants и не теряются при перезапуске процесса.
+"""
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Literal,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    cast,
+)
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+from sqlalchemy import ColumnElement, exists, insert, select
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from backend_server.database import (
+    SessionSource,
+    any_session_scope,
+    run_in_session,
+)
+from backend_server.media_storage import MediaStorage
+from backend_server.models import Media, MediaVariant
+
+logger = logging.getLogger(__name__)
+
+# Наибольшая сторона вариантов, пиксели
+MEDIA_THUMB_SIZE = int(os.environ.get('MEDIA_THUMB_SIZE', '150'))
+MEDIA_FEED_SIZE = int(os.environ.get('MEDIA_FEED_SIZE', '1080'))
+# Сколько процессов строят варианты
+MEDIA_PROCESSES = int(os.environ.get('MEDIA_PROCESSES', '2'))
+JPEG_QUALITY = 85
+# Тип медиафайлов, загруженных до определения типа, и не изображений
+DEFAULT_MEDIA_TYPE = 'image/png'
+
+VariantName = Literal['thumb', 'feed']
+VARIANT_SIZES: Dict[str, int] = {
+    'thumb': MEDIA_THUMB_SIZE,
+    'feed': MEDIA_FEED_SIZE,
+}
+# Варианты строятся только для неанимированных растровых форматов
+RESIZABLE_TYPES = frozenset(('image/jpeg', 'image/png', 'image/webp'))
+
+
+class ImageInfo(NamedTuple):
+    """Тип и размеры изображения"""
+    mime: str
+    width: int
+    height: int
+
+
+class RenderedVariant(NamedTuple):
+    """Закодированный вариант изображения"""
+    name: str
+    content: bytes
+    info: ImageInfo
+
+
+# Вариант и ключ его содержимого в хранилище
+StoredVariant = Tuple[RenderedVariant, str]
+# Выполняет функцию с аргументами в пуле вычислений
+Compute = Callable[..., Awaitable[Any]]
+
+
+def sniff_image(data: bytes) -> Optional[ImageInfo]:
+    """
+    Определяет тип и размеры изображения по заголовку файла,
+    не декодируя пиксели. Возвращает None для не изображений
+    и слишком больших изображений.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            mime = Image.MIME.get(image.format or '')
+            width, height = image.size
+    except (UnidentifiedImageError, Image.DecompressionBombError,
+            OSError, ValueError):
+        return None
+    if mime is None:
+        return None
+    return ImageInfo(mime, width, height)
+
+
+def needs_variant(info: Optional[ImageInfo], max_side: int) -> bool:
+    """Строится ли для изображения вариант с наибольшей стороной max_side"""
+    return info is not None and info.mime in RESIZABLE_TYPES \
+        and max(info.width, info.height) > max_side
+
+
+def render_variants(data: bytes,
+                    sizes: Dict[str, int]) -> List[RenderedVariant]:
+    """
+    Строит варианты изображения, которые меньше оригинала.
+    Варианты масштабируются последовательно от большего к меньшему,
+    JPEG декодируется сразу в уменьшенном масштабе. Изображения
+    с прозрачностью кодируются в PNG, остальные в JPEG.
+    Выполняется в пуле процессов, поэтому принимает и возвращает
+    только сериализуемые pickle значения.
+    """
+    rendered = []
+    with Image.open(io.BytesIO(data)) as source:
+        largest = max(sizes.values())
+        source.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(source)
+    alpha = image.mode in ('RGBA', 'LA', 'PA') \
+        or 'transparency' in image.info
+    image = image.convert('RGBA' if alpha else 'RGB')
+    for name, max_side in sorted(sizes.items(), key=lambda item: -item[1]):
+        if max(image.size) <= max_side:
+            continue
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        if alpha:
+            image.save(buffer, 'PNG', optimize=True)
+        else:
+            image.save(buffer, 'JPEG', quality=JPEG_QUALITY,
+                       optimize=True, progressive=True)
+        rendered.append(RenderedVariant(name, buffer.getvalue(), ImageInfo(
+            'image/png' if alpha else 'image/jpeg', *image.size)))
+    return rendered
+
+
+class MediaProcessor:
+    """
+    Строит варианты загруженных изображений в пуле процессов.
+    Без очереди задач построение запускается задачей цикла событий
+    через schedule в собственном пуле, с очередью - асинхронным
+    обработчиком задачи через derive_async в пуле вычислений
+    очереди, и собственный пул не создаётся.
+    """
+
+    def __init__(
+            self,
+            storage: MediaStorage,
+            sizes: Optional[Dict[str, int]] = None,
+            processes: int = MEDIA_PROCESSES,
+    ) -> None:
+        self.storage = storage
+        self.sizes = VARIANT_SIZES if sizes is None else sizes
+        self.processes = processes
+        self._stats = dict.fromkeys(('processed', 'variants', 'failed'), 0)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._tasks: Set['asyncio.Task[None]'] = set()
+        self._lock = threading.Lock()
+
+    def wanted(self, info: Optional[ImageInfo]) -> bool:
+        """Нужен ли изображению хотя бы один вариант"""
+        return any(needs_variant(info, max_side)
+                   for max_side in self.sizes.values())
+
+    def source(self, my_session: Session,
+               media_id: int) -> Optional[Tuple[str, int]]:
+        """
+        Возвращает ключ и размер оригинала, если варианты
+        изображения ещё не построены
+        """
+        row = my_session.execute(
+            select(Media.sha256, Media.size, Media.mime)
+            .where(cast(ColumnElement[bool], media_id == Media.id))
+            .where(~exists().where(cast(ColumnElement[bool],
+                                        media_id == MediaVariant.media_id)))
+        ).one_or_none()
+        if row is None or row.sha256 is None \
+                or row.mime not in RESIZABLE_TYPES:
+            return None
+        return row.sha256, row.size or 0
+
+    def read(self, sha256: str, size: int) -> bytes:
+        """Читает оригинал из хранилища"""
+        return b''.join(self.storage.read_range(sha256, 0, size))
+
+    def executor(self) -> ProcessPoolExecutor:
+        """
+        Пул процессов, создаётся при первом обращении. Процесс
+        приложения уже многопоточный, а fork такого процесса может
+        зависнуть на захваченной другим потоком блокировке,
+        поэтому процессы пула запускаются через forkserver.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    self.processes,
+                    mp_context=multiprocessing.get_context('forkserver'))
+            return self._executor
+
+    def put(self, rendered: List[RenderedVariant]) -> List[StoredVariant]:
+        """Сохраняет содержимое вариантов в хранилище"""
+        return [(variant, self.storage.put(variant.content))
+                for variant in rendered]
+
+    def save(self, my_session: Session, media_id: int,
+             stored: List[StoredVariant]) -> int:
+        """Записывает метаданные сохранённых вариантов"""
+        if stored:
+            my_session.execute(insert(MediaVariant), [{
+                'media_id': media_id, 'name': variant.name, 'sha256': sha256,
+                'size': len(variant.content), 'mime': variant.info.mime,
+                'width': variant.info.width, 'height': variant.info.height,
+            } for variant, sha256 in stored])
+            my_session.commit()
+        self._count('processed')
+        self._count('variants', len(stored))
+        return len(stored)
+
+    async def compute(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Выполняет func(*args) в собственном пуле процессов"""
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor(), func, *args)
+
+    async def derive_async(self, my_session: SessionSource, media_id: int,
+                           compute: Optional[Compute] = None) -> int:
+        """
+        Строит варианты изображения, не занимая цикл событий:
+        чтение и запись хранилища идут в пуле потоков,
+        масштабирование - в пуле compute, по умолчанию собственном
+        """
+        async with any_session_scope(my_session) as session:
+            source = await run_in_session(session, self.source, media_id)
+            if source is None:
+                return 0
+            data = await run_in_threadpool(self.read, *source)
+            rendered: List[RenderedVariant] = await (
+                compute or self.compute)(render_variants, data, self.sizes)
+            stored = await run_in_threadpool(self.put, rendered)
+            return await run_in_session(session, self.save, media_id, stored)
+
+    def schedule(self, my_session: SessionSource, media_id: int) -> None:
+        """Запускает построение вариантов в фоне текущего цикла событий"""
+        task = asyncio.ensure_future(self._derive_logged(my_session, media_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _derive_logged(self, my_session: SessionSource,
+                             media_id: int) -> None:
+        try:
+            await self.derive_async(my_session, media_id)
+        except Exception:
+            self._count('failed')
+            logger.exception('Failed to build variants of media %s', media_id)
+
+    async def join(self) -> None:
+        """Дожидается построений, запущенных через schedule"""
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def stop(self) -> None:
+        """Дожидается фоновых построений и останавливает пул процессов"""
+        await self.join()
+        self.close()
+
+    def close(self) -> None:
+        """Останавливает пул процессов"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _count(self, name: str, delta: int = 1) -> None:
+        with self._lock:
+            self._stats[name] += delta
+
+    def statistics(self) -> Dict[str, int]:
+        """
+        Возвращает число обработанных изображений, построенных
+        вариантов, ошибок и построений в фоне
+        """
+        with self._lock:
+            return {**self._stats, 'pending': len(self._tasks)}
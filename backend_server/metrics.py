@@ -0,0 +1,320 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Pattern,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from backend_server.database import pool_statistics
+
+# Метрики собираются по умолчанию, METRICS=0 отключает их
+METRICS = os.environ.get('METRICS', '1') == '1'
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+UNMATCHED_ROUTE = '<unmatched>'
+SQL_STARTED_KEY = 'metrics_sql_started'
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+Labels = Tuple[str, ...]
+Scope = MutableMapping[str, Any]
+Message = MutableMapping[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+ASGIApp = Callable[[Scope, Receive, Send], Awaitable[None]]
+StatsSource = Callable[[], Mapping[str, Mapping[str, Union[int, float]]]]
+
+
+class Histogram:
+    """
+    Гистограмма Prometheus с метками: счётчики попаданий в интервалы,
+    сумма и число наблюдений. Безопасна для вызова из любого потока.
+    """
+
+    def __init__(self, name: str, description: str,
+                 label_names: Sequence[str],
+                 buckets: Sequence[float]) -> None:
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Labels, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: Labels, value: float) -> None:
+        """
+        Учитывает наблюдение. Ряд хранит счётчики интервалов,
+        затем сумму и число наблюдений.
+        """
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = \
+                    [0.0] * (len(self.buckets) + 2)
+            # Наблюдения больше последней границы попадают только в +Inf
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> Iterable[str]:
+        """Строки гистограммы в текстовом формате Prometheus"""
+        yield f'# HELP {self.name} {self.description}'
+        yield f'# TYPE {self.name} histogram'
+        with self._lock:
+            snapshot = {labels: list(series)
+                        for labels, series in self._series.items()}
+        for labels, series in sorted(snapshot.items()):
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield self._line('_bucket', labels, cumulative,
+                                 ('le', format_value(bound)))
+            yield self._line('_bucket', labels, series[-1], ('le', '+Inf'))
+            yield self._line('_sum', labels, series[-2])
+            yield self._line('_count', labels, series[-1])
+
+    def _line(self, suffix: str, labels: Labels, value: float,
+              *extra: Tuple[str, str]) -> str:
+        pairs = list(zip(self.label_names, labels)) + list(extra)
+        return f'{self.name}{suffix}{format_labels(pairs)} ' \
+            f'{format_value(value)}'
+
+
+class Counter:
+    """Счётчик или шкала Prometheus с метками"""
+
+    def __init__(self, name: str, description: str,
+                 label_names: Sequence[str], kind: str = 'counter') -> None:
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.kind = kind
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, labels: Labels, delta: float = 1) -> None:
+        """Прибавляет delta к значению с метками labels"""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + delta
+
+    def render(self) -> Iterable[str]:
+        """Строки метрики в текстовом формате Prometheus"""
+        yield f'# HELP {self.name} {self.description}'
+        yield f'# TYPE {self.name} {self.kind}'
+        with self._lock:
+            snapshot = sorted(self._values.items())
+        for labels, value in snapshot:
+            yield f'{self.name}' \
+                f'{format_labels(zip(self.label_names, labels))} ' \
+                f'{format_value(value)}'
+
+
+def format_value(value: float) -> str:
+    """Число в формате Prometheus: целые без дробной части"""
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def format_labels(pairs: Iterable[Tuple[str, str]]) -> str:
+    """Набор меток {name="value"} с экранированием значений"""
+    escaped = [
+        f'{name}="' + value.replace('\\', '\\\\').replace('"', '\\"')
+        .replace('\n', '\\n') + '"'
+        for name, value in pairs
+    ]
+    return '{' + ','.join(escaped) + '}' if escaped else ''
+
+
+class RequestSql:
+    """SQL-запросы текущего HTTP-запроса: число и время"""
+    __slots__ = ('count', 'duration')
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.duration = 0.0
+
+
+_request_sql: ContextVar[Optional[RequestSql]] = ContextVar(
+    'request_sql', default=None)
+
+
+class Metrics:
+    """
+    Метрики процесса: задержки, статусы и число выполняющихся
+    запросов по шаблонам роутов, число и время SQL-запросов
+    на HTTP-запрос, состояние пула соединений и статистика кэшей.
+    """
+
+    def __init__(self) -> None:
+        route_labels = ('method', 'route')
+        self.latency = Histogram(
+            'http_request_duration_seconds', 'HTTP request latency',
+            route_labels, LATENCY_BUCKETS)
+        self.responses = Counter(
+            'http_responses_total', 'HTTP responses by status code',
+            route_labels + ('status', ))
+        self.in_flight = Counter(
+            'http_requests_in_flight', 'HTTP requests being served',
+            route_labels, kind='gauge')
+        self.sql_queries = Histogram(
+            'db_queries_per_request', 'SQL statements per HTTP request',
+            route_labels, QUERY_BUCKETS)
+        self.sql_time = Histogram(
+            'db_time_per_request_seconds', 'SQL time per HTTP request',
+            route_labels, LATENCY_BUCKETS)
+        self.engines: List[Engine] = []
+        self.stats_sources: Dict[str, StatsSource] = {}
+
+    def instrument_engine(self, sqlalchemy_engine: Engine) -> None:
+        """Подписывается на выполнение SQL-запросов двигателя"""
+        if sqlalchemy_engine not in self.engines:
+            self.engines.append(sqlalchemy_engine)
+        # Обработчики общие для всех приложений процесса:
+        # запрос, к которому относится SQL, определяет контекст
+        for name, listener in (('before_cursor_execute',
+                                _before_cursor_execute),
+                               ('after_cursor_execute',
+                                _after_cursor_execute)):
+            if not event.contains(sqlalchemy_engine, name, listener):
+                event.listen(sqlalchemy_engine, name, listener)
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        lines: List[str] = []
+        for metric in (self.latency, self.responses, self.in_flight,
+                       self.sql_queries, self.sql_time):
+            lines.extend(metric.render())
+        lines.extend(self._render_pools())
+        lines.extend(self._render_stats())
+        return '\n'.join(lines) + '\n'
+
+    def _render_pools(self) -> Iterable[str]:
+        yield '# HELP db_pool Connection pool statistics'
+        yield '# TYPE db_pool gauge'
+        for index, sqlalchemy_engine in enumerate(self.engines):
+            for name, value in pool_statistics(sqlalchemy_engine).items():
+                yield 'db_pool' + format_labels(
+                    [('engine', str(index)), ('stat', name)]) + \
+                    f' {format_value(value)}'
+
+    def _render_stats(self) -> Iterable[str]:
+        ratios = []
+        yield '# HELP component_stat Cache and component statistics'
+        yield '# TYPE component_stat gauge'
+        for source in self.stats_sources.values():
+            for component, stats in source().items():
+                for name, value in stats.items():
+                    yield 'component_stat' + format_labels(
+                        [('component', component), ('stat', name)]) + \
+                        f' {format_value(value)}'
+                lookups = stats.get('hits', 0) + stats.get('misses', 0)
+                if 'hits' in stats and lookups:
+                    ratios.append((component, stats['hits'] / lookups))
+        yield '# HELP cache_hit_ratio Cache hits to lookups'
+        yield '# TYPE cache_hit_ratio gauge'
+        for component, ratio in ratios:
+            yield 'cache_hit_ratio' + format_labels(
+                [('cache', component)]) + f' {format_value(ratio)}'
+
+
+def _before_cursor_execute(conn: Any, *args: Any) -> None:
+    if _request_sql.get() is not None:
+        conn.info[SQL_STARTED_KEY] = time.perf_counter()
+
+
+def _after_cursor_execute(conn: Any, *args: Any) -> None:
+    request_sql = _request_sql.get()
+    started = conn.info.pop(SQL_STARTED_KEY, None)
+    if request_sql is not None and started is not None:
+        request_sql.count += 1
+        request_sql.duration += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware сбора метрик HTTP-запросов.
+    Шаблон роута определяется до обработки запроса,
+    чтобы учитывать выполняющиеся запросы по роутам.
+    """
+
+    def __init__(self, app: ASGIApp, metrics: Metrics,
+                 routes: Callable[[], Sequence[Any]]) -> None:
+        self.app = app
+        self.metrics = metrics
+        self.routes = routes
+        # Регулярные выражения путей роутов, пересобираются
+        # при подключении новых роутов
+        self._patterns: List[Tuple[Pattern[str], Optional[Set[str]],
+                                   str]] = []
+        self._routes_count = 0
+
+    async def __call__(self, scope: Scope, receive: Receive,
+                       send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        labels = (scope['method'], self._route(scope))
+        status = ['500']
+
+        async def send_status(message: Message) -> None:
+            if message['type'] == 'http.response.start':
+                status[0] = str(message['status'])
+            await send(message)
+
+        request_sql = RequestSql()
+        token = _request_sql.set(request_sql)
+        self.metrics.in_flight.add(labels)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            self.metrics.latency.observe(labels,
+                                         time.perf_counter() - started)
+            self.metrics.in_flight.add(labels, -1)
+            self.metrics.responses.add(labels + (status[0], ))
+            self.metrics.sql_queries.observe(labels, request_sql.count)
+            self.metrics.sql_time.observe(labels, request_sql.duration)
+            _request_sql.reset(token)
+
+    def _route(self, scope: Scope) -> str:
+        """
+        Шаблон пути роута, которому соответствует запрос.
+        Если метод не подходит ни к одному роуту пути,
+        берётся первый роут с подходящим путём.
+        """
+        routes = self.routes()
+        if len(routes) != self._routes_count:
+            self._routes_count = len(routes)
+            self._patterns = [
+                (route.path_regex, getattr(route, 'methods', None),
+                 str(route.path))
+                for route in routes if hasattr(route, 'path_regex')]
+        path, method = scope['path'], scope['method']
+        partial = UNMATCHED_ROUTE
+        for path_regex, methods, template in self._patterns:
+            if not path_regex.match(path):
+                continue
+            if methods is None or method in methods:
+                return template
+            if partial == UNMATCHED_ROUTE:
+                partial = template
+        return partial
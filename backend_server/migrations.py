@@ -0,0 +1,54 @@
+from typing import Dict
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine.base import Connection, Engine
+
+# Импорт моделей регистрирует их таблицы и индексы в Base.metadata
+import backend_server.models  # noqa: F401
+from backend_server.database import Base
+
+# Столбцы, добавленные в существующие таблицы после первого релиза:
+# таблица -> {столбец: тип DDL}
+ADDED_COLUMNS: Dict[str, Dict[str, str]] = {
+    'media': {'sha256': 'VARCHAR(64)', 'size': 'INTEGER',
+              'mime': 'VARCHAR(50)', 'width': 'INTEGER', 'height': 'INTEGER'},
+    'tweet': {'like_count': 'INTEGER NOT NULL DEFAULT 0'},
+    'user': {'followers_count': 'INTEGER NOT NULL DEFAULT 0',
+             'following_count': 'INTEGER NOT NULL DEFAULT 0'},
+}
+
+
+def upgrade_schema(sqlalchemy_engine: Engine) -> None:
+    """
+    Доводит схему существующей БД до текущих моделей.
+    create_all создаёт только отсутствующие таблицы, поэтому
+    новые столбцы и индексы добавляются здесь.
+    Повторный вызов ничего не меняет.
+    """
+    inspector = inspect(sqlalchemy_engine)
+    tables = set(inspector.get_table_names())
+    with sqlalchemy_engine.begin() as connection:
+        for table, columns in ADDED_COLUMNS.items():
+            if table in tables:
+                existing = {
+                    column['name'] for column in inspector.get_columns(table)
+                }
+                _add_columns(connection, table, {
+                    column: ddl_type for column, ddl_type in columns.items()
+                    if column not in existing
+                })
+        for table_name in tables & set(Base.metadata.tables):
+            for index in Base.metadata.tables[table_name].indexes:
+                index.create(connection, checkfirst=True)
+        if 'media' in tables \
+                and sqlalchemy_engine.dialect.name == 'postgresql':
+            connection.execute(text(
+                'ALTER TABLE media ALTER COLUMN file DROP NOT NULL'))
+
+
+def _add_columns(
+        connection: Connection, table: str, columns: Dict[str, str]) -> None:
+    """Добавляет в таблицу недостающие столбцы"""
+    for column, ddl_type in columns.items():
+        connection.execute(text(
+            f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl_type}'))
@@ -1,19 +1,28 @@
-from typing import List
+from typing import Any, List
 
 from sqlalchemy import (
     JSON,
     Column,
+    Float,
     ForeignKey,
+    Index,
     Integer,
     LargeBinary,
     PrimaryKeyConstraint,
     String,
+    func,
+    literal_column,
 )
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.orm import Mapped, relationship
+from sqlalchemy.sql.elements import ColumnClause
 
 from backend_server.database import Base
 
+# Конфигурация полнотекстового поиска Postgres: simple не зависит
+# от языка твитов, см. backend_server.search
+SEARCH_CONFIG: ColumnClause[Any] = literal_column("'simple'::regconfig")
+
 
 class User(Base):
     __tablename__ = 'user'
@@ -21,6 +30,11 @@ class User(Base):
     id = Column(Integer, primary_key=True)
     api_key = Column(String(50), nullable=False, unique=True)
     name = Column(String(50), nullable=False)
+    # Денормализованные счётчики, см. backend_server.counters
+    followers_count = Column(Integer, nullable=False, default=0,
+                             server_default='0')
+    following_count = Column(Integer, nullable=False, default=0,
+                             server_default='0')
     tweets: Mapped[List['Tweet']] = relationship(back_populates='author')
     liked_tweets: Mapped[List['Tweet']] = relationship(
         secondary='like', back_populates='users_who_liked'
@@ -46,10 +60,23 @@ class Tweet(Base):
     content = Column(String, nullable=False)
     media_ids = Column(JSON)
     user_id = Column(Integer, ForeignKey('user.id'))
+    __table_args__ = (
+        # Твиты автора от новых к старым: лента и профиль без сортировки
+        Index('ix_tweet_user_id_id', user_id, id.desc()),
+        # Полнотекстовый поиск по содержимому, только в Postgres
+        Index('ix_tweet_content_tsv', func.to_tsvector(SEARCH_CONFIG, content),
+              postgresql_using='gin').ddl_if(dialect='postgresql'),
+    )
+    # Денормализованный счётчик лайков, см. backend_server.counters
+    like_count = Column(Integer, nullable=False, default=0,
+                        server_default='0')
     author: Mapped['User'] = relationship(back_populates='tweets')
     medias: Mapped[List['Media']] = relationship(back_populates='tweet')
     users_who_liked: Mapped[List['User']] = relationship(
         secondary='like', back_populates='liked_tweets')
+    # Пользователи, упомянутые в твите через @имя
+    mentioned_users: Mapped[List['User']] = relationship(
+        secondary='mention')
     likes: Mapped[List['Like']] = relationship(
         foreign_keys='Like.tweet_id',
         back_populates='tweet_was_liked', viewonly=True
@@ -60,15 +87,44 @@ class Media(Base):
     __tablename__ = 'media'
 
     id = Column(Integer, primary_key=True)
-    file = Column(LargeBinary, nullable=False)
-    tweet_id = Column(Integer, ForeignKey('tweet.id'))
+    # Содержимое хранится в MediaStorage по ключу sha256,
+    # столбец file остаётся только для ещё не перенесённых записей
+    file = Column(LargeBinary, nullable=True)
+    sha256 = Column(String(64))
+    size = Column(Integer)
+    # Тип и размеры изображения, определённые при загрузке,
+    # см. backend_server.media_variants
+    mime = Column(String(50))
+    width = Column(Integer)
+    height = Column(Integer)
+    tweet_id = Column(Integer, ForeignKey('tweet.id'), index=True)
     tweet: Mapped['Tweet'] = relationship(back_populates='medias')
 
 
+class MediaVariant(Base):
+    """Уменьшенная копия изображения в хранилище медиафайлов"""
+    __tablename__ = 'media_variant'
+    __table_args__ = (
+        PrimaryKeyConstraint('media_id', 'name', name='media_variant_pk'),
+    )
+
+    media_id = Column(Integer, ForeignKey('media.id'))
+    name = Column(String(10))
+    sha256 = Column(String(64), nullable=False)
+    size = Column(Integer, nullable=False)
+    mime = Column(String(50), nullable=False)
+    width = Column(Integer, nullable=False)
+    height = Column(Integer, nullable=False)
+
+
 class Like(Base):
     __tablename__ = 'like'
-    __table_args__ = (PrimaryKeyConstraint(
-        'tweet_id', 'user_id', name='tweet_user_pk'), )
+    # Первичный ключ покрывает лайки твита,
+    # индекс (user_id, tweet_id) - лайки пользователя без чтения таблицы
+    __table_args__ = (
+        PrimaryKeyConstraint('tweet_id', 'user_id', name='tweet_user_pk'),
+        Index('ix_like_user_id_tweet_id', 'user_id', 'tweet_id'),
+    )
 
     tweet_id = Column(Integer, ForeignKey('tweet.id'))
     user_id = Column(Integer, ForeignKey('user.id'))
@@ -83,8 +139,14 @@ class Like(Base):
 
 class Follow(Base):
     __tablename__ = 'follow'
-    __table_args__ = (PrimaryKeyConstraint('follower_id', 'following_id',
-                                           name='user_follower_pk'), )
+    # Первичный ключ покрывает подписки пользователя,
+    # индекс (following_id, follower_id) - его подписчиков
+    __table_args__ = (
+        PrimaryKeyConstraint('follower_id', 'following_id',
+                             name='user_follower_pk'),
+        Index('ix_follow_following_id_follower_id',
+              'following_id', 'follower_id'),
+    )
 
     follower_id = Column(Integer, ForeignKey('user.id'))
     following_id = Column(Integer, ForeignKey('user.id'))
@@ -98,3 +160,46 @@ class Follow(Base):
     # Прокси follower_id -> id
     id = association_proxy('follower', 'id')
     name = association_proxy('follower', 'name')
+
+
+class Mention(Base):
+    __tablename__ = 'mention'
+    # Первичный ключ покрывает упоминания в твите,
+    # индекс (user_id, tweet_id) - ленту упоминаний пользователя
+    __table_args__ = (
+        PrimaryKeyConstraint('tweet_id', 'user_id',
+                             name='mention_tweet_user_pk'),
+        Index('ix_mention_user_id_tweet_id', 'user_id', 'tweet_id'),
+    )
+
+    tweet_id = Column(Integer, ForeignKey('tweet.id'))
+    user_id = Column(Integer, ForeignKey('user.id'))
+
+
+class TrendSnapshot(Base):
+    __tablename__ = 'trend_snapshot'
+    # Снимок скользящего окна трендов, см. backend_server.trends
+    name = Column(String(50), primary_key=True)
+    saved_at = Column(Integer, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+
+
+class Job(Base):
+    __tablename__ = 'job'
+    # Очередь фоновых задач, см. backend_server.jobs.
+    # Индекс (state, run_at) - выбор готовых к выполнению задач
+    __table_args__ = (
+        Index('ix_job_state_run_at', 'state', 'run_at'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(50), nullable=False)
+    payload = Column(JSON, nullable=False)
+    state = Column(String(10), nullable=False)
+    attempts = Column(Integer, nullable=False, default=0,
+                      server_default='0')
+    # Время в секундах Unix
+    created_at = Column(Float, nullable=False)
+    run_at = Column(Float, nullable=False)
+    locked_at = Column(Float)
+    last_error = Column(String)
@@ -0,0 +1,82 @@
+import base64
+import binascii
+import math
+from typing import Tuple
+
+# Размер страницы ленты по умолчанию и максимально допустимый
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 800
+
+# Виды курсоров: id последней записи, смещение страницы
+# и ключ (оценка, id) последнего твита ранжированной ленты
+ID_CURSOR = 'id'
+OFFSET_CURSOR = 'offset'
+RANKED_CURSOR = 'ranked'
+
+
+class InvalidCursorError(ValueError):
+    """Курсор пагинации повреждён или подделан"""
+
+
+def _encode(kind: str, value: str) -> str:
+    return base64.urlsafe_b64encode(f'{kind}:{value}'.encode()).decode()
+
+
+def _decode(cursor: str, kind: str) -> str:
+    """
+    Возвращает значение курсора вида kind.
+    Возбуждает InvalidCursorError для курсора другого вида.
+    """
+    try:
+        payload = base64.urlsafe_b64decode(cursor.encode()).decode()
+    except (binascii.Error, UnicodeError, ValueError):
+        raise InvalidCursorError('Invalid cursor')
+    cursor_kind, _, value = payload.partition(':')
+    if cursor_kind != kind:
+        raise InvalidCursorError(f'Cursor is not a {kind} cursor')
+    return value
+
+
+def encode_cursor(last_id: int, kind: str = ID_CURSOR) -> str:
+    """
+    Кодирует id последней записи страницы или смещение
+    следующей страницы в непрозрачный курсор вида kind
+    """
+    return _encode(kind, str(last_id))
+
+
+def decode_cursor(cursor: str, kind: str = ID_CURSOR) -> int:
+    """
+    Декодирует курсор, полученный от клиента, в id записи или смещение.
+    Возбуждает InvalidCursorError, если курсор повреждён
+    или выдан для другого вида пагинации.
+    """
+    value = _decode(cursor, kind)
+    try:
+        last_id = int(value)
+    except ValueError:
+        raise InvalidCursorError('Invalid cursor')
+    if last_id <= 0:
+        raise InvalidCursorError('Invalid cursor')
+    return last_id
+
+
+def encode_ranked_cursor(score: float, tweet_id: int) -> str:
+    """Кодирует оценку и id последнего твита ранжированной страницы"""
+    return _encode(RANKED_CURSOR, f'{score!r}:{tweet_id}')
+
+
+def decode_ranked_cursor(cursor: str) -> Tuple[float, int]:
+    """
+    Декодирует курсор ранжированной ленты в оценку и id твита.
+    Возбуждает InvalidCursorError, если курсор повреждён
+    или выдан для другого вида пагинации.
+    """
+    score, _, tweet_id = _decode(cursor, RANKED_CURSOR).partition(':')
+    try:
+        key = float(score), int(tweet_id)
+    except ValueError:
+        raise InvalidCursorError('Invalid cursor')
+    if not math.isfinite(key[0]) or key[1] <= 0:
+        raise InvalidCursorError('Invalid cursor')
+    return key
@@ -0,0 +1,307 @@
+"""
+Профилирование отдельных HTTP-запросов по требованию.
+
+Запрос профилируется, если в заголовке x-profile передан один
+из токенов PROFILING_TOKENS, или случайно с вероятностью
+PROFILING_SAMPLE_RATE. Такой запрос выполняется под cProfile:
+в цикле событий и в потоках пула, куда run_in_session передаёт
+работу с БД. Профиль хранит статистику функций и хронологию
+SQL-запросов, последние PROFILING_KEEP профилей доступны через
+/api/profiles, а при заданном PROFILING_DIR сохраняются в файлы
+.prof для pstats и snakeviz.
+
+Без токенов и вероятности middleware не подключается,
+остальные запросы проверяют только заголовок. Запросы путей
+PROFILING_EXCLUDE (поток /api/stream не завершается) не профилируются,
+иначе они бы надолго заняли профилировщик.
+"""
+import cProfile
+import marshal
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextvars import ContextVar
+from functools import wraps
+from typing import (
+    Any,
+    Callable,
+    Collection,
+    Dict,
+    List,
+    MutableMapping,
+    Optional,
+    TypeVar,
+)
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.concurrency import run_in_threadpool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+PROFILING_TOKENS = frozenset(
+    token for token in os.environ.get('PROFILING_TOKENS', '').split(',')
+    if token)
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_KEEP = int(os.environ.get('PROFILING_KEEP', '50'))
+PROFILING_DIR = os.environ.get('PROFILING_DIR') or None
+# Префиксы путей долгих потоковых ответов, которые не профилируются
+PROFILING_EXCLUDE = tuple(
+    prefix for prefix
+    in os.environ.get('PROFILING_EXCLUDE', '/api/stream').split(',')
+    if prefix)
+PROFILING = bool(PROFILING_TOKENS) or PROFILING_SAMPLE_RATE > 0
+PROFILE_HEADER = 'x-profile'
+PROFILE_ID_HEADER = 'x-profile-id'
+SQL_STARTED_KEY = 'profiling_sql_started'
+TOP_FUNCTIONS = 30
+
+T = TypeVar('T')
+
+
+class RequestProfile:
+    """Профиль одного HTTP-запроса: статистика функций и SQL"""
+
+    def __init__(self, method: str, path: str) -> None:
+        self.profile_id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.status = 0
+        self.sql: List[Dict[str, Any]] = []
+        self.stats: Optional[pstats.Stats] = None
+        self._origin = time.perf_counter()
+        self._profiles: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+
+    def offset(self, moment: float) -> float:
+        """Миллисекунды от начала запроса до момента perf_counter"""
+        return round((moment - self._origin) * 1000, 3)
+
+    def add_sql(self, statement: str, started: float) -> None:
+        """Добавляет выполненный SQL-запрос в хронологию"""
+        with self._lock:
+            self.sql.append({
+                'start_ms': self.offset(started),
+                'duration_ms': round(
+                    (time.perf_counter() - started) * 1000, 3),
+                'statement': statement,
+            })
+
+    def add_profile(self, profile: cProfile.Profile) -> None:
+        """Добавляет профиль потока, выполнявшего часть запроса"""
+        with self._lock:
+            self._profiles.append(profile)
+
+    def finish(self, status: int) -> None:
+        """Завершает профиль и объединяет статистику потоков"""
+        self.duration = self.offset(time.perf_counter())
+        self.status = status
+        with self._lock:
+            self.stats = pstats.Stats(*self._profiles) \
+                if self._profiles else None
+
+    def summary(self) -> Dict[str, Any]:
+        """Краткое описание профиля для списка"""
+        return {
+            'id': self.profile_id, 'method': self.method, 'path': self.path,
+            'status': self.status, 'started_at': self.started_at,
+            'duration_ms': self.duration, 'sql_count': len(self.sql),
+            'sql_ms': round(sum(item['duration_ms'] for item in self.sql), 3),
+        }
+
+    def report(self, limit: int = TOP_FUNCTIONS) -> Dict[str, Any]:
+        """Описание профиля с самыми дорогими функциями и SQL"""
+        return dict(self.summary(), sql=self.sql,
+                    functions=top_functions(self.stats, limit))
+
+    def dump(self) -> bytes:
+        """Статистика в формате файлов pstats"""
+        stats = self.stats.stats if self.stats else {}  # type: ignore
+        return marshal.dumps(stats)
+
+
+def top_functions(stats: Optional[pstats.Stats],
+                  limit: int) -> List[Dict[str, Any]]:
+    """Функции с наибольшим накопленным временем"""
+    if stats is None:
+        return []
+    rows = sorted(stats.stats.items(),  # type: ignore
+                  key=lambda item: item[1][3], reverse=True)[:limit]
+    return [{
+        'function': f'{filename}:{line}({name})',
+        'calls': calls,
+        'total_ms': round(total * 1000, 3),
+        'cumulative_ms': round(cumulative * 1000, 3),
+    } for (filename, line, name), (_, calls, total, cumulative, _)
+        in rows]
+
+
+_current_profile: ContextVar[Optional[RequestProfile]] = ContextVar(
+    'current_profile', default=None)
+
+
+def in_thread(func: Callable[..., T]) -> Callable[..., T]:
+    """
+    Оборачивает функцию, выполняемую в пуле потоков,
+    профилированием текущего запроса. Вне профилируемого
+    запроса возвращает функцию без изменений.
+    """
+    request_profile = _current_profile.get()
+    if request_profile is None:
+        return func
+
+    @wraps(func)
+    def profiled(*args: Any, **kwargs: Any) -> T:
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # В потоке уже работает другой профилировщик
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            request_profile.add_profile(profile)
+
+    return profiled
+
+
+def _before_cursor_execute(conn: Any, *args: Any) -> None:
+    if _current_profile.get() is not None:
+        conn.info[SQL_STARTED_KEY] = time.perf_counter()
+
+
+def _after_cursor_execute(conn: Any, cursor: Any, statement: str,
+                          *args: Any) -> None:
+    request_profile = _current_profile.get()
+    started = conn.info.pop(SQL_STARTED_KEY, None)
+    if request_profile is not None and started is not None:
+        request_profile.add_sql(statement, started)
+
+
+class Profiler:
+    """
+    Отбирает запросы для профилирования и хранит последние профили.
+    Одновременно профилируется один запрос: cProfile цикла событий
+    видит и другие выполняющиеся в нём запросы.
+    """
+
+    def __init__(self, tokens: Collection[str] = PROFILING_TOKENS,
+                 sample_rate: float = PROFILING_SAMPLE_RATE,
+                 keep: int = PROFILING_KEEP,
+                 dump_dir: Optional[str] = PROFILING_DIR,
+                 exclude: Collection[str] = PROFILING_EXCLUDE) -> None:
+        self.tokens = frozenset(token.encode() for token in tokens)
+        self.sample_rate = sample_rate
+        self.keep = keep
+        self.dump_dir = dump_dir
+        self.exclude = tuple(exclude)
+        self.profiles: MutableMapping[str, RequestProfile] = OrderedDict()
+        self._active = threading.Lock()
+        self._lock = threading.Lock()
+
+    def is_admin(self, token: Optional[str]) -> bool:
+        """Проверяет токен доступа к профилям"""
+        return token is not None and token.encode() in self.tokens
+
+    def wants(self, scope: Scope) -> bool:
+        """Решает, профилировать ли запрос"""
+        if str(scope['path']).startswith(self.exclude):
+            return False
+        if self.tokens:
+            for name, value in scope['headers']:
+                if name == PROFILE_HEADER.encode() and value in self.tokens:
+                    return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self, scope: Scope) -> bool:
+        """Занимает профилировщик, если запрос нужно профилировать"""
+        return self.wants(scope) and self._active.acquire(blocking=False)
+
+    def finish(self, request_profile: RequestProfile, status: int) -> None:
+        """
+        Объединяет статистику, сохраняет профиль запроса
+        и освобождает профилировщик. Вызывается в пуле потоков:
+        сборка статистики и запись файла не занимают цикл событий.
+        """
+        try:
+            request_profile.finish(status)
+            self.store(request_profile)
+        finally:
+            self._active.release()
+
+    def instrument_engine(self, sqlalchemy_engine: Engine) -> None:
+        """Подписывается на выполнение SQL-запросов двигателя"""
+        for name, listener in (('before_cursor_execute',
+                                _before_cursor_execute),
+                               ('after_cursor_execute',
+                                _after_cursor_execute)):
+            if not event.contains(sqlalchemy_engine, name, listener):
+                event.listen(sqlalchemy_engine, name, listener)
+
+    def store(self, request_profile: RequestProfile) -> None:
+        """Сохраняет профиль, вытесняя самые старые"""
+        with self._lock:
+            self.profiles[request_profile.profile_id] = request_profile
+            while len(self.profiles) > self.keep:
+                self.profiles.pop(next(iter(self.profiles)))
+        if self.dump_dir is not None and request_profile.stats is not None:
+            os.makedirs(self.dump_dir, exist_ok=True)
+            request_profile.stats.dump_stats(os.path.join(
+                self.dump_dir, f'{request_profile.profile_id}.prof'))
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Краткие описания профилей, новые первыми"""
+        with self._lock:
+            return [request_profile.summary() for request_profile
+                    in reversed(list(self.profiles.values()))]
+
+    def get(self, profile_id: str) -> Optional[RequestProfile]:
+        """Профиль по идентификатору"""
+        with self._lock:
+            return self.profiles.get(profile_id)
+
+
+class ProfilingMiddleware:
+    """
+    ASGI-middleware профилирования выбранных запросов.
+    Идентификатор профиля возвращается в заголовке x-profile-id.
+    """
+
+    def __init__(self, app: ASGIApp, profiler: Profiler) -> None:
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope: Scope, receive: Receive,
+                       send: Send) -> None:
+        if scope['type'] != 'http' or not self.profiler.start(scope):
+            await self.app(scope, receive, send)
+            return
+        request_profile = RequestProfile(scope['method'], scope['path'])
+        status = [500]
+
+        async def send_with_id(message: Message) -> None:
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+                message['headers'] = list(message.get('headers', [])) + [
+                    (PROFILE_ID_HEADER.encode(),
+                     request_profile.profile_id.encode())]
+            await send(message)
+
+        token = _current_profile.set(request_profile)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profile.disable()
+            _current_profile.reset(token)
+            request_profile.add_profile(profile)
+            await run_in_threadpool(
+                self.profiler.finish, request_profile, status[0])
@@ -0,0 +1,201 @@
+import os
+from itertools import chain
+from typing import (
+    Any,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    cast,
+)
+
+import numpy as np
+import numpy.typing as npt
+from sqlalchemy import ColumnElement, Select, func, literal, select
+from sqlalchemy.orm import Session
+
+from backend_server.database import run_cpu_bound
+from backend_server.models import Follow, Like, Tweet
+
+# Сколько твитов-кандидатов отбирается из каждого источника
+RANKED_CANDIDATES = int(os.environ.get('RANKED_CANDIDATES', '10000'))
+# Через сколько новых твитов вес твита падает вдвое.
+# Отдельного времени создания у твитов нет, id растут монотонно
+# и служат логическими часами.
+RANKED_HALF_LIFE = float(os.environ.get('RANKED_HALF_LIFE', '500'))
+LIKE_WEIGHT = 1.0
+SOCIAL_WEIGHT = 2.0
+AFFINITY_WEIGHT = 1.5
+FOLLOW_WEIGHT = 1.0
+
+IntArray = npt.NDArray[np.int64]
+FloatArray = npt.NDArray[np.float64]
+# Оценка и id твита: ключ позиции в ранжированной ленте
+RankKey = Tuple[float, int]
+
+
+class Candidates(NamedTuple):
+    """Признаки твитов-кандидатов, по массиву на признак"""
+    tweet_ids: IntArray
+    author_ids: IntArray
+    like_counts: IntArray
+    # Сколько авторов из подписок пользователя лайкнули твит
+    followee_likes: IntArray
+
+
+def _rows(session: Session, query: Select[Any], width: int = 4) -> IntArray:
+    """Выполняет запрос и возвращает строки целочисленной матрицей"""
+    rows = session.execute(query).tuples().all()
+    return np.fromiter(chain.from_iterable(rows), dtype=np.int64,
+                       count=len(rows) * width).reshape(-1, width)
+
+
+def gather_candidates(
+        session: Session, user_id: int,
+        limit: int = RANKED_CANDIDATES) -> Candidates:
+    """
+    Отбирает кандидатов для ранжированной ленты тремя запросами:
+    свежие твиты авторов из подписок, твиты, лайкнутые этими авторами,
+    и свежие твиты всех остальных. Собственные твиты исключаются.
+    """
+    followees = select(Follow.following_id).where(
+        cast(ColumnElement[bool], user_id == Follow.follower_id))
+    not_own = Tweet.user_id != user_id
+    columns = (Tweet.id, Tweet.user_id, Tweet.like_count)
+    followed = _rows(session, select(*columns, literal(0))
+                     .where(not_own, Tweet.user_id.in_(followees))
+                     .order_by(Tweet.id.desc()).limit(limit))
+    liked = _rows(session, select(*columns, func.count())
+                  .join(Like, Like.tweet_id == Tweet.id)
+                  .where(not_own, Like.user_id.in_(followees))
+                  .group_by(Tweet.id)
+                  .order_by(Tweet.id.desc()).limit(limit))
+    recent = _rows(session, select(*columns, literal(0))
+                   .where(not_own)
+                   .order_by(Tweet.id.desc()).limit(limit))
+    # Кандидаты из нескольких источников берутся из первого по порядку,
+    # в котором известно число лайков от авторов из подписок
+    rows = np.concatenate([liked, followed, recent])
+    _, first = np.unique(rows[:, 0], return_index=True)
+    rows = rows[first]
+    return Candidates(tweet_ids=rows[:, 0], author_ids=rows[:, 1],
+                      like_counts=rows[:, 2], followee_likes=rows[:, 3])
+
+
+def add_pending_likes(candidates: Candidates,
+                      pending: Mapping[int, int]) -> Candidates:
+    """
+    Добавляет к числу лайков кандидатов приращения,
+    ещё не записанные в БД. id кандидатов отсортированы.
+    """
+    if not pending or not len(candidates.tweet_ids):
+        return candidates
+    pending_ids = np.fromiter(pending.keys(), dtype=np.int64)
+    deltas = np.fromiter(pending.values(), dtype=np.int64)
+    position = np.searchsorted(candidates.tweet_ids, pending_ids) \
+        .clip(max=len(candidates.tweet_ids) - 1)
+    found = candidates.tweet_ids[position] == pending_ids
+    like_counts = candidates.like_counts.copy()
+    np.add.at(like_counts, position[found], deltas[found])
+    return candidates._replace(like_counts=like_counts)
+
+
+def author_affinity(
+        session: Session, user_id: int) -> Tuple[IntArray, IntArray]:
+    """
+    Возвращает отсортированные id авторов и число лайков,
+    которые пользователь поставил их твитам.
+    """
+    matrix = _rows(session, select(Tweet.user_id, func.count())
+                   .join(Like, Like.tweet_id == Tweet.id)
+                   .where(cast(ColumnElement[bool], user_id == Like.user_id))
+                   .group_by(Tweet.user_id)
+                   .order_by(Tweet.user_id), width=2)
+    return matrix[:, 0], matrix[:, 1]
+
+
+def followed_authors(session: Session, user_id: int) -> IntArray:
+    """Возвращает id авторов, на которых подписан пользователь"""
+    return np.array(cast(Sequence[int], session.scalars(
+        select(Follow.following_id).where(
+            cast(ColumnElement[bool], user_id == Follow.follower_id))
+    ).all()), dtype=np.int64)
+
+
+def score_candidates(
+        candidates: Candidates,
+        followed_ids: IntArray,
+        affinity_ids: IntArray,
+        affinity_likes: IntArray,
+        half_life: float = RANKED_HALF_LIFE,
+) -> FloatArray:
+    """
+    Оценивает всех кандидатов сразу операциями над массивами:
+    сумма логарифмов лайков, лайков подписок и близости к автору
+    плюс бонус за подписку, умноженная на затухание по давности.
+    Оценка возвращается в логарифмической шкале от id твита,
+    а не от самого нового кандидата, поэтому новые твиты не меняют
+    оценок остальных и ключ (оценка, id) годится для курсора.
+    """
+    affinity = np.zeros(len(candidates.author_ids), dtype=np.int64)
+    if len(affinity_ids):
+        position = np.searchsorted(affinity_ids, candidates.author_ids) \
+            .clip(max=len(affinity_ids) - 1)
+        found = affinity_ids[position] == candidates.author_ids
+        affinity[found] = affinity_likes[position[found]]
+    scores: FloatArray = candidates.tweet_ids / half_life + np.log2(
+        1.0
+        + LIKE_WEIGHT * np.log1p(candidates.like_counts)
+        + SOCIAL_WEIGHT * np.log1p(candidates.followee_likes)
+        + AFFINITY_WEIGHT * np.log1p(affinity)
+        + FOLLOW_WEIGHT * np.isin(candidates.author_ids, followed_ids)
+    )
+    return scores
+
+
+def rank(candidates: Candidates, scores: FloatArray, limit: int,
+         after: Optional[RankKey] = None) -> List[RankKey]:
+    """
+    Возвращает оценки и id твитов страницы ранжированной ленты:
+    по убыванию оценки, при равенстве - сначала новые,
+    начиная с твита, следующего за ключом after.
+    """
+    tweet_ids = candidates.tweet_ids
+    if after is not None:
+        score, tweet_id = after
+        keep = (scores < score) | ((scores == score) & (tweet_ids < tweet_id))
+        tweet_ids, scores = tweet_ids[keep], scores[keep]
+    order = np.lexsort((-tweet_ids, -scores))[:limit]
+    return [(float(score), int(tweet_id))
+            for score, tweet_id in zip(scores[order], tweet_ids[order])]
+
+
+def rank_candidates(candidates: Candidates, pending_likes: Mapping[int, int],
+                    followed_ids: IntArray, affinity_ids: IntArray,
+                    affinity_likes: IntArray, limit: int,
+                    after: Optional[RankKey]) -> List[RankKey]:
+    """
+    Оценивает и упорядочивает кандидатов, не обращаясь к БД,
+    и возвращает ключи твитов страницы
+    """
+    candidates = add_pending_likes(candidates, pending_likes)
+    scores = score_candidates(candidates, followed_ids,
+                              affinity_ids, affinity_likes)
+    return rank(candidates, scores, limit, after)
+
+
+def ranked_page(session: Session, user_id: int, limit: int,
+                after: Optional[RankKey],
+                pending_likes: Mapping[int, int]) -> List[RankKey]:
+    """
+    Отбирает, оценивает и упорядочивает кандидатов ленты пользователя
+    и возвращает ключи твитов страницы после ключа after.
+    Оценка выполняется через run_cpu_bound.
+    """
+    candidates = gather_candidates(session, user_id)
+    affinity_ids, affinity_likes = author_affinity(session, user_id)
+    return run_cpu_bound(rank_candidates, candidates, pending_likes,
+                         followed_authors(session, user_id),
+                         affinity_ids, affinity_likes, limit, after)
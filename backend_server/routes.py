@@ -1,229 +1,588 @@
+import asyncio
 import sys
-from typing import List, Optional, Union, cast
+from typing import (
+    Any,
+    Collection,
+    Dict,
+    List,
+    Literal,
+    Mapping,
+    Optional,
+    Protocol,
+    Union,
+)
 
-from fastapi import Body, FastAPI, File, Header, Path, Response
-from sqlalchemy import ColumnElement, delete
-from sqlalchemy.exc import IntegrityError, MultipleResultsFound, NoResultFound
+from fastapi import (
+    Body,
+    Depends,
+    FastAPI,
+    File,
+    Header,
+    Path,
+    Query,
+    Request,
+    Response,
+)
+from fastapi.responses import (
+    JSONResponse,
+    PlainTextResponse,
+    StreamingResponse,
+)
+from sqlalchemy.exc import MultipleResultsFound, NoResultFound
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
-from backend_server.models import Follow, Like, Media, Tweet, User
+from backend_server import services
+from backend_server.auth import ApiKeyResolver, user_id_dependency
+from backend_server.counters import CounterAggregator
+from backend_server.database import (
+    AnySession,
+    SessionSource,
+    any_session_scope,
+    run_in_session,
+    session_dependency,
+    source_engine,
+    wrap_threads,
+)
+from backend_server.export import (
+    EXPORT_ADMIN_KEYS,
+    gzip_chunks,
+    parse_after,
+    stream_export,
+)
+from backend_server.follow_graph import FollowGraph
+from backend_server.jobs import DELETE_TWEET, JOBS, MEDIA_VARIANTS, JobQueue
+from backend_server.media_cache import MediaCache, MediaKey
+from backend_server.media_storage import (
+    MediaFile,
+    MediaStorage,
+    etag_for,
+    etag_matches,
+    make_media_storage,
+    media_response,
+    not_modified,
+)
+from backend_server.media_variants import (
+    DEFAULT_MEDIA_TYPE,
+    MediaProcessor,
+    VariantName,
+    sniff_image,
+)
+from backend_server.metrics import (
+    METRICS,
+    PROMETHEUS_CONTENT_TYPE,
+    Metrics,
+    MetricsMiddleware,
+)
+from backend_server.pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    OFFSET_CURSOR,
+    InvalidCursorError,
+    decode_cursor,
+    decode_ranked_cursor,
+)
+from backend_server.profiling import (
+    PROFILE_HEADER,
+    PROFILING,
+    Profiler,
+    ProfilingMiddleware,
+    in_thread,
+)
+from backend_server.ranking import RankKey
 from backend_server.schemas import (
+    ProfileModel,
+    ProfileSummaryModel,
+    ResultCacheStatsModel,
     ResultErrorModel,
     ResultMediaModel,
     ResultModel,
+    ResultPoolStatsModel,
+    ResultProfileModel,
+    ResultProfilesModel,
+    ResultSuggestionsModel,
+    ResultTrendsModel,
     ResultTweetModel,
     ResultTweetsModel,
     ResultUserInfoModelOut,
+    ResultUsersModel,
+    ResultUserSummaryModel,
 )
+from backend_server.search import (
+    SEARCH_MAX_QUERY,
+    SEARCH_RETRY_AFTER,
+    SearchIndex,
+    SearchUnavailableError,
+    build_in_background,
+    make_search_index,
+)
+from backend_server.serializers import FAST_JSON, RawJSONResponse
+from backend_server.stream import (
+    STREAM_MAX_DURATION,
+    StreamFullError,
+    StreamHub,
+    sse_events,
+)
+from backend_server.timeline import HomeTimelineCache
+from backend_server.trends import TRENDS_CANDIDATES, TrendingTopics
+from backend_server.user_profiles import (
+    FOLLOWERS,
+    FOLLOWING,
+    Direction,
+    ProfileCache,
+)
+from backend_server.write_coalescer import (
+    FOLLOW,
+    LIKE,
+    WRITE_COALESCING,
+    Write,
+    WriteCoalescer,
+)
+
+
+async def publish_tweet(
+        session: AnySession, hub: StreamHub, counters: CounterAggregator,
+        author_id: Optional[int], tweet_id: Optional[int]) -> None:
+    """Публикует новый твит, если его ждёт хотя бы один поток"""
+    if author_id is None or tweet_id is None \
+            or not hub.has_followers(author_id):
+        return
+    tweet = await run_in_session(
+        session, services.read_tweet_payload, counters, tweet_id)
+    if tweet is not None:
+        hub.publish_tweet(author_id, tweet)
+
+
+async def publish_like(session: AnySession, hub: StreamHub,
+                       tweet_id: int, delta: int) -> None:
+    """
+    Публикует изменение числа лайков подписчикам автора твита.
+    Автор читается из БД, только если открыт хотя бы один поток.
+    """
+    if not hub.has_subscribers():
+        return
+    author_id = await run_in_session(
+        session, services.read_tweet_author, tweet_id)
+    if author_id is not None:
+        hub.publish_like(author_id, tweet_id, delta)
+
+
+async def delete_tweet(
+        session: AnySession, timelines: HomeTimelineCache,
+        search: SearchIndex, jobs: Optional[JobQueue],
+        user_id: Optional[int], tweet_id: int) -> ResultModel:
+    """Удаляет твит сразу или ставит удаление в очередь задач"""
+    if jobs is None:
+        return await run_in_session(
+            session, services.delete_tweet,
+            timelines, search, user_id, tweet_id)
+    result = await run_in_session(
+        session, services.enqueue_delete_tweet, jobs, user_id, tweet_id)
+    jobs.wake()
+    return result
 
 
 def connect_routes_tweets_post_delete(
-        app: FastAPI, my_session: Session) -> None:
-    """Фабрика роутов создания и удаления твитов приложения"""
+        app: FastAPI, my_session: SessionSource,
+        timelines: HomeTimelineCache,
+        counters: CounterAggregator,
+        resolver: ApiKeyResolver,
+        hub: StreamHub,
+        search: SearchIndex,
+        trends: TrendingTopics,
+        jobs: Optional[JobQueue] = None) -> None:
+    """
+    Фабрика роутов создания и удаления твитов приложения.
+    С очередью задач твит удаляется в фоне.
+    """
+    get_session = session_dependency(my_session)
+    get_user_id = user_id_dependency(resolver, get_session)
 
     @app.post('/api/tweets', status_code=201,
               response_model=ResultTweetModel)
-    def create_new_tweet(
-            api_key: str = Header(...),
+    async def create_new_tweet(
+            user_id: Optional[int] = Depends(get_user_id),
             tweet_data: str = Body(...),
-            tweet_media_ids: Optional[List[int]] = Body(None)
+            tweet_media_ids: Optional[List[int]] = Body(None),
+            session: AnySession = Depends(get_session),
     ) -> ResultTweetModel:
         """
         Создаёт запись твита и сохраняет в базу.
         Получает строку и медиафайлы. Возвращает id созданного твита.
+        Индексирует твит для поиска и публикует его
+        в потоки подписчиков автора.
         """
-        user_id = my_session.query(User.id).filter(
-            cast(ColumnElement[bool], api_key == User.api_key)).scalar()
-        new_tweet = Tweet(content=tweet_data,
-                          media_ids=tweet_media_ids,
-                          user_id=user_id)
-        my_session.add(new_tweet)
-        my_session.commit()
-        return ResultTweetModel(result=True, tweet_id=new_tweet.id)
+        result = await run_in_session(
+            session, services.add_tweet,
+            timelines, search, trends, user_id, tweet_data, tweet_media_ids,
+        )
+        await publish_tweet(session, hub, counters, user_id, result.tweet_id)
+        return result
 
     @app.delete('/api/tweets/{tweet_id}',
                 status_code=200, response_model=ResultModel)
-    def remove_tweet(
+    async def remove_tweet(
             response: Response,
-            api_key: str = Header(...),
-            tweet_id: int = Path(...)
+            user_id: Optional[int] = Depends(get_user_id),
+            tweet_id: int = Path(...),
+            session: AnySession = Depends(get_session),
     ) -> ResultModel:
         """
         Удаляет запись твита из базы. Получает id твита.
         Возвращает сообщение статуса удаления.
+        С очередью задач проверяет автора и возвращает ответ,
+        не дожидаясь удаления.
         """
-        user_id = my_session.query(User.id).filter(
-            cast(ColumnElement[bool], api_key == User.api_key)).scalar()
         try:
-            deleting_tweet = my_session.query(Tweet).filter(
-                cast(ColumnElement[bool], tweet_id == Tweet.id)).one()
-            if deleting_tweet.user_id != user_id:
-                response.status_code = 403
-                raise PermissionError
-        except (NoResultFound, PermissionError):
+            result = await delete_tweet(session, timelines, search, jobs,
+                                        user_id, tweet_id)
+        except PermissionError:
+            response.status_code = 403
             return ResultModel(result=False)
-        my_session.delete(deleting_tweet)
-        my_session.commit()
-        return ResultModel(result=True)
+        # Удалить твит может только его автор
+        if result.result and user_id is not None:
+            hub.publish_delete(user_id, tweet_id)
+        return result
+
+
+async def media_file_response(
+        session: AnySession, media_cache: MediaCache,
+        media_storage: MediaStorage, processor: MediaProcessor,
+        media_id: int, size: Optional[VariantName],
+        request_headers: Mapping[str, str]) -> Response:
+    """
+    Отвечает на запрос медиафайла. Совпадение If-None-Match
+    с известным ETag проверяется до обращения к БД и хранилищу.
+    """
+    if_none_match = request_headers.get('if-none-match')
+    key: MediaKey = media_id if size is None else (media_id, size)
+    etag = media_cache.etag(key) if if_none_match else None
+    if etag is not None and etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    media = await read_media_file(session, media_cache, media_storage,
+                                  processor, media_id, size, if_none_match)
+    if media is None:
+        return Response(status_code=404)
+    return media_response(media, media_storage,
+                          media.mime or DEFAULT_MEDIA_TYPE, request_headers)
 
 
-def connect_routes_medias_post_get(app: FastAPI, my_session: Session) -> None:
-    """Фабрика роутов создания и получения медиафайлов приложения"""
+async def read_media_file(
+        session: AnySession, media_cache: MediaCache,
+        media_storage: MediaStorage, processor: MediaProcessor,
+        media_id: int, size: Optional[VariantName],
+        if_none_match: Optional[str] = None) -> Optional[MediaFile]:
+    """
+    Находит медиафайл или его вариант в кэше процесса или в БД.
+    Оригинал, отданный вместо ещё не построенного варианта,
+    под ключом варианта не кэшируется. Содержимое файла,
+    совпадающего с If-None-Match, не читается.
+    """
+    key: MediaKey = media_id if size is None else (media_id, size)
+    media = media_cache.get(key)
+    if media is not None:
+        return media
+    final = True
+    if size is None:
+        media = await run_in_session(session, services.read_media, media_id)
+    else:
+        media, final = await run_in_session(
+            session, services.read_media_variant,
+            media_id, size, processor.sizes[size])
+    if media is None or not final:
+        return media
+    media_cache.remember(key, media.sha256)
+    if etag_matches(if_none_match, etag_for(media.sha256)):
+        return media
+    return await run_in_threadpool(
+        media_cache.fill, key, media, media_storage)
+
+
+def connect_routes_medias_post_get(
+        app: FastAPI, my_session: SessionSource,
+        media_storage: MediaStorage, media_cache: MediaCache,
+        processor: MediaProcessor, jobs: Optional[JobQueue] = None) -> None:
+    """
+    Фабрика роутов создания и получения медиафайлов приложения.
+    Варианты изображений строятся в фоне, с очередью задач -
+    задачами очереди.
+    """
+    get_session = session_dependency(my_session)
 
     @app.post(
         '/api/medias', status_code=201, response_model=ResultMediaModel
     )
-    def add_new_media(file: bytes = File(...)) -> ResultMediaModel:
+    async def add_new_media(
+            file: bytes = File(...),
+            session: AnySession = Depends(get_session),
+    ) -> ResultMediaModel:
         """
-        Создаёт запись медиафайла и сохраняет в базу.
-        Получает медиафайл из form-data. Возвращает id изображения
+        Сохраняет медиафайл в хранилище, а его метаданные в базу.
+        Получает медиафайл из form-data. Определяет тип и размеры
+        изображения и запускает построение его вариантов,
+        не дожидаясь его. Возвращает id изображения
         """
-        new_media = Media(file=file)
-        my_session.add(new_media)
-        my_session.commit()
-        return ResultMediaModel(result=True, media_id=new_media.id)
+        sha256 = await run_in_threadpool(media_storage.put, file)
+        info = await run_in_threadpool(sniff_image, file)
+        wanted = processor.wanted(info)
+        result = await run_in_session(
+            session, services.add_media, sha256, len(file), info,
+            jobs if wanted else None)
+        if not wanted or result.media_id is None:
+            return result
+        if jobs is not None:
+            jobs.wake()
+        else:
+            processor.schedule(my_session, result.media_id)
+        return result
 
     @app.get('/api/medias/{media_id}', response_class=Response)
-    def get_mediafile(media_id: int = Path(...)) -> Response:
+    async def get_mediafile(
+            request: Request,
+            media_id: int = Path(...),
+            size: Optional[VariantName] = Query(None),
+            session: AnySession = Depends(get_session),
+    ) -> Response:
         """
-        Находит запись медиафайла из БД по media_id.
-        Получает media_id из пути запроса.
-        Возвращает пользователю медиафайл в байтах.
+        Находит медиафайл в кэше процесса или запись медиафайла в БД.
+        Получает media_id из пути запроса и необязательный вариант
+        изображения size: thumb или feed.
+        Возвращает пользователю медиафайл с его типом, строгим ETag
+        и поддержкой запросов диапазона (Range), на совпадающий
+        If-None-Match отвечает 304 по известному ETag без обращения к БД.
         """
-        mediafile: bytes = my_session.query(Media.file).filter(
-            cast(ColumnElement[bool], media_id == Media.id)).scalar()
-        return Response(content=mediafile, media_type='image/png')
+        return await media_file_response(
+            session, media_cache, media_storage, processor,
+            media_id, size, request.headers)
 
 
-def connect_routes_likes_post(app: FastAPI, my_session: Session) -> None:
+def connect_routes_likes_post(
+        app: FastAPI, my_session: SessionSource,
+        counters: CounterAggregator,
+        resolver: ApiKeyResolver,
+        hub: StreamHub,
+        coalescer: Optional[WriteCoalescer] = None) -> None:
     """Фабрика роута создания лайков"""
+    get_session = session_dependency(my_session)
+    get_user_id = user_id_dependency(resolver, get_session)
 
     @app.post('/api/tweets/{tweet_id}/likes',
               status_code=201, response_model=ResultModel)
-    def like_tweet(
-            api_key: str = Header(...), tweet_id: int = Path(...)
+    async def like_tweet(
+            user_id: Optional[int] = Depends(get_user_id),
+            tweet_id: int = Path(...),
+            session: AnySession = Depends(get_session),
     ) -> ResultModel:
         """
         Создаёт запись лайка и сохраняет в базу. Получает id твита.
         Возвращает сообщение о статусе создания лайка.
         """
-        user_id = my_session.query(User.id).filter(
-            cast(ColumnElement[bool], api_key == User.api_key)).scalar()
-        new_like = Like(tweet_id=tweet_id,
-                        user_id=user_id)
-        my_session.add(new_like)
-        try:
-            my_session.flush()
-        except IntegrityError:
-            my_session.rollback()
-            return ResultModel(result=False)
-        my_session.commit()
-        return ResultModel(result=True)
+        if coalescer is not None:
+            result = ResultModel(result=await coalescer.submit(
+                Write(LIKE, user_id, tweet_id, insert=True)))
+        else:
+            result = await run_in_session(
+                session, services.add_like, counters, user_id, tweet_id)
+        if result.result:
+            await publish_like(session, hub, tweet_id, 1)
+        return result
 
 
-def connect_routes_likes_delete(app: FastAPI, my_session: Session) -> None:
+def connect_routes_likes_delete(
+        app: FastAPI, my_session: SessionSource,
+        counters: CounterAggregator,
+        resolver: ApiKeyResolver,
+        hub: StreamHub,
+        coalescer: Optional[WriteCoalescer] = None) -> None:
     """Фабрика роута удаления лайков"""
+    get_session = session_dependency(my_session)
+    get_user_id = user_id_dependency(resolver, get_session)
 
     @app.delete('/api/tweets/{tweet_id}/likes')
-    def remove_like_tweet(
-            api_key: str = Header(...), tweet_id: int = Path(...)
+    async def remove_like_tweet(
+            user_id: Optional[int] = Depends(get_user_id),
+            tweet_id: int = Path(...),
+            session: AnySession = Depends(get_session),
     ) -> ResultModel:
         """
         Удаляет запись лайка из базы. Получает id твита.
         Возвращает сообщение о статусе удаления лайка.
         """
-        user_id: int = my_session.query(User.id).filter(
-            cast(ColumnElement[bool], api_key == User.api_key)).scalar()
-        try:
-            my_session.execute(
-                delete(Like).returning(Like)
-                .filter(cast(ColumnElement[bool], user_id == Like.user_id))
-                .filter(cast(ColumnElement[bool], tweet_id == Like.tweet_id))
-            ).one()
-        except NoResultFound:
-            my_session.rollback()
-            return ResultModel(result=False)
-        my_session.commit()
-        return ResultModel(result=True)
+        if coalescer is not None:
+            result = ResultModel(result=await coalescer.submit(
+                Write(LIKE, user_id, tweet_id, insert=False)))
+        else:
+            result = await run_in_session(
+                session, services.delete_like, counters, user_id, tweet_id)
+        if result.result:
+            await publish_like(session, hub, tweet_id, -1)
+        return result
 
 
-def connect_routes_follows_post(app: FastAPI, my_session: Session) -> None:
+def connect_routes_follows_post(
+        app: FastAPI, my_session: SessionSource,
+        timelines: HomeTimelineCache,
+        counters: CounterAggregator,
+        resolver: ApiKeyResolver,
+        hub: StreamHub,
+        graph: FollowGraph,
+        profiles: ProfileCache,
+        coalescer: Optional[WriteCoalescer] = None) -> None:
     """Фабрика роута создания подписки"""
+    get_session = session_dependency(my_session)
+    get_user_id = user_id_dependency(resolver, get_session)
 
     @app.post('/api/users/{following_id}/follow',
               status_code=201, response_model=ResultModel)
-    def follow_user(
-            api_key: str = Header(...), following_id: int = Path(...)
+    async def follow_user(
+            user_id: Optional[int] = Depends(get_user_id),
+            following_id: int = Path(...),
+            session: AnySession = Depends(get_session),
     ) -> ResultModel:
         """
         Создаёт запись подписки на пользователя и сохраняет в базу.
         Получает id пользователя.
         Возвращает сообщение статуса создания подписки.
         """
-        user_id = my_session.query(User.id).filter(
-            cast(ColumnElement[bool], api_key == User.api_key)).scalar()
-        new_follow = Follow(follower_id=user_id,
-                            following_id=following_id)
-        my_session.add(new_follow)
-        try:
-            my_session.flush()
-        except IntegrityError:
-            my_session.rollback()
-            return ResultModel(result=False)
-        my_session.commit()
-        return ResultModel(result=True)
+        if coalescer is not None:
+            result = ResultModel(result=await coalescer.submit(
+                Write(FOLLOW, user_id, following_id, insert=True)))
+        else:
+            result = await run_in_session(
+                session, services.add_follow,
+                timelines, counters, user_id, following_id,
+            )
+        if result.result and user_id is not None:
+            hub.follow(user_id, following_id, following=True)
+            graph.follow(user_id, following_id, following=True)
+            profiles.invalidate(user_id, following_id)
+        return result
 
 
-def connect_routes_follows_delete(app: FastAPI, my_session: Session) -> None:
+def connect_routes_follows_delete(
+        app: FastAPI, my_session: SessionSource,
+        timelines: HomeTimelineCache,
+        counters: CounterAggregator,
+        resolver: ApiKeyResolver,
+        hub: StreamHub,
+        graph: FollowGraph,
+        profiles: ProfileCache,
+        coalescer: Optional[WriteCoalescer] = None) -> None:
     """Фабрика роута удаления подписки"""
+    get_session = session_dependency(my_session)
+    get_user_id = user_id_dependency(resolver, get_session)
 
     @app.delete('/api/users/{following_id}/follow',
                 response_model=ResultModel)
-    def cancel_follow_user(
-            api_key: str = Header(...), following_id: int = Path(...)
+    async def cancel_follow_user(
+            user_id: Optional[int] = Depends(get_user_id),
+            following_id: int = Path(...),
+            session: AnySession = Depends(get_session),
     ) -> ResultModel:
         """
         Удаляет запись подписки на пользователя из базы.
         Получает id пользователя.
         Возвращает сообщение статуса удаления подписки.
         """
-        user_id: int = my_session.query(User.id).filter(
-            cast(ColumnElement[bool], api_key == User.api_key)).scalar()
-        try:
-            my_session.execute(
-                delete(Follow).returning(Follow)
-                .filter(cast(ColumnElement[bool],
-                             user_id == Follow.follower_id))
-                .filter(cast(ColumnElement[bool],
-                             following_id == Follow.following_id))
-            ).one()
-        except NoResultFound:
-            my_session.rollback()
-            return ResultModel(result=False)
-        my_session.commit()
-        return ResultModel(result=True)
+        if coalescer is not None:
+            result = ResultModel(result=await coalescer.submit(
+                Write(FOLLOW, user_id, following_id, insert=False)))
+        else:
+            result = await run_in_session(
+                session, services.delete_follow,
+                timelines, counters, user_id, following_id,
+            )
+        if result.result and user_id is not None:
+            hub.follow(user_id, following_id, following=False)
+            graph.follow(user_id, following_id, following=False)
+            profiles.invalidate(user_id, following_id)
+        return result
 
 
-def connect_routes_tweets_get(app: FastAPI, my_session: Session) -> None:
+async def read_feed_page(
+        session: AnySession,
+        timelines: HomeTimelineCache,
+        counters: CounterAggregator,
+        user_id: Optional[int],
+        limit: int,
+        cursor: Optional[str],
+        ranked: bool,
+        fast_json: bool,
+) -> Union[ResultTweetsModel, Response]:
+    """
+    Выбирает сервис страницы ленты: хронологической или ранжированной,
+    модель pydantic или готовый JSON. Курсор декодируется по виду ленты.
+    Возбуждает InvalidCursorError для курсора другой ленты.
+    """
+    if ranked:
+        return await read_ranked_page(
+            session, counters, user_id, limit,
+            decode_ranked_cursor(cursor) if cursor else None, fast_json)
+    before_id = decode_cursor(cursor) if cursor else None
+    if fast_json:
+        return RawJSONResponse(await run_in_session(
+            session, services.read_feed_json,
+            timelines, counters, user_id, limit, before_id,
+        ))
+    return await run_in_session(
+        session, services.read_feed,
+        timelines, counters, user_id, limit, before_id,
+    )
+
+
+async def read_ranked_page(
+        session: AnySession,
+        counters: CounterAggregator,
+        user_id: Optional[int],
+        limit: int,
+        after: Optional[RankKey],
+        fast_json: bool,
+) -> Union[ResultTweetsModel, Response]:
+    """Выбирает сервис страницы ранжированной ленты"""
+    if fast_json:
+        return RawJSONResponse(await run_in_session(
+            session, services.read_ranked_feed_json,
+            counters, user_id, limit, after,
+        ))
+    return await run_in_session(
+        session, services.read_ranked_feed,
+        counters, user_id, limit, after,
+    )
+
+
+def connect_routes_tweets_get(
+        app: FastAPI, my_session: SessionSource,
+        timelines: HomeTimelineCache,
+        counters: CounterAggregator,
+        resolver: ApiKeyResolver,
+        fast_json: bool = False) -> None:
     """Фабрика роута получения твитов"""
+    get_session = session_dependency(my_session)
+    get_user_id = user_id_dependency(resolver, get_session)
 
     @app.get('/api/tweets',
              response_model=Union[ResultTweetsModel, ResultErrorModel])
-    def get_tweets_list(
-            response: Response, api_key: str = Header(...)
-    ) -> Union[ResultTweetsModel, ResultErrorModel]:
+    async def get_tweets_list(
+            response: Response,
+            user_id: Optional[int] = Depends(get_user_id),
+            limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+            cursor: Optional[str] = Query(None),
+            mode: Literal['chronological', 'ranked'] = Query('chronological'),
+            session: AnySession = Depends(get_session),
+    ) -> Union[ResultTweetsModel, ResultErrorModel, Response]:
         """
-        Возвращает json со списком твитов
+        Возвращает json со страницей твитов
         для ленты этого пользователя из базы данных.
+        Следующая страница запрашивается по курсору next_cursor.
+        mode=ranked упорядочивает ленту по оценке вместо времени.
         В случае любой ошибки возвращает json с описанием ошибки.
         """
         try:
-            user = my_session.query(User).filter(
-                cast(ColumnElement[bool], api_key == User.api_key)).one()
-            tweets = my_session.query(Tweet).filter(
-                cast(ColumnElement[bool], user.id != Tweet.user_id)).all()
-            return ResultTweetsModel(result=True, tweets=tweets)
-        except (NoResultFound, MultipleResultsFound):
+            return await read_feed_page(
+                session, timelines, counters, user_id, limit, cursor,
+                ranked=mode == 'ranked', fast_json=fast_json,
+            )
+        except (NoResultFound, MultipleResultsFound, InvalidCursorError):
             response.status_code = 400
             exc_info = sys.exc_info()
             er_type = str(exc_info[0])
@@ -234,38 +593,620 @@ def connect_routes_tweets_get(app: FastAPI, my_session: Session) -> None:
             )
 
 
-def connect_routes_users_get(app: FastAPI, my_session: Session) -> None:
+def connect_routes_search(
+        app: FastAPI, my_session: SessionSource,
+        counters: CounterAggregator,
+        search: SearchIndex,
+        fast_json: bool = False) -> None:
+    """
+    Фабрика роута полнотекстового поиска твитов.
+    Пока индекс строится, роут отвечает 503.
+    """
+    get_session = session_dependency(my_session)
+    connect_search_index(app=app, my_session=my_session, search=search)
+
+    @app.get('/api/search',
+             response_model=Union[ResultTweetsModel, ResultErrorModel],
+             responses={503: {'model': ResultErrorModel}})
+    async def search_tweets(
+            response: Response,
+            q: str = Query(..., min_length=1, max_length=SEARCH_MAX_QUERY),
+            limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+            cursor: Optional[str] = Query(None),
+            session: AnySession = Depends(get_session),
+    ) -> Union[ResultTweetsModel, ResultErrorModel, Response]:
+        """
+        Возвращает страницу твитов, содержащих все слова запроса q,
+        по убыванию релевантности.
+        Следующая страница запрашивается по курсору next_cursor.
+        """
+        try:
+            offset = decode_cursor(cursor, OFFSET_CURSOR) if cursor else 0
+            if fast_json:
+                return RawJSONResponse(await run_in_session(
+                    session, services.search_tweets_json,
+                    search, counters, q, limit, offset))
+            return await run_in_session(
+                session, services.search_tweets,
+                search, counters, q, limit, offset)
+        except InvalidCursorError as exc:
+            response.status_code = 400
+            return ResultErrorModel(result=False,
+                                    error_type=str(type(exc)),
+                                    error_message=str(exc))
+        except SearchUnavailableError as exc:
+            response.status_code = 503
+            response.headers['Retry-After'] = str(SEARCH_RETRY_AFTER)
+            return ResultErrorModel(result=False,
+                                    error_type=str(type(exc)),
+                                    error_message=str(exc))
+
+
+def connect_search_index(
+        app: FastAPI, my_session: SessionSource,
+        search: SearchIndex) -> None:
+    """
+    Строит поисковый индекс в фоне при запуске приложения,
+    чтобы запуск и другие роуты его не ждали
+    """
+    building: List['asyncio.Future[None]'] = []
+
+    async def start_building() -> None:
+        building.append(asyncio.ensure_future(
+            build_in_background(search, my_session)))
+
+    async def stop_building() -> None:
+        for task in building:
+            task.cancel()
+
+    app.add_event_handler('startup', start_building)
+    app.add_event_handler('shutdown', stop_building)
+
+
+def connect_routes_mentions_get(
+        app: FastAPI, my_session: SessionSource,
+        counters: CounterAggregator,
+        resolver: ApiKeyResolver) -> None:
+    """Фабрика роута ленты упоминаний пользователя"""
+    get_session = session_dependency(my_session)
+    get_user_id = user_id_dependency(resolver, get_session)
+
+    @app.get('/api/users/me/mentions',
+             response_model=Union[ResultTweetsModel, ResultErrorModel])
+    async def get_my_mentions(
+            response: Response,
+            user_id: Optional[int] = Depends(get_user_id),
+            limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+            cursor: Optional[str] = Query(None),
+            session: AnySession = Depends(get_session),
+    ) -> Union[ResultTweetsModel, ResultErrorModel]:
+        """
+        Возвращает страницу твитов, упоминающих этого пользователя
+        через @имя, от новых к старым.
+        Следующая страница запрашивается по курсору next_cursor.
+        """
+        try:
+            before_id = decode_cursor(cursor) if cursor else None
+            return await run_in_session(
+                session, services.read_mentions,
+                counters, user_id, limit, before_id)
+        except (NoResultFound, InvalidCursorError) as exc:
+            response.status_code = 400
+            return ResultErrorModel(result=False,
+                                    error_type=str(type(exc)),
+                                    error_message=str(exc))
+
+
+def connect_routes_suggestions_get(
+        app: FastAPI, my_session: SessionSource,
+        resolver: ApiKeyResolver,
+        graph: FollowGraph) -> None:
+    """
+    Фабрика роута рекомендаций, на кого подписаться.
+    Строит граф подписок при запуске приложения.
+    """
+    get_session = session_dependency(my_session)
+    get_user_id = user_id_dependency(resolver, get_session)
+
+    @app.get('/api/users/me/suggestions',
+             response_model=Union[ResultSuggestionsModel, ResultErrorModel])
+    async def get_my_suggestions(
+            response: Response,
+            user_id: Optional[int] = Depends(get_user_id),
+            limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+            session: AnySession = Depends(get_session),
+    ) -> Union[ResultSuggestionsModel, ResultErrorModel]:
+        """
+        Возвращает друзей друзей этого пользователя
+        по убыванию числа общих подписок
+        """
+        try:
+            return await run_in_session(
+                session, services.read_suggestions, graph, user_id, limit)
+        except NoResultFound as exc:
+            response.status_code = 400
+            return ResultErrorModel(result=False,
+                                    error_type=str(type(exc)),
+                                    error_message=str(exc))
+
+    async def load_graph() -> None:
+        async with any_session_scope(my_session) as session:
+            await run_in_session(session, graph.load)
+
+    app.add_event_handler('startup', load_graph)
+
+
+def connect_routes_trends(
+        app: FastAPI, my_session: SessionSource,
+        trends: TrendingTopics) -> None:
+    """
+    Фабрика роута трендов. Сохраняет снимок трендов
+    при остановке приложения.
+    """
+    get_session = session_dependency(my_session)
+
+    @app.get('/api/trends', response_model=ResultTrendsModel)
+    async def get_trends(
+            limit: int = Query(10, ge=1, le=TRENDS_CANDIDATES),
+            session: AnySession = Depends(get_session),
+    ) -> ResultTrendsModel:
+        """
+        Возвращает самые частые хэштеги скользящего окна
+        с оценками их частоты
+        """
+        return await run_in_session(
+            session, services.read_trends, trends, limit)
+
+    async def save_trends() -> None:
+        async with any_session_scope(my_session) as session:
+            await run_in_session(session, trends.load)
+            await run_in_session(session, trends.snapshot)
+
+    app.add_event_handler('shutdown', save_trends)
+
+
+def connect_routes_users_get(
+        app: FastAPI, my_session: SessionSource,
+        counters: CounterAggregator,
+        resolver: ApiKeyResolver,
+        profiles: ProfileCache,
+        fast_json: bool = False) -> None:
     """Фабрика роутов получения пользователей"""
+    get_session = session_dependency(my_session)
+    get_user_id = user_id_dependency(resolver, get_session)
+    user_models = Union[ResultUserInfoModelOut, ResultUserSummaryModel]
 
-    @app.get('/api/users/me', response_model=ResultUserInfoModelOut)
-    def get_my_info(api_key: str = Header(...)) -> ResultUserInfoModelOut:
+    async def read_user(session: AnySession, user_id: Optional[int],
+                        compact: bool
+                        ) -> Union[ResultUserInfoModelOut, Response]:
+        if compact:
+            return RawJSONResponse(await run_in_session(
+                session, services.read_user_summary,
+                profiles, counters, user_id))
+        if fast_json:
+            return RawJSONResponse(await run_in_session(
+                session, services.read_user_by_id_json, counters, user_id))
+        return await run_in_session(
+            session, services.read_user_by_id, counters, user_id)
+
+    @app.get('/api/users/me', response_model=user_models)
+    async def get_my_info(
+            user_id: Optional[int] = Depends(get_user_id),
+            compact: bool = Query(False),
+            session: AnySession = Depends(get_session),
+    ) -> Union[ResultUserInfoModelOut, Response]:
         """
         Возвращает из базы данных запись профиля текущего пользователя.
         Возвращает json с информацией о пользователе, подписках и подписчиках.
+        С compact=true - краткий профиль из кэша: счётчики
+        и первые подписчики и подписки.
         """
-        user = my_session.query(User).filter(
-            cast(ColumnElement[bool], api_key == User.api_key)).one()
-        return ResultUserInfoModelOut(result=True, user=user)
+        return await read_user(session, user_id, compact)
 
-    @app.get('/api/users/{user_id}', response_model=ResultUserInfoModelOut)
-    def get_any_user_info(user_id: int = Path(...)) -> ResultUserInfoModelOut:
+    @app.get('/api/users/{user_id}', response_model=user_models)
+    async def get_any_user_info(
+            user_id: int = Path(...),
+            compact: bool = Query(False),
+            session: AnySession = Depends(get_session),
+    ) -> Union[ResultUserInfoModelOut, Response]:
         """
         Возвращает из базы данных запись произвольного профиля по его id.
         Получает id пользователя.
         Возвращает json с информацией о пользователе, подписках и подписчиках.
+        С compact=true - краткий профиль из кэша.
+        """
+        return await read_user(session, user_id, compact)
+
+
+def connect_routes_follows_get(
+        app: FastAPI, my_session: SessionSource) -> None:
+    """Фабрика роутов постраничных списков подписчиков и подписок"""
+    get_session = session_dependency(my_session)
+
+    async def read_page(
+            session: AnySession, response: Response, user_id: int,
+            direction: Direction, limit: int, cursor: Optional[str],
+    ) -> Union[ResultUsersModel, ResultErrorModel]:
+        try:
+            before_id = decode_cursor(cursor) if cursor else None
+            return await run_in_session(
+                session, services.read_follows,
+                user_id, direction, limit, before_id)
+        except (NoResultFound, InvalidCursorError) as exc:
+            response.status_code = 400
+            return ResultErrorModel(result=False,
+                                    error_type=str(type(exc)),
+                                    error_message=str(exc))
+
+    @app.get('/api/users/{user_id}/followers',
+             response_model=Union[ResultUsersModel, ResultErrorModel])
+    async def get_followers(
+            response: Response,
+            user_id: int = Path(...),
+            limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+            cursor: Optional[str] = Query(None),
+            session: AnySession = Depends(get_session),
+    ) -> Union[ResultUsersModel, ResultErrorModel]:
+        """
+        Возвращает страницу подписчиков пользователя.
+        Следующая страница запрашивается по курсору next_cursor.
+        """
+        return await read_page(session, response, user_id,
+                               FOLLOWERS, limit, cursor)
+
+    @app.get('/api/users/{user_id}/following',
+             response_model=Union[ResultUsersModel, ResultErrorModel])
+    async def get_following(
+            response: Response,
+            user_id: int = Path(...),
+            limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+            cursor: Optional[str] = Query(None),
+            session: AnySession = Depends(get_session),
+    ) -> Union[ResultUsersModel, ResultErrorModel]:
+        """
+        Возвращает страницу пользователей, на которых подписан
+        пользователь. Следующая страница запрашивается по курсору.
+        """
+        return await read_page(session, response, user_id,
+                               FOLLOWING, limit, cursor)
+
+
+def connect_routes_stream(
+        app: FastAPI, my_session: SessionSource,
+        hub: StreamHub,
+        resolver: ApiKeyResolver,
+        max_duration: float = STREAM_MAX_DURATION) -> None:
+    """Фабрика роута потока событий ленты"""
+    get_session = session_dependency(my_session)
+    get_user_id = user_id_dependency(resolver, get_session)
+
+    @app.get('/api/stream', response_class=StreamingResponse)
+    async def stream_events(
+            user_id: Optional[int] = Depends(get_user_id),
+            session: AnySession = Depends(get_session),
+    ) -> Response:
+        """
+        Открывает поток Server-Sent Events текущего пользователя:
+        новые твиты его подписок (tweet), изменения числа лайков (like)
+        и удаления твитов (delete). Событие resync означает, что часть
+        событий потеряна и ленту нужно перечитать.
+        """
+        if user_id is None:
+            return JSONResponse(status_code=400, content=ResultErrorModel(
+                result=False, error_type='Unauthorized',
+                error_message='Unknown api-key',
+            ).model_dump())
+        following = await run_in_session(
+            session, services.read_following_ids, user_id)
+        try:
+            subscription = hub.subscribe(user_id, following)
+        except StreamFullError:
+            return JSONResponse(status_code=503,
+                                content=ResultModel(result=False).model_dump())
+        return StreamingResponse(
+            sse_events(hub, subscription, max_duration=max_duration),
+            media_type='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+        )
+
+
+def connect_routes_export(
+        app: FastAPI, my_session: SessionSource,
+        admin_keys: Collection[str] = EXPORT_ADMIN_KEYS) -> None:
+    """Фабрика роутов выгрузки данных для администраторов"""
+
+    @app.get('/api/export/{table}', response_class=StreamingResponse,
+             responses={400: {'model': ResultErrorModel},
+                        403: {'model': ResultModel}})
+    async def export_table(
+            table: Literal['tweets', 'likes', 'follows'] = Path(...),
+            after: Optional[str] = Query(None),
+            gzip: bool = Query(False),
+            api_key: str = Header(...),
+    ) -> Response:
+        """
+        Выгружает таблицу в NDJSON по возрастанию первичного ключа.
+        after - ключ последней полученной строки через запятую
+        для продолжения прерванной выгрузки, gzip - сжатие ответа.
+        Доступно только ключам из EXPORT_ADMIN_KEYS.
+        """
+        if api_key not in admin_keys:
+            return JSONResponse(status_code=403,
+                                content=ResultModel(result=False).model_dump())
+        try:
+            key = parse_after(table, after)
+        except ValueError as exc:
+            return JSONResponse(status_code=400, content=ResultErrorModel(
+                result=False, error_type='ValueError',
+                error_message=str(exc),
+            ).model_dump())
+        chunks = stream_export(my_session, table, key)
+        if gzip:
+            return StreamingResponse(gzip_chunks(chunks),
+                                     media_type='application/x-ndjson',
+                                     headers={'Content-Encoding': 'gzip'})
+        return StreamingResponse(chunks, media_type='application/x-ndjson')
+
+
+class StatisticsProvider(Protocol):
+    """Кэш или другой компонент, отдающий счётчики своей работы"""
+
+    def statistics(self) -> Mapping[str, int]:
+        """Возвращает снимок счётчиков"""
+
+
+def connect_routes_stats_get(
+        app: FastAPI, my_session: SessionSource,
+        caches: Mapping[str, StatisticsProvider]) -> None:
+    """Фабрика роутов служебной статистики приложения"""
+    get_session = session_dependency(my_session)
+
+    @app.get('/api/stats/caches', response_model=ResultCacheStatsModel)
+    async def get_cache_stats() -> ResultCacheStatsModel:
+        """Возвращает счётчики попаданий и промахов кэшей процесса"""
+        cache_stats: Dict[str, Mapping[str, int]] = {
+            name: cache.statistics() for name, cache in caches.items()
+        }
+        return ResultCacheStatsModel(result=True, caches=cache_stats)
+
+    @app.get('/api/stats/pool', response_model=ResultPoolStatsModel)
+    async def get_pool_stats(
+            session: AnySession = Depends(get_session),
+    ) -> ResultPoolStatsModel:
+        """
+        Возвращает статистику пула соединений с БД:
+        число выданных соединений и время ожидания свободного соединения.
+        """
+        return await run_in_session(session, services.read_pool_stats)
+
+
+def connect_metrics(
+        app: FastAPI, my_session: SessionSource,
+        caches: Mapping[str, StatisticsProvider]) -> None:
+    """
+    Подключает middleware метрик и роут /metrics
+    в текстовом формате Prometheus
+    """
+    metrics = Metrics()
+    sqlalchemy_engine = source_engine(my_session)
+    if sqlalchemy_engine is not None:
+        metrics.instrument_engine(sqlalchemy_engine)
+    metrics.stats_sources['caches'] = lambda: {
+        name: cache.statistics() for name, cache in caches.items()}
+    app.add_middleware(MetricsMiddleware, metrics=metrics,
+                       routes=lambda: app.router.routes)
+
+    @app.get('/metrics', response_class=PlainTextResponse,
+             include_in_schema=False)
+    async def get_metrics() -> PlainTextResponse:
+        """Возвращает метрики процесса для Prometheus"""
+        return PlainTextResponse(metrics.render(),
+                                 media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+def profile_response(
+        profiler: Profiler, profile_id: str,
+        format: str) -> Union[ResultProfileModel, Response]:
+    """Ответ с профилем запроса в JSON или в формате pstats"""
+    request_profile = profiler.get(profile_id)
+    if request_profile is None:
+        return Response(status_code=404)
+    if format == 'pstats':
+        return Response(
+            request_profile.dump(), media_type='application/octet-stream',
+            headers={'Content-Disposition':
+                     f'attachment; filename="{profile_id}.prof"'})
+    return ResultProfileModel(
+        result=True, profile=ProfileModel(**request_profile.report()))
+
+
+def connect_profiling(
+        app: FastAPI, my_session: SessionSource,
+        profiler: Optional[Profiler] = None) -> None:
+    """
+    Подключает профилирование запросов по заголовку x-profile
+    или по вероятности и роуты чтения профилей
+    """
+    profiler = profiler or Profiler()
+    wrap_threads(in_thread)
+    sqlalchemy_engine = source_engine(my_session)
+    if sqlalchemy_engine is not None:
+        profiler.instrument_engine(sqlalchemy_engine)
+    app.add_middleware(ProfilingMiddleware, profiler=profiler)
+
+    @app.get('/api/profiles', response_model=ResultProfilesModel,
+             responses={403: {'model': ResultModel}},
+             include_in_schema=False)
+    async def list_profiles(
+            token: Optional[str] = Header(None, alias=PROFILE_HEADER),
+    ) -> Union[ResultProfilesModel, JSONResponse]:
+        """Возвращает последние профили запросов, новые первыми"""
+        if not profiler.is_admin(token):
+            return JSONResponse(status_code=403,
+                                content=ResultModel(result=False).model_dump())
+        return ResultProfilesModel(result=True, profiles=[
+            ProfileSummaryModel(**summary) for summary in profiler.list()])
+
+    @app.get('/api/profiles/{profile_id}', response_model=ResultProfileModel,
+             responses={403: {'model': ResultModel}, 404: {}},
+             include_in_schema=False)
+    async def get_profile(
+            profile_id: str = Path(...),
+            format: Literal['json', 'pstats'] = Query('json'),
+            token: Optional[str] = Header(None, alias=PROFILE_HEADER),
+    ) -> Union[ResultProfileModel, Response]:
+        """
+        Возвращает профиль запроса: хронологию SQL и самые дорогие
+        функции, с format=pstats - файл статистики для pstats
         """
-        user = my_session.query(User).filter(
-            cast(ColumnElement[bool], user_id == User.id)).one()
-        return ResultUserInfoModelOut(result=True, user=user)
-
-
-def connect_routes(app: FastAPI, my_session: Session) -> None:
-    """Функция-фабрика подключения роутов к приложению"""
-    connect_routes_tweets_post_delete(app=app, my_session=my_session)
-    connect_routes_medias_post_get(app=app, my_session=my_session)
-    connect_routes_likes_post(app=app, my_session=my_session)
-    connect_routes_likes_delete(app=app, my_session=my_session)
-    connect_routes_follows_post(app=app, my_session=my_session)
-    connect_routes_follows_delete(app=app, my_session=my_session)
-    connect_routes_tweets_get(app=app, my_session=my_session)
-    connect_routes_users_get(app=app, my_session=my_session)
+        if not profiler.is_admin(token):
+            return JSONResponse(status_code=403,
+                                content=ResultModel(result=False).model_dump())
+        return profile_response(profiler, profile_id, format)
+
+
+def connect_jobs(
+        app: FastAPI, jobs: JobQueue,
+        timelines: HomeTimelineCache, search: SearchIndex,
+        processor: MediaProcessor) -> None:
+    """
+    Назначает обработчики фоновых задач, запускает исполнителей
+    при запуске приложения и останавливает их при остановке.
+    Варианты изображений строит асинхронный обработчик: чтение
+    хранилища не занимает цикл событий, а масштабирование идёт
+    в пуле вычислений очереди.
+    """
+
+    def delete_in_background(session: Session,
+                             payload: Dict[str, Any]) -> ResultModel:
+        return services.delete_tweet(session, timelines, search,
+                                     payload['user_id'], payload['tweet_id'])
+
+    async def derive_in_background(session: AnySession,
+                                   payload: Dict[str, Any]) -> int:
+        return await processor.derive_async(
+            session, payload['media_id'], jobs.compute)
+
+    jobs.register(DELETE_TWEET, delete_in_background)
+    jobs.register_async(MEDIA_VARIANTS, derive_in_background)
+    app.add_event_handler('startup', jobs.start)
+    app.add_event_handler('shutdown', jobs.stop)
+
+
+def connect_counters_flush(
+        app: FastAPI, my_session: SessionSource,
+        counters: CounterAggregator) -> None:
+    """
+    Записывает накопленные приращения счётчиков по таймеру,
+    начиная с запуска приложения, и при его остановке
+    """
+
+    async def start_flushing() -> None:
+        await counters.start(my_session)
+
+    async def flush_counters() -> None:
+        await counters.stop()
+        async with any_session_scope(my_session) as session:
+            await run_in_session(session, counters.flush)
+
+    app.add_event_handler('startup', start_flushing)
+    app.add_event_handler('shutdown', flush_counters)
+
+
+def connect_routes(
+        app: FastAPI,
+        my_session: SessionSource,
+        media_storage: Optional[MediaStorage] = None,
+        coalesce_writes: bool = WRITE_COALESCING,
+        fast_json: bool = FAST_JSON,
+        metrics: bool = METRICS,
+        profiling: bool = PROFILING,
+        background_jobs: bool = JOBS,
+) -> None:
+    """
+    Функция-фабрика подключения роутов к приложению.
+    Режим работы роутов определяется источником сессий:
+    Session/sessionmaker - синхронный драйвер в пуле потоков,
+    AsyncSession/async_sessionmaker - асинхронный драйвер.
+    Хранилище медиафайлов по умолчанию выбирается по окружению.
+    coalesce_writes включает объединение лайков и подписок в пачки,
+    fast_json - сборку лент и профилей в JSON без pydantic,
+    metrics - сбор метрик и роут /metrics,
+    profiling - профилирование запросов по требованию,
+    background_jobs - очередь фоновых задач в БД.
+    """
+    timelines = HomeTimelineCache()
+    media_cache = MediaCache()
+    resolver = ApiKeyResolver()
+    counters = CounterAggregator()
+    hub = StreamHub()
+    search = make_search_index(my_session)
+    trends = TrendingTopics()
+    graph = FollowGraph()
+    profiles = ProfileCache()
+    coalescer = WriteCoalescer(my_session, counters, timelines) \
+        if coalesce_writes else None
+    jobs = JobQueue(my_session) if background_jobs else None
+    media_storage = media_storage or make_media_storage()
+    processor = MediaProcessor(media_storage)
+    connect_routes_tweets_post_delete(app=app, my_session=my_session,
+                                      timelines=timelines, counters=counters,
+                                      resolver=resolver, hub=hub,
+                                      search=search, trends=trends,
+                                      jobs=jobs)
+    connect_routes_medias_post_get(
+        app=app, my_session=my_session, media_storage=media_storage,
+        media_cache=media_cache, processor=processor, jobs=jobs,
+    )
+    connect_routes_likes_post(app=app, my_session=my_session,
+                              counters=counters, resolver=resolver,
+                              hub=hub, coalescer=coalescer)
+    connect_routes_likes_delete(app=app, my_session=my_session,
+                                counters=counters, resolver=resolver,
+                                hub=hub, coalescer=coalescer)
+    connect_routes_follows_post(app=app, my_session=my_session,
+                                timelines=timelines, counters=counters,
+                                resolver=resolver, hub=hub,
+                                graph=graph, profiles=profiles,
+                                coalescer=coalescer)
+    connect_routes_follows_delete(app=app, my_session=my_session,
+                                  timelines=timelines, counters=counters,
+                                  resolver=resolver, hub=hub,
+                                  graph=graph, profiles=profiles,
+                                  coalescer=coalescer)
+    connect_routes_tweets_get(app=app, my_session=my_session,
+                              timelines=timelines, counters=counters,
+                              resolver=resolver, fast_json=fast_json)
+    connect_routes_users_get(app=app, my_session=my_session,
+                             counters=counters, resolver=resolver,
+                             profiles=profiles, fast_json=fast_json)
+    connect_routes_follows_get(app=app, my_session=my_session)
+    connect_routes_search(app=app, my_session=my_session,
+                          counters=counters, search=search,
+                          fast_json=fast_json)
+    connect_routes_mentions_get(app=app, my_session=my_session,
+                                counters=counters, resolver=resolver)
+    connect_routes_suggestions_get(app=app, my_session=my_session,
+                                   resolver=resolver, graph=graph)
+    connect_routes_trends(app=app, my_session=my_session, trends=trends)
+    connect_routes_stream(app=app, my_session=my_session,
+                          hub=hub, resolver=resolver)
+    connect_routes_export(app=app, my_session=my_session)
+    caches: Dict[str, StatisticsProvider] = {
+        'media': media_cache, 'auth': resolver, 'counters': counters,
+        'stream': hub, 'search': search, 'trends': trends,
+        'follow_graph': graph, 'profiles': profiles,
+        'media_variants': processor, 'timelines': timelines}
+    if coalescer is not None:
+        caches['writes'] = coalescer
+    if jobs is not None:
+        caches['jobs'] = jobs
+        connect_jobs(app=app, jobs=jobs, timelines=timelines, search=search,
+                     processor=processor)
+    connect_routes_stats_get(app=app, my_session=my_session, caches=caches)
+    if metrics:
+        connect_metrics(app=app, my_session=my_session, caches=caches)
+    if profiling:
+        connect_profiling(app=app, my_session=my_session)
+    connect_counters_flush(app=app, my_session=my_session, counters=counters)
+    app.add_event_handler('shutdown', processor.stop)
@@ -1,7 +1,16 @@
-from typing import List, Optional
+from typing import Dict, List, Mapping, Optional, Union
 
 from pydantic import BaseModel, computed_field
 
+# Вариант изображения, на который ссылаются вложения твитов,
+# см. backend_server.media_variants
+ATTACHMENT_SIZE = 'feed'
+
+
+def media_url(media_id: int) -> str:
+    """Ссылка на вложение твита в размере для ленты"""
+    return f'/api/medias/{media_id}?size={ATTACHMENT_SIZE}'
+
 
 class ResultModel(BaseModel):
     """Возвращает информацию о статусе операции"""
@@ -43,11 +52,12 @@ class TweetModel(BaseModel):
     media_ids: list[int]
     author: UserModel
     likes: List[LikeModel]
+    like_count: int = 0
 
     @computed_field
     def attachments(self) -> Optional[List[str]]:
         return None if not self.media_ids else [
-            f'/api/medias/{media_id}' for media_id in self.media_ids
+            media_url(media_id) for media_id in self.media_ids
         ]
 
     class Config:
@@ -55,8 +65,20 @@ class TweetModel(BaseModel):
 
 
 class ResultTweetsModel(ResultModel):
-    """Возвращает результат и список твитов"""
+    """Возвращает результат, страницу твитов и курсор следующей страницы"""
     tweets: List[TweetModel]
+    next_cursor: Optional[str] = None
+
+
+class TrendModel(BaseModel):
+    """Хэштег и оценка его частоты за окно трендов"""
+    tag: str
+    count: int
+
+
+class ResultTrendsModel(ResultModel):
+    """Возвращает результат и самые частые хэштеги"""
+    trends: List[TrendModel]
 
 
 class ResultErrorModel(ResultModel):
@@ -70,7 +92,96 @@ class UserInfoModel(UserModel):
     """Модель пользователя для возвращения ему"""
     followers: List[UserModel]
     following: List[UserModel]
+    followers_count: int = 0
+    following_count: int = 0
 
 
 class ResultUserInfoModelOut(ResultModel):
     user: UserInfoModel
+
+
+class ResultUsersModel(ResultModel):
+    """Возвращает страницу пользователей и курсор следующей страницы"""
+    users: List[UserModel]
+    next_cursor: Optional[str] = None
+
+
+class UserSummaryModel(UserModel):
+    """
+    Краткий профиль: счётчики, первые подписчики и подписки
+    и курсоры их следующих страниц
+    """
+    followers_count: int
+    following_count: int
+    followers: List[UserModel]
+    following: List[UserModel]
+    followers_cursor: Optional[str] = None
+    following_cursor: Optional[str] = None
+
+
+class ResultUserSummaryModel(ResultModel):
+    """Возвращает краткий профиль пользователя"""
+    user: UserSummaryModel
+
+
+class SuggestionModel(UserModel):
+    """Рекомендуемый пользователь и число общих подписок"""
+    mutual_count: int
+
+
+class ResultSuggestionsModel(ResultModel):
+    """Возвращает результат и рекомендации, на кого подписаться"""
+    users: List[SuggestionModel]
+
+
+class ResultPoolStatsModel(ResultModel):
+    """Возвращает результат и статистику пула соединений с БД"""
+    pool: Dict[str, Union[int, float]]
+
+
+class ResultCacheStatsModel(ResultModel):
+    """Возвращает результат и счётчики кэшей процесса по их именам"""
+    caches: Dict[str, Mapping[str, int]]
+
+
+class ProfileSummaryModel(BaseModel):
+    """Краткое описание профиля запроса"""
+    id: str
+    method: str
+    path: str
+    status: int
+    started_at: float
+    duration_ms: float
+    sql_count: int
+    sql_ms: float
+
+
+class SqlTimelineModel(BaseModel):
+    """SQL-запрос в хронологии профилируемого запроса"""
+    start_ms: float
+    duration_ms: float
+    statement: str
+
+
+class FunctionStatModel(BaseModel):
+    """Статистика функции в профиле запроса"""
+    function: str
+    calls: int
+    total_ms: float
+    cumulative_ms: float
+
+
+class ProfileModel(ProfileSummaryModel):
+    """Профиль запроса: хронология SQL и самые дорогие функции"""
+    sql: List[SqlTimelineModel]
+    functions: List[FunctionStatModel]
+
+
+class ResultProfilesModel(ResultModel):
+    """Возвращает результат и последние профили запросов"""
+    profiles: List[ProfileSummaryModel]
+
+
+class ResultProfileModel(ResultModel):
+    """Возвращает результат и профиль запроса"""
+    profile: ProfileModel
@@ -0,0 +1,337 @@
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter
+from heapq import nlargest
+from itertools import islice
+from typing import (
+    Any,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Protocol,
+    Sequence,
+    Tuple,
+)
+
+from sqlalchemy import Float, func, select
+from sqlalchemy.orm import Session
+
+from backend_server.database import (
+    SessionSource,
+    any_session_scope,
+    run_cpu_bound,
+    run_in_session,
+    source_engine,
+)
+from backend_server.models import SEARCH_CONFIG, Tweet
+
+# Индекс поиска: auto - Postgres для Postgres, иначе в памяти процесса
+SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'auto')
+# Сколько самых новых совпадений ранжируется на запрос:
+# частые слова не заставляют оценивать все твиты
+SEARCH_CANDIDATES = int(os.environ.get('SEARCH_CANDIDATES', '2000'))
+SEARCH_BATCH_SIZE = 10000
+SEARCH_MAX_QUERY = 200
+# Параметры BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Через сколько секунд повторить поиск, пока индекс строится
+SEARCH_RETRY_AFTER = 1
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> List[str]:
+    """Разбивает текст на слова в нижнем регистре"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class SearchUnavailableError(Exception):
+    """Индекс ещё строится и не может отвечать на запросы"""
+
+
+class SearchIndex(Protocol):
+    """Поисковый индекс твитов"""
+
+    def load(self, session: Session) -> None:
+        """Строит индекс из БД, если он ещё не построен"""
+
+    def add(self, tweet_id: int, content: str) -> None:
+        """Индексирует новый или изменённый твит"""
+
+    def remove(self, tweet_id: int) -> None:
+        """Удаляет твит из индекса"""
+
+    def search(self, session: Session, query: str,
+               limit: int, offset: int) -> List[int]:
+        """
+        Возвращает id твитов, содержащих все слова запроса,
+        по убыванию релевантности, начиная с offset.
+        Возбуждает SearchUnavailableError, пока индекс не построен.
+        """
+
+    def statistics(self) -> Mapping[str, int]:
+        """Возвращает снимок счётчиков индекса"""
+
+
+class InvertedIndex:
+    """
+    Инвертированный индекс с оценкой BM25: для каждого слова
+    id твитов и число вхождений. Не потокобезопасен.
+    """
+
+    def __init__(self) -> None:
+        self.postings: Dict[str, Dict[int, int]] = {}
+        # Длина и набор слов каждого твита
+        self.lengths: Dict[int, int] = {}
+        self.terms: Dict[int, Tuple[str, ...]] = {}
+        self.total_length = 0
+
+    def add(self, tweet_id: int, content: str) -> None:
+        """Индексирует твит, заменяя прежнюю версию"""
+        self.remove(tweet_id)
+        tokens = tokenize(content)
+        frequencies = Counter(tokens)
+        for term, frequency in frequencies.items():
+            self.postings.setdefault(term, {})[tweet_id] = frequency
+        self.lengths[tweet_id] = len(tokens)
+        self.terms[tweet_id] = tuple(frequencies)
+        self.total_length += len(tokens)
+
+    def remove(self, tweet_id: int) -> None:
+        """Удаляет твит из индекса, если он там есть"""
+        for term in self.terms.pop(tweet_id, ()):
+            postings = self.postings[term]
+            del postings[tweet_id]
+            if not postings:
+                del self.postings[term]
+        self.total_length -= self.lengths.pop(tweet_id, 0)
+
+    def search(self, terms: List[str], limit: int, offset: int,
+               candidates: int = SEARCH_CANDIDATES) -> List[int]:
+        """
+        Находит твиты со всеми словами, оценивает не больше candidates
+        самых новых из них по BM25 и возвращает страницу id
+        по убыванию оценки, при равенстве - от новых к старым.
+        """
+        lists = []
+        for term in set(terms):
+            posting = self.postings.get(term)
+            if posting is None:
+                return []
+            lists.append(posting)
+        lists.sort(key=len)
+        rarest, others = lists[0], lists[1:]
+        # Твиты добавляются по возрастанию id, обход с конца
+        # выдаёт самые новые совпадения
+        matches = islice((tweet_id for tweet_id in reversed(rarest)
+                          if all(tweet_id in other for other in others)),
+                         candidates)
+        documents = len(self.lengths)
+        average_length = self.total_length / documents
+        weights = [(math.log(1 + (documents - len(posting) + 0.5)
+                             / (len(posting) + 0.5)), posting)
+                   for posting in lists]
+        scored = []
+        for tweet_id in matches:
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[tweet_id]
+                              / average_length)
+            score = sum(idf * posting[tweet_id] * (BM25_K1 + 1)
+                        / (posting[tweet_id] + norm)
+                        for idf, posting in weights)
+            scored.append((score, tweet_id))
+        return [tweet_id for _, tweet_id
+                in nlargest(offset + limit, scored)][offset:]
+
+
+def load_index(session: Session) -> InvertedIndex:
+    """
+    Строит инвертированный индекс всех твитов БД.
+    Пачки строк индексируются через run_cpu_bound.
+    """
+    index = InvertedIndex()
+    result = session.execute(
+        select(Tweet.id, Tweet.content).order_by(Tweet.id)
+        .execution_options(yield_per=SEARCH_BATCH_SIZE))
+    for rows in result.partitions():
+        run_cpu_bound(_add_rows, index, rows)
+    return index
+
+
+def _add_rows(index: InvertedIndex, rows: Sequence[Any]) -> None:
+    for tweet_id, content in rows:
+        index.add(tweet_id, content)
+
+
+async def build_in_background(search: SearchIndex,
+                              my_session: SessionSource) -> None:
+    """
+    Строит индекс при запуске приложения, не задерживая запуск.
+    Ошибка построения записывается в лог.
+    """
+    try:
+        async with any_session_scope(my_session) as session:
+            await run_in_session(session, search.load)
+    except Exception:
+        logger.exception('Failed to build search index')
+
+
+class MemorySearchIndex:
+    """
+    Поисковый индекс в памяти процесса для SQLite и тестов.
+    Строится из БД в фоне при запуске приложения и далее
+    обновляется при создании и удалении твитов. Изменения,
+    пришедшие во время построения, применяются после него.
+    """
+
+    def __init__(self, candidates: int = SEARCH_CANDIDATES) -> None:
+        self.candidates = candidates
+        self._index: Optional[InvertedIndex] = None
+        # Изменения во время построения: (id, текст или None для удаления)
+        self._pending: List[Tuple[int, Optional[str]]] = []
+        self._building = 0
+        self._builds = 0
+        self._queries = 0
+        self._lock = threading.Lock()
+
+    def add(self, tweet_id: int, content: str) -> None:
+        """Индексирует твит, если индекс построен или строится"""
+        self._apply(tweet_id, content)
+
+    def remove(self, tweet_id: int) -> None:
+        """Удаляет твит из индекса"""
+        self._apply(tweet_id, None)
+
+    def _apply(self, tweet_id: int, content: Optional[str]) -> None:
+        with self._lock:
+            if self._index is None:
+                if self._building:
+                    self._pending.append((tweet_id, content))
+                return
+            if content is None:
+                self._index.remove(tweet_id)
+            else:
+                self._index.add(tweet_id, content)
+
+    def search(self, session: Session, query: str,
+               limit: int, offset: int) -> List[int]:
+        """Возвращает страницу id твитов по убыванию оценки BM25"""
+        terms = tokenize(query)
+        if not terms:
+            return []
+        index = self._index
+        if index is None:
+            raise SearchUnavailableError('Search index is being built')
+        return run_cpu_bound(self._score, index, terms, limit, offset)
+
+    def _score(self, index: InvertedIndex, terms: List[str],
+               limit: int, offset: int) -> List[int]:
+        """Ранжирует совпадения по BM25 под блокировкой индекса"""
+        with self._lock:
+            self._queries += 1
+            return index.search(terms, limit, offset, self.candidates)
+
+    def load(self, session: Session) -> None:
+        """
+        Строит индекс из БД, если он ещё не построен, без блокировки,
+        чтобы не задерживать изменения. Из одновременных построений
+        используется первое.
+        """
+        if self._index is not None:
+            return
+        with self._lock:
+            self._building += 1
+        index: Optional[InvertedIndex] = None
+        try:
+            index = load_index(session)
+        finally:
+            with self._lock:
+                self._building -= 1
+                if index is not None and self._index is None:
+                    self._install(index)
+                if not self._building:
+                    self._pending.clear()
+
+    def _install(self, index: InvertedIndex) -> None:
+        """Применяет к построенному индексу отложенные изменения"""
+        for tweet_id, content in self._pending:
+            if content is None:
+                index.remove(tweet_id)
+            else:
+                index.add(tweet_id, content)
+        self._index = index
+        self._builds += 1
+
+    def statistics(self) -> Mapping[str, int]:
+        """Возвращает число твитов и слов индекса, построений и запросов"""
+        with self._lock:
+            index = self._index
+            return {
+                'documents': len(index.lengths) if index else 0,
+                'terms': len(index.postings) if index else 0,
+                'builds': self._builds,
+                'queries': self._queries,
+            }
+
+
+class PostgresSearchIndex:
+    """
+    Поиск средствами Postgres: tsvector содержимого твита
+    по GIN-индексу ix_tweet_content_tsv и ранжирование ts_rank_cd.
+    Индекс обновляется самой БД.
+    """
+
+    def __init__(self, candidates: int = SEARCH_CANDIDATES) -> None:
+        self.candidates = candidates
+        self._queries = 0
+
+    def load(self, session: Session) -> None:
+        """Ничего не делает: индекс строится БД"""
+
+    def add(self, tweet_id: int, content: str) -> None:
+        """Ничего не делает: индекс обновляется БД"""
+
+    def remove(self, tweet_id: int) -> None:
+        """Ничего не делает: индекс обновляется БД"""
+
+    def search(self, session: Session, query: str,
+               limit: int, offset: int) -> List[int]:
+        """
+        Ранжирует не больше candidates самых новых совпадений
+        и возвращает страницу id по убыванию оценки
+        """
+        if not tokenize(query):
+            return []
+        self._queries += 1
+        vector = func.to_tsvector(SEARCH_CONFIG, Tweet.content)
+        ts_query = func.plainto_tsquery(SEARCH_CONFIG, query)
+        matches = select(Tweet.id, vector.label('vector')) \
+            .where(vector.bool_op('@@')(ts_query)) \
+            .order_by(Tweet.id.desc()).limit(self.candidates).subquery()
+        rank = func.ts_rank_cd(matches.c.vector, ts_query, type_=Float)
+        return list(session.scalars(
+            select(matches.c.id).order_by(rank.desc(), matches.c.id.desc())
+            .limit(limit).offset(offset)))
+
+    def statistics(self) -> Mapping[str, int]:
+        """Возвращает число запросов"""
+        return {'queries': self._queries}
+
+
+def make_search_index(my_session: SessionSource) -> SearchIndex:
+    """
+    Выбирает поисковый индекс по SEARCH_BACKEND:
+    auto - Postgres для БД Postgres, иначе индекс в памяти
+    """
+    sqlalchemy_engine = source_engine(my_session)
+    if SEARCH_BACKEND == 'postgres' or SEARCH_BACKEND == 'auto' \
+            and sqlalchemy_engine is not None \
+            and sqlalchemy_engine.dialect.name == 'postgresql':
+        return PostgresSearchIndex()
+    return MemorySearchIndex()
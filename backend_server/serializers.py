@@ -0,0 +1,127 @@
+import os
+from typing import Any, Dict, List, Optional, Sequence, cast
+
+import orjson
+from fastapi import Response
+from sqlalchemy import ColumnElement, select
+from sqlalchemy.exc import NoResultFound
+from sqlalchemy.orm import Session
+
+from backend_server.counters import (
+    FOLLOWERS_COUNT,
+    FOLLOWING_COUNT,
+    LIKE_COUNT,
+    CounterAggregator,
+)
+from backend_server.models import Follow, Like, Tweet, User
+from backend_server.schemas import media_url
+
+# Ленты и профили собираются из строк и кодируются без pydantic
+FAST_JSON = os.environ.get('FAST_JSON', '0') == '1'
+
+
+class RawJSONResponse(Response):
+    """Ответ с телом, уже закодированным в JSON"""
+    media_type = 'application/json'
+
+
+def dumps(content: Any) -> bytes:
+    """
+    Кодирует JSON байт в байт как JSONResponse FastAPI:
+    без пробелов и с не-ASCII символами как есть.
+    """
+    return orjson.dumps(content)
+
+
+def tweets_payload(
+        my_session: Session,
+        counters: CounterAggregator,
+        tweet_ids: List[int],
+) -> List[Dict[str, Any]]:
+    """
+    Собирает твиты в порядке tweet_ids из строк двух запросов
+    без создания объектов ORM. Форма и порядок ключей совпадают
+    с TweetModel.
+    """
+    likes: Dict[int, List[Dict[str, Any]]] = {}
+    for tweet_id, user_id, name in my_session.execute(
+            select(Like.tweet_id, Like.user_id, User.name)
+            .outerjoin(User, User.id == Like.user_id)
+            .where(Like.tweet_id.in_(tweet_ids))):
+        likes.setdefault(tweet_id, []).append(
+            {'user_id': user_id, 'name': name})
+    tweets = {}
+    for tweet_id, content, media_ids, like_count, author_id, author_name \
+            in my_session.execute(
+                select(Tweet.id, Tweet.content, Tweet.media_ids,
+                       Tweet.like_count, User.id, User.name)
+                .join(User, User.id == Tweet.user_id)
+                .where(Tweet.id.in_(tweet_ids))):
+        tweets[tweet_id] = {
+            'id': tweet_id,
+            'content': content,
+            'media_ids': media_ids,
+            'author': {'id': author_id, 'name': author_name},
+            'likes': likes.get(tweet_id, []),
+            'like_count': like_count + counters.pending(LIKE_COUNT, tweet_id),
+            'attachments': [media_url(media_id)
+                            for media_id in media_ids] or None,
+        }
+    return [tweets[tweet_id] for tweet_id in tweet_ids
+            if tweet_id in tweets]
+
+
+def tweets_page_json(
+        my_session: Session,
+        counters: CounterAggregator,
+        tweet_ids: List[int],
+        next_cursor: Optional[str],
+) -> bytes:
+    """Кодирует страницу ленты в форме ResultTweetsModel"""
+    return dumps({
+        'result': True,
+        'tweets': tweets_payload(my_session, counters, tweet_ids),
+        'next_cursor': next_cursor,
+    })
+
+
+def user_json(
+        my_session: Session,
+        counters: CounterAggregator,
+        user_id: Optional[int],
+) -> bytes:
+    """
+    Кодирует профиль пользователя в форме ResultUserInfoModelOut.
+    Возбуждает NoResultFound, если пользователь не найден.
+    """
+    row = my_session.execute(
+        select(User.id, User.name,
+               User.followers_count, User.following_count)
+        .where(cast(ColumnElement[bool], user_id == User.id))
+    ).one_or_none()
+    if row is None:
+        raise NoResultFound('No row was found when one was required')
+    found_id, name, followers_count, following_count = row
+    followers = my_session.execute(
+        select(User.id, User.name)
+        .join(Follow, Follow.follower_id == User.id)
+        .where(cast(ColumnElement[bool], found_id == Follow.following_id))
+    ).all()
+    following = cast(Sequence[Any], my_session.scalars(
+        select(Follow.following_id).where(
+            cast(ColumnElement[bool], found_id == Follow.follower_id))
+    ).all())
+    # UserModel подписки читает id и name через прокси Follow.id/name,
+    # которые ссылаются на подписчика, то есть на самого пользователя
+    author = {'id': found_id, 'name': name}
+    return dumps({'result': True, 'user': {
+        'id': found_id,
+        'name': name,
+        'followers': [{'id': follower_id, 'name': follower_name}
+                      for follower_id, follower_name in followers],
+        'following': [author for _ in following],
+        'followers_count':
+            followers_count + counters.pending(FOLLOWERS_COUNT, found_id),
+        'following_count':
+            following_count + counters.pending(FOLLOWING_COUNT, found_id),
+    }})
@@ -0,0 +1,658 @@
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple, cast
+
+from sqlalchemy import ColumnElement, and_, delete, select
+from sqlalchemy.exc import IntegrityError, NoResultFound
+from sqlalchemy.orm import Session, joinedload, selectinload
+
+from backend_server.counters import (
+    FOLLOWERS_COUNT,
+    FOLLOWING_COUNT,
+    LIKE_COUNT,
+    CounterAggregator,
+)
+from backend_server.database import pool_statistics, run_cpu_bound
+from backend_server.follow_graph import FollowGraph
+from backend_server.jobs import DELETE_TWEET, MEDIA_VARIANTS, JobQueue
+from backend_server.media_storage import MediaFile, blob_key
+from backend_server.media_variants import ImageInfo, needs_variant
+from backend_server.models import (
+    Follow,
+    Like,
+    Media,
+    MediaVariant,
+    Mention,
+    Tweet,
+    User,
+)
+from backend_server.pagination import (
+    OFFSET_CURSOR,
+    encode_cursor,
+    encode_ranked_cursor,
+)
+from backend_server.ranking import RankKey, ranked_page
+from backend_server.schemas import (
+    ResultMediaModel,
+    ResultModel,
+    ResultPoolStatsModel,
+    ResultSuggestionsModel,
+    ResultTrendsModel,
+    ResultTweetModel,
+    ResultTweetsModel,
+    ResultUserInfoModelOut,
+    ResultUsersModel,
+    SuggestionModel,
+    TrendModel,
+)
+from backend_server.search import SearchIndex
+from backend_server.serializers import (
+    tweets_page_json,
+    tweets_payload,
+    user_json,
+)
+from backend_server.timeline import HomeTimelineCache
+from backend_server.trends import (
+    TrendingTopics,
+    extract_hashtags,
+    extract_mentions,
+)
+from backend_server.user_profiles import Direction, ProfileCache, follow_page
+
+
+def load_tweets(my_session: Session, tweet_ids: List[int]) -> List[Tweet]:
+    """
+    Загружает твиты по списку id с сохранением порядка списка.
+    Авторы и лайки подгружаются заранее фиксированным числом запросов.
+    """
+    tweets_by_id = {
+        tweet.id: tweet for tweet in my_session.query(Tweet).options(
+            joinedload(Tweet.author),
+            selectinload(Tweet.likes).joinedload(Like.user_who_liked),
+        ).filter(Tweet.id.in_(tweet_ids))
+    }
+    return [tweets_by_id[tweet_id] for tweet_id in tweet_ids
+            if tweet_id in tweets_by_id]
+
+
+def add_tweet(
+        my_session: Session,
+        timelines: HomeTimelineCache,
+        search: SearchIndex,
+        trends: TrendingTopics,
+        user_id: Optional[int],
+        tweet_data: str,
+        tweet_media_ids: Optional[List[int]],
+) -> ResultTweetModel:
+    """
+    Сохраняет новый твит с упоминаниями пользователей,
+    рассылает его по лентам подписчиков, добавляет в поисковый
+    индекс и учитывает его хэштеги в трендах
+    """
+    new_tweet = Tweet(content=tweet_data,
+                      media_ids=tweet_media_ids,
+                      user_id=user_id)
+    names = extract_mentions(tweet_data)
+    if names:
+        new_tweet.mentioned_users = list(my_session.scalars(
+            select(User).where(User.name.in_(names))))
+    my_session.add(new_tweet)
+    my_session.commit()
+    timelines.fan_out(my_session, cast(int, new_tweet.id), user_id)
+    search.add(cast(int, new_tweet.id), tweet_data)
+    trends.load(my_session)
+    trends.record(extract_hashtags(tweet_data))
+    trends.snapshot_due(my_session)
+    return ResultTweetModel(result=True, tweet_id=new_tweet.id)
+
+
+def delete_tweet(
+        my_session: Session,
+        timelines: HomeTimelineCache,
+        search: SearchIndex,
+        user_id: Optional[int],
+        tweet_id: int,
+) -> ResultModel:
+    """
+    Удаляет твит пользователя и убирает его из лент подписчиков
+    и поискового индекса.
+    Возбуждает PermissionError, если твит принадлежит другому автору.
+    """
+    try:
+        deleting_tweet = my_session.query(Tweet).filter(
+            cast(ColumnElement[bool], tweet_id == Tweet.id)).one()
+    except NoResultFound:
+        return ResultModel(result=False)
+    if deleting_tweet.user_id != user_id:
+        raise PermissionError
+    my_session.delete(deleting_tweet)
+    my_session.commit()
+    timelines.remove(my_session, tweet_id, user_id)
+    search.remove(tweet_id)
+    return ResultModel(result=True)
+
+
+def enqueue_delete_tweet(
+        my_session: Session,
+        jobs: JobQueue,
+        user_id: Optional[int],
+        tweet_id: int,
+) -> ResultModel:
+    """
+    Проверяет автора твита и ставит удаление твита
+    в очередь фоновых задач.
+    Возбуждает PermissionError, если твит принадлежит другому автору.
+    """
+    row = my_session.execute(select(Tweet.user_id).where(
+        cast(ColumnElement[bool], tweet_id == Tweet.id))).one_or_none()
+    if row is None:
+        return ResultModel(result=False)
+    if row.user_id != user_id:
+        raise PermissionError
+    jobs.enqueue(my_session, DELETE_TWEET,
+                 {'user_id': user_id, 'tweet_id': tweet_id})
+    my_session.commit()
+    return ResultModel(result=True)
+
+
+def add_media(
+        my_session: Session,
+        sha256: str,
+        size: int,
+        info: Optional[ImageInfo] = None,
+        jobs: Optional[JobQueue] = None,
+) -> ResultMediaModel:
+    """
+    Сохраняет метаданные медиафайла, уже записанного в хранилище,
+    с типом и размерами изображения. С очередью задач в той же
+    транзакции ставит задачу построения вариантов.
+    """
+    new_media = Media(sha256=sha256, size=size,
+                      mime=info.mime if info else None,
+                      width=info.width if info else None,
+                      height=info.height if info else None)
+    my_session.add(new_media)
+    if jobs is not None:
+        my_session.flush()
+        jobs.enqueue(my_session, MEDIA_VARIANTS, {'media_id': new_media.id})
+    my_session.commit()
+    return ResultMediaModel(result=True, media_id=new_media.id)
+
+
+def media_file(sha256: Optional[str], size: Optional[int],
+               content: Optional[bytes], mime: Optional[str]) -> MediaFile:
+    """
+    Метаданные медиафайла по строке media. Для записей,
+    ещё не перенесённых в хранилище, - вместе с содержимым
+    из столбца media.file.
+    """
+    if sha256 is None:
+        content = content or b''
+        return MediaFile(sha256=blob_key(content), size=len(content),
+                         content=content, stored=False, mime=mime)
+    return MediaFile(sha256=sha256, size=size or 0, mime=mime)
+
+
+def read_media(my_session: Session, media_id: int) -> Optional[MediaFile]:
+    """
+    Возвращает метаданные медиафайла.
+    Для записей, ещё не перенесённых в хранилище, возвращает
+    и содержимое из столбца media.file.
+    """
+    row = my_session.query(
+        Media.sha256, Media.size, Media.file, Media.mime).filter(
+        cast(ColumnElement[bool], media_id == Media.id)).one_or_none()
+    if row is None:
+        return None
+    return media_file(*row)
+
+
+def read_media_variant(
+        my_session: Session, media_id: int,
+        name: str, max_side: int) -> Tuple[Optional[MediaFile], bool]:
+    """
+    Возвращает метаданные варианта изображения, а если его нет -
+    оригинала, одним запросом. Второй элемент - окончателен ли
+    ответ: False, пока вариант ещё может быть построен.
+    """
+    row = my_session.execute(
+        select(Media.sha256, Media.size, Media.file, Media.mime,
+               Media.width, Media.height, MediaVariant.sha256.label('key'),
+               MediaVariant.size.label('variant_size'),
+               MediaVariant.mime.label('variant_mime'))
+        .outerjoin(MediaVariant, and_(MediaVariant.media_id == Media.id,
+                                      MediaVariant.name == name))
+        .where(cast(ColumnElement[bool], media_id == Media.id))
+    ).one_or_none()
+    if row is None:
+        return None, True
+    if row.key is not None:
+        return MediaFile(sha256=row.key, size=row.variant_size,
+                         mime=row.variant_mime), True
+    info = ImageInfo(row.mime, row.width, row.height) \
+        if row.mime is not None else None
+    return media_file(row.sha256, row.size, row.file, row.mime), \
+        not needs_variant(info, max_side)
+
+
+def add_like(
+        my_session: Session,
+        counters: CounterAggregator,
+        user_id: Optional[int],
+        tweet_id: int,
+) -> ResultModel:
+    """Сохраняет лайк твита пользователем и наращивает счётчик лайков"""
+    new_like = Like(tweet_id=tweet_id,
+                    user_id=user_id)
+    my_session.add(new_like)
+    try:
+        my_session.flush()
+    except IntegrityError:
+        my_session.rollback()
+        return ResultModel(result=False)
+    my_session.commit()
+    counters.add(LIKE_COUNT, tweet_id, 1)
+    counters.flush_due(my_session)
+    return ResultModel(result=True)
+
+
+def delete_like(
+        my_session: Session,
+        counters: CounterAggregator,
+        user_id: Optional[int],
+        tweet_id: int,
+) -> ResultModel:
+    """Удаляет лайк твита пользователем и уменьшает счётчик лайков"""
+    try:
+        my_session.execute(
+            delete(Like).returning(Like)
+            .filter(cast(ColumnElement[bool], user_id == Like.user_id))
+            .filter(cast(ColumnElement[bool], tweet_id == Like.tweet_id))
+        ).one()
+    except NoResultFound:
+        my_session.rollback()
+        return ResultModel(result=False)
+    my_session.commit()
+    counters.add(LIKE_COUNT, tweet_id, -1)
+    counters.flush_due(my_session)
+    return ResultModel(result=True)
+
+
+def add_follow(
+        my_session: Session,
+        timelines: HomeTimelineCache,
+        counters: CounterAggregator,
+        user_id: Optional[int],
+        following_id: int,
+) -> ResultModel:
+    """
+    Сохраняет подписку пользователя на другого пользователя
+    и наращивает счётчики подписчиков и подписок
+    """
+    new_follow = Follow(follower_id=user_id,
+                        following_id=following_id)
+    my_session.add(new_follow)
+    try:
+        my_session.flush()
+    except IntegrityError:
+        my_session.rollback()
+        return ResultModel(result=False)
+    my_session.commit()
+    counters.add(FOLLOWERS_COUNT, following_id, 1)
+    counters.add(FOLLOWING_COUNT, user_id, 1)
+    counters.flush_due(my_session)
+    timelines.invalidate(user_id)
+    return ResultModel(result=True)
+
+
+def delete_follow(
+        my_session: Session,
+        timelines: HomeTimelineCache,
+        counters: CounterAggregator,
+        user_id: Optional[int],
+        following_id: int,
+) -> ResultModel:
+    """
+    Удаляет подписку пользователя на другого пользователя
+    и уменьшает счётчики подписчиков и подписок
+    """
+    try:
+        my_session.execute(
+            delete(Follow).returning(Follow)
+            .filter(cast(ColumnElement[bool],
+                         user_id == Follow.follower_id))
+            .filter(cast(ColumnElement[bool],
+                         following_id == Follow.following_id))
+        ).one()
+    except NoResultFound:
+        my_session.rollback()
+        return ResultModel(result=False)
+    my_session.commit()
+    counters.add(FOLLOWERS_COUNT, following_id, -1)
+    counters.add(FOLLOWING_COUNT, user_id, -1)
+    counters.flush_due(my_session)
+    timelines.invalidate(user_id)
+    return ResultModel(result=True)
+
+
+def feed_ids(
+        my_session: Session,
+        timelines: HomeTimelineCache,
+        user_id: Optional[int],
+        limit: int,
+        before_id: Optional[int],
+) -> Tuple[List[int], Optional[str]]:
+    """
+    Возвращает id твитов страницы ленты пользователя
+    и курсор следующей страницы.
+    Возбуждает NoResultFound, если пользователь не найден.
+    """
+    if user_id is None:
+        raise NoResultFound('No row was found when one was required')
+    tweet_ids = timelines.page(my_session, user_id,
+                               limit=limit, before_id=before_id)
+    next_cursor = encode_cursor(tweet_ids[-1]) \
+        if len(tweet_ids) == limit else None
+    return tweet_ids, next_cursor
+
+
+def ranked_feed_ids(
+        my_session: Session,
+        counters: CounterAggregator,
+        user_id: Optional[int],
+        limit: int,
+        after: Optional[RankKey],
+) -> Tuple[List[int], Optional[str]]:
+    """
+    Возвращает id твитов страницы ранжированной ленты пользователя
+    после ключа after и курсор следующей страницы, хранящий
+    оценку и id её последнего твита.
+    Возбуждает NoResultFound, если пользователь не найден.
+    """
+    if user_id is None:
+        raise NoResultFound('No row was found when one was required')
+    keys = ranked_page(my_session, user_id, limit=limit, after=after,
+                       pending_likes=counters.pending_by_key(LIKE_COUNT))
+    next_cursor = encode_ranked_cursor(*keys[-1]) \
+        if len(keys) == limit else None
+    return [tweet_id for _, tweet_id in keys], next_cursor
+
+
+def read_feed(
+        my_session: Session,
+        timelines: HomeTimelineCache,
+        counters: CounterAggregator,
+        user_id: Optional[int],
+        limit: int,
+        before_id: Optional[int],
+) -> ResultTweetsModel:
+    """Возвращает страницу ленты пользователя"""
+    return tweets_page(my_session, counters, *feed_ids(
+        my_session, timelines, user_id, limit, before_id))
+
+
+def read_feed_json(
+        my_session: Session,
+        timelines: HomeTimelineCache,
+        counters: CounterAggregator,
+        user_id: Optional[int],
+        limit: int,
+        before_id: Optional[int],
+) -> bytes:
+    """Возвращает страницу ленты пользователя готовым JSON"""
+    return tweets_page_json(my_session, counters, *feed_ids(
+        my_session, timelines, user_id, limit, before_id))
+
+
+def read_ranked_feed(
+        my_session: Session,
+        counters: CounterAggregator,
+        user_id: Optional[int],
+        limit: int,
+        after: Optional[RankKey],
+) -> ResultTweetsModel:
+    """Возвращает страницу ранжированной ленты пользователя"""
+    return tweets_page(my_session, counters, *ranked_feed_ids(
+        my_session, counters, user_id, limit, after))
+
+
+def read_ranked_feed_json(
+        my_session: Session,
+        counters: CounterAggregator,
+        user_id: Optional[int],
+        limit: int,
+        after: Optional[RankKey],
+) -> bytes:
+    """Возвращает страницу ранжированной ленты пользователя готовым JSON"""
+    return tweets_page_json(my_session, counters, *ranked_feed_ids(
+        my_session, counters, user_id, limit, after))
+
+
+def tweets_page(
+        my_session: Session,
+        counters: CounterAggregator,
+        tweet_ids: List[int],
+        next_cursor: Optional[str],
+) -> ResultTweetsModel:
+    """
+    Загружает твиты страницы ленты в заданном порядке.
+    Счётчики лайков учитывают ещё не записанные в БД приращения.
+    """
+    return run_cpu_bound(tweets_model, load_tweets(my_session, tweet_ids),
+                         next_cursor, counters.pending_by_key(LIKE_COUNT))
+
+
+def tweets_model(
+        tweets: List[Tweet],
+        next_cursor: Optional[str],
+        pending_likes: Mapping[int, int],
+) -> ResultTweetsModel:
+    """
+    Строит модель страницы из загруженных твитов. Выполняется
+    через run_cpu_bound и не обращается к сессии.
+    """
+    result = ResultTweetsModel(result=True, tweets=tweets,
+                               next_cursor=next_cursor)
+    for tweet in result.tweets:
+        tweet.like_count += pending_likes.get(tweet.id, 0)
+    return result
+
+
+def search_ids(
+        my_session: Session,
+        search: SearchIndex,
+        query: str,
+        limit: int,
+        offset: int,
+) -> Tuple[List[int], Optional[str]]:
+    """
+    Возвращает id твитов страницы результатов поиска
+    и курсор следующей страницы, хранящий её смещение
+    """
+    tweet_ids = search.search(my_session, query, limit, offset)
+    next_cursor = encode_cursor(offset + limit, OFFSET_CURSOR) \
+        if len(tweet_ids) == limit else None
+    return tweet_ids, next_cursor
+
+
+def search_tweets(
+        my_session: Session,
+        search: SearchIndex,
+        counters: CounterAggregator,
+        query: str,
+        limit: int,
+        offset: int,
+) -> ResultTweetsModel:
+    """Возвращает страницу результатов поиска твитов"""
+    return tweets_page(my_session, counters, *search_ids(
+        my_session, search, query, limit, offset))
+
+
+def search_tweets_json(
+        my_session: Session,
+        search: SearchIndex,
+        counters: CounterAggregator,
+        query: str,
+        limit: int,
+        offset: int,
+) -> bytes:
+    """Возвращает страницу результатов поиска твитов готовым JSON"""
+    return tweets_page_json(my_session, counters, *search_ids(
+        my_session, search, query, limit, offset))
+
+
+def read_mentions(
+        my_session: Session,
+        counters: CounterAggregator,
+        user_id: Optional[int],
+        limit: int,
+        before_id: Optional[int],
+) -> ResultTweetsModel:
+    """
+    Возвращает страницу твитов, упоминающих пользователя,
+    от новых к старым.
+    Возбуждает NoResultFound, если пользователь не найден.
+    """
+    if user_id is None:
+        raise NoResultFound('No row was found when one was required')
+    query = select(Mention.tweet_id).where(
+        cast(ColumnElement[bool], user_id == Mention.user_id))
+    if before_id is not None:
+        query = query.where(Mention.tweet_id < before_id)
+    tweet_ids = cast(List[int], list(my_session.scalars(
+        query.order_by(Mention.tweet_id.desc()).limit(limit))))
+    next_cursor = encode_cursor(tweet_ids[-1]) \
+        if len(tweet_ids) == limit else None
+    return tweets_page(my_session, counters, tweet_ids, next_cursor)
+
+
+def read_trends(my_session: Session, trends: TrendingTopics,
+                limit: int) -> ResultTrendsModel:
+    """Возвращает самые частые хэштеги скользящего окна"""
+    trends.load(my_session)
+    return ResultTrendsModel(result=True, trends=[
+        TrendModel(tag=tag, count=count) for tag, count in trends.top(limit)])
+
+
+def read_suggestions(
+        my_session: Session,
+        graph: FollowGraph,
+        user_id: Optional[int],
+        limit: int,
+) -> ResultSuggestionsModel:
+    """
+    Возвращает пользователей, на которых подписаны подписки
+    пользователя, по убыванию числа общих подписок.
+    Возбуждает NoResultFound, если пользователь не найден.
+    """
+    if user_id is None:
+        raise NoResultFound('No row was found when one was required')
+    graph.load(my_session)
+    suggestions = run_cpu_bound(graph.suggest, user_id, limit)
+    names = dict(my_session.execute(
+        select(User.id, User.name).where(
+            User.id.in_([suggested for suggested, _ in suggestions]))
+    ).tuples().all())
+    return ResultSuggestionsModel(result=True, users=[
+        SuggestionModel(id=suggested, name=names[suggested],
+                        mutual_count=mutual_count)
+        for suggested, mutual_count in suggestions if suggested in names])
+
+
+def read_user_by_id(
+        my_session: Session,
+        counters: CounterAggregator,
+        user_id: Optional[int],
+) -> ResultUserInfoModelOut:
+    """
+    Возвращает профиль пользователя по его id.
+    Счётчики подписчиков и подписок учитывают ещё не записанные приращения.
+    Подписки и подписчики с их именами загружаются заранее,
+    а не отдельным запросом на каждого подписчика при сериализации.
+    """
+    user = my_session.query(User).options(
+        selectinload(User.followers).joinedload(Follow.follower),
+        selectinload(User.following),
+    ).filter(cast(ColumnElement[bool], user_id == User.id)).one()
+    result = run_cpu_bound(ResultUserInfoModelOut, result=True, user=user)
+    result.user.followers_count += counters.pending(
+        FOLLOWERS_COUNT, result.user.id)
+    result.user.following_count += counters.pending(
+        FOLLOWING_COUNT, result.user.id)
+    return result
+
+
+def read_user_by_id_json(
+        my_session: Session,
+        counters: CounterAggregator,
+        user_id: Optional[int],
+) -> bytes:
+    """
+    Возвращает профиль пользователя по его id готовым JSON.
+    Возбуждает NoResultFound, если пользователь не найден.
+    """
+    return user_json(my_session, counters, user_id)
+
+
+def read_user_summary(
+        my_session: Session,
+        profiles: ProfileCache,
+        counters: CounterAggregator,
+        user_id: Optional[int],
+) -> bytes:
+    """
+    Возвращает краткий профиль пользователя готовым JSON.
+    Возбуждает NoResultFound, если пользователь не найден.
+    """
+    if user_id is None:
+        raise NoResultFound('No row was found when one was required')
+    return profiles.summary(my_session, counters, user_id)
+
+
+def read_follows(
+        my_session: Session,
+        user_id: int,
+        direction: Direction,
+        limit: int,
+        before_id: Optional[int],
+) -> ResultUsersModel:
+    """
+    Возвращает страницу подписчиков или подписок пользователя.
+    Возбуждает NoResultFound, если пользователь не найден.
+    """
+    users, next_cursor = follow_page(
+        my_session, user_id, direction, limit, before_id)
+    if not users and my_session.scalar(select(User.id).where(
+            cast(ColumnElement[bool], user_id == User.id))) is None:
+        raise NoResultFound('No row was found when one was required')
+    return ResultUsersModel(result=True, users=users,
+                            next_cursor=next_cursor)
+
+
+def read_following_ids(
+        my_session: Session, user_id: int) -> List[int]:
+    """Возвращает id пользователей, на которых подписан пользователь"""
+    return list(cast(Sequence[int], my_session.scalars(
+        select(Follow.following_id).where(
+            cast(ColumnElement[bool], user_id == Follow.follower_id))
+    ).all()))
+
+
+def read_tweet_payload(
+        my_session: Session,
+        counters: CounterAggregator,
+        tweet_id: int,
+) -> Optional[Dict[str, Any]]:
+    """Возвращает твит в форме TweetModel для публикации в поток"""
+    tweets = tweets_payload(my_session, counters, [tweet_id])
+    return tweets[0] if tweets else None
+
+
+def read_tweet_author(my_session: Session, tweet_id: int) -> Optional[int]:
+    """Возвращает id автора твита или None, если твита нет"""
+    return my_session.scalar(select(Tweet.user_id).where(
+        cast(ColumnElement[bool], tweet_id == Tweet.id)))
+
+
+def read_pool_stats(my_session: Session) -> ResultPoolStatsModel:
+    """Возвращает статистику пула соединений двигателя сессии"""
+    return ResultPoolStatsModel(
+        result=True, pool=pool_statistics(my_session.get_bind().engine))
@@ -0,0 +1,206 @@
+import asyncio
+import os
+import threading
+from collections import deque
+from typing import (
+    AsyncIterator,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    Set,
+    Tuple,
+)
+
+from backend_server.serializers import dumps
+
+# Сколько соединений /api/stream может быть открыто одновременно
+STREAM_MAX_SUBSCRIBERS = int(os.environ.get('STREAM_MAX_SUBSCRIBERS', '1000'))
+# Сколько событий ждёт отправки в одном соединении
+STREAM_QUEUE_SIZE = int(os.environ.get('STREAM_QUEUE_SIZE', '256'))
+# Как часто отправлять комментарий-пинг в простаивающее соединение, секунды
+STREAM_HEARTBEAT = float(os.environ.get('STREAM_HEARTBEAT', '15'))
+# Через сколько секунд закрывать соединение (0 - не закрывать),
+# EventSource клиента переподключается автоматически
+STREAM_MAX_DURATION = float(os.environ.get('STREAM_MAX_DURATION', '0'))
+
+# Событие потока: (тип, данные JSON)
+Event = Tuple[str, bytes]
+RESYNC: Event = ('resync', b'{}')
+
+
+class StreamFullError(Exception):
+    """Открыто максимальное число соединений потока"""
+
+
+class Subscription:
+    """
+    Подписка одного соединения на события хаба.
+    События копятся в ограниченной очереди. Если клиент не успевает
+    их забирать, очередь сбрасывается и клиент получает одно
+    событие resync, после которого должен перечитать ленту.
+    Публикация безопасна из любого потока.
+    """
+
+    def __init__(self, user_id: int, following: Iterable[int],
+                 queue_size: int, loop: asyncio.AbstractEventLoop) -> None:
+        self.user_id = user_id
+        self.following: Set[int] = set(following)
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._events: Deque[Event] = deque()
+        self._lock = threading.Lock()
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+
+    def push(self, event: Event) -> None:
+        """Добавляет событие в очередь и будит ожидающее соединение"""
+        with self._lock:
+            if self._events and self._events[0] == RESYNC:
+                self.dropped += 1
+            elif len(self._events) >= self.queue_size:
+                self.dropped += len(self._events) + 1
+                self._events.clear()
+                self._events.append(RESYNC)
+            else:
+                self._events.append(event)
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def next_events(self, timeout: float) -> List[Event]:
+        """
+        Возвращает накопленные события, дожидаясь их не дольше timeout.
+        Пустой список означает, что событий за это время не было.
+        """
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        self._wakeup.clear()
+        with self._lock:
+            events = list(self._events)
+            self._events.clear()
+        return events
+
+
+class StreamHub:
+    """
+    Хаб публикации событий процесса для соединений /api/stream:
+    новые твиты, изменения числа лайков и удаления твитов
+    доставляются только подписчикам автора твита.
+    """
+
+    def __init__(self, max_subscribers: int = STREAM_MAX_SUBSCRIBERS,
+                 queue_size: int = STREAM_QUEUE_SIZE) -> None:
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self.published = 0
+        self._subscriptions: Set[Subscription] = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id: int,
+                  following: Iterable[int]) -> Subscription:
+        """
+        Регистрирует соединение пользователя с его подписками.
+        Возбуждает StreamFullError, если соединений слишком много.
+        """
+        subscription = Subscription(user_id, following, self.queue_size,
+                                    asyncio.get_running_loop())
+        with self._lock:
+            if len(self._subscriptions) >= self.max_subscribers:
+                raise StreamFullError('Too many stream subscribers')
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Удаляет соединение из хаба"""
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def follow(self, user_id: int, author_id: int, following: bool) -> None:
+        """Обновляет подписки открытых соединений пользователя"""
+        with self._lock:
+            for subscription in self._subscriptions:
+                if subscription.user_id != user_id:
+                    continue
+                if following:
+                    subscription.following.add(author_id)
+                else:
+                    subscription.following.discard(author_id)
+
+    def has_subscribers(self) -> bool:
+        """Проверяет, открыт ли хотя бы один поток"""
+        with self._lock:
+            return bool(self._subscriptions)
+
+    def has_followers(self, author_id: int) -> bool:
+        """Проверяет, открыт ли поток хотя бы у одного подписчика автора"""
+        with self._lock:
+            return any(author_id in subscription.following
+                       for subscription in self._subscriptions)
+
+    def publish_tweet(self, author_id: int, tweet: Dict[str, object]) -> None:
+        """Отправляет новый твит соединениям подписчиков автора"""
+        self._publish(('tweet', dumps(tweet)),
+                      lambda subscription: author_id in subscription.following)
+
+    def publish_like(self, author_id: int, tweet_id: int,
+                     delta: int) -> None:
+        """Отправляет изменение числа лайков твита подписчикам автора"""
+        self._publish(('like', dumps({'tweet_id': tweet_id, 'delta': delta})),
+                      lambda subscription: author_id in subscription.following)
+
+    def publish_delete(self, author_id: int, tweet_id: int) -> None:
+        """Отправляет удаление твита подписчикам автора"""
+        self._publish(('delete', dumps({'tweet_id': tweet_id})),
+                      lambda subscription: author_id in subscription.following)
+
+    def _publish(self, event: Event,
+                 accepts: Callable[[Subscription], bool]) -> None:
+        with self._lock:
+            recipients = [subscription for subscription
+                          in self._subscriptions if accepts(subscription)]
+            self.published += 1
+        for subscription in recipients:
+            subscription.push(event)
+
+    def statistics(self) -> Dict[str, int]:
+        """Возвращает число соединений, событий и сброшенных событий"""
+        with self._lock:
+            return {
+                'subscribers': len(self._subscriptions),
+                'published': self.published,
+                'dropped': sum(subscription.dropped
+                               for subscription in self._subscriptions),
+            }
+
+
+def format_event(event: Event) -> bytes:
+    """Кодирует событие в формат Server-Sent Events"""
+    name, data = event
+    return b'event: ' + name.encode() + b'\ndata: ' + data + b'\n\n'
+
+
+async def sse_events(
+        hub: StreamHub,
+        subscription: Subscription,
+        heartbeat: float = STREAM_HEARTBEAT,
+        max_duration: float = STREAM_MAX_DURATION,
+) -> AsyncIterator[bytes]:
+    """
+    Отдаёт события подписки в формате SSE до отключения клиента
+    или истечения max_duration. В простое отправляет комментарий-пинг.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + (max_duration or float('inf'))
+    try:
+        yield b'retry: 1000\n\n'
+        while loop.time() < deadline:
+            events = await subscription.next_events(
+                min(heartbeat, deadline - loop.time()))
+            for event in events:
+                yield format_event(event)
+            if not events:
+                yield b': ping\n\n'
+    finally:
+        hub.unsubscribe(subscription)
@@ -0,0 +1,222 @@
+import os
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import List, Mapping, Optional, Sequence, Set, cast
+
+from sqlalchemy import ColumnElement, select
+from sqlalchemy.orm import Session
+
+from backend_server.models import Follow, Tweet, User
+
+# Сколько последних твитов хранится в ленте одного пользователя
+TIMELINE_MAX_SIZE = 800
+# Сколько лент пользователей хранится в памяти процесса
+TIMELINE_MAX_USERS = int(os.environ.get('TIMELINE_MAX_USERS', '10000'))
+# Авторы с большим числом подписчиков не рассылаются по лентам,
+# их твиты подтягиваются при чтении ленты (pull)
+CELEBRITY_FOLLOWERS_THRESHOLD = 10000
+
+
+class HomeTimelineCache:
+    """
+    Материализованные домашние ленты пользователей (fan-out on write).
+    Хранит в памяти процесса ограниченный список id твитов
+    для каждого пользователя по возрастанию id. Ленты давно
+    не читавших пользователей вытесняются (LRU).
+    Лента строится из БД при первом чтении и далее пополняется
+    при создании твитов авторами, на которых подписан пользователь.
+    Страницы старше хранимого хвоста ленты читаются из БД.
+    """
+
+    def __init__(
+            self,
+            max_size: int = TIMELINE_MAX_SIZE,
+            celebrity_threshold: int = CELEBRITY_FOLLOWERS_THRESHOLD,
+            max_users: int = TIMELINE_MAX_USERS,
+    ) -> None:
+        self.max_size = max_size
+        self.celebrity_threshold = celebrity_threshold
+        self.max_users = max_users
+        self.evictions = 0
+        self._timelines: OrderedDict[int, List[int]] = OrderedDict()
+        # Пользователи, в ленте которых хранятся все твиты их подписок
+        self._complete: Set[int] = set()
+        self._celebrities: Set[int] = set()
+        self._lock = threading.Lock()
+
+    def fan_out(self, session: Session,
+                tweet_id: int, author_id: Optional[int]) -> None:
+        """
+        Добавляет новый твит в уже построенные ленты подписчиков автора.
+        Для авторов с большим числом подписчиков рассылка не выполняется.
+        """
+        if author_id is None:
+            return
+        followers_count = session.scalar(
+            select(User.followers_count).where(
+                cast(ColumnElement[bool], author_id == User.id))
+        ) or 0
+        if followers_count > self.celebrity_threshold:
+            with self._lock:
+                self._celebrities.add(author_id)
+            return
+        follower_ids = self._follower_ids(session, author_id)
+        with self._lock:
+            self._celebrities.discard(author_id)
+            for follower_id in follower_ids:
+                timeline = self._timelines.get(follower_id)
+                if timeline is not None:
+                    self._insert(follower_id, timeline, tweet_id)
+
+    def _insert(self, user_id: int, timeline: List[int],
+                tweet_id: int) -> None:
+        """
+        Вставляет твит на место по id: рассылки одновременно
+        созданных твитов могут прийти не по порядку.
+        Самые старые твиты сверх max_size отбрасываются.
+        """
+        position = bisect_left(timeline, tweet_id)
+        if position < len(timeline) and timeline[position] == tweet_id:
+            return
+        timeline.insert(position, tweet_id)
+        if len(timeline) > self.max_size:
+            del timeline[:len(timeline) - self.max_size]
+            self._complete.discard(user_id)
+
+    def remove(self, session: Session,
+               tweet_id: int, author_id: Optional[int]) -> None:
+        """Удаляет твит из лент подписчиков автора"""
+        if author_id is None:
+            return
+        follower_ids = self._follower_ids(session, author_id)
+        with self._lock:
+            for follower_id in follower_ids:
+                timeline = self._timelines.get(follower_id, [])
+                position = bisect_left(timeline, tweet_id)
+                if position < len(timeline) \
+                        and timeline[position] == tweet_id:
+                    del timeline[position]
+
+    def invalidate(self, user_id: Optional[int]) -> None:
+        """Сбрасывает ленту пользователя, например после смены подписок"""
+        if user_id is None:
+            return
+        with self._lock:
+            self._timelines.pop(user_id, None)
+            self._complete.discard(user_id)
+
+    def page(
+            self,
+            session: Session,
+            user_id: int,
+            limit: int,
+            before_id: Optional[int] = None,
+    ) -> List[int]:
+        """
+        Возвращает не более limit id твитов ленты пользователя
+        от новых к старым, старше before_id, если он указан.
+        Твиты авторов-знаменитостей подмешиваются запросом к БД,
+        как и твиты старше хвоста ленты.
+        """
+        with self._lock:
+            timeline = self._timelines.get(user_id)
+            if timeline is not None:
+                self._timelines.move_to_end(user_id)
+        if timeline is None:
+            timeline = self._build(session, user_id)
+        with self._lock:
+            end = len(timeline) if before_id is None \
+                else bisect_left(timeline, before_id)
+            tweet_ids = timeline[max(end - limit, 0):end][::-1]
+            complete = user_id in self._complete
+            celebrities = set(self._celebrities)
+        if len(tweet_ids) < limit and not complete:
+            tweet_ids += self._older(session, user_id, tweet_ids,
+                                     limit, before_id)
+        if celebrities:
+            pulled = self._pull(session, user_id, celebrities,
+                                limit, before_id)
+            tweet_ids = sorted(set(tweet_ids).union(pulled),
+                               reverse=True)[:limit]
+        return tweet_ids
+
+    def _build(self, session: Session, user_id: int) -> List[int]:
+        """
+        Строит ленту пользователя из твитов авторов его подписок,
+        вытесняя ленты давно не читавших пользователей
+        """
+        tweet_ids = self._query(session, user_id, self.max_size, None)
+        with self._lock:
+            if user_id not in self._timelines:
+                self._timelines[user_id] = tweet_ids[::-1]
+                if len(tweet_ids) < self.max_size:
+                    self._complete.add(user_id)
+                self._evict()
+            return self._timelines[user_id]
+
+    def _evict(self) -> None:
+        while len(self._timelines) > self.max_users:
+            evicted, _ = self._timelines.popitem(last=False)
+            self._complete.discard(evicted)
+            self.evictions += 1
+
+    def statistics(self) -> Mapping[str, int]:
+        """Возвращает число лент в памяти, их твитов и вытеснений"""
+        with self._lock:
+            return {
+                'users': len(self._timelines),
+                'tweets': sum(map(len, self._timelines.values())),
+                'evictions': self.evictions,
+            }
+
+    def _older(self, session: Session, user_id: int, tweet_ids: List[int],
+               limit: int, before_id: Optional[int]) -> List[int]:
+        """
+        Дочитывает из БД твиты старше хвоста ленты, которых
+        не хватило странице из tweet_ids
+        """
+        return self._query(session, user_id, limit - len(tweet_ids),
+                           tweet_ids[-1] if tweet_ids else before_id)
+
+    @staticmethod
+    def _query(session: Session, user_id: int, limit: int,
+               before_id: Optional[int]) -> List[int]:
+        """
+        Выбирает твиты авторов подписок пользователя от новых к старым
+        по индексу ix_tweet_user_id_id
+        """
+        query = select(Tweet.id) \
+            .join(Follow, Follow.following_id == Tweet.user_id) \
+            .where(cast(ColumnElement[bool], user_id == Follow.follower_id))
+        if before_id is not None:
+            query = query.where(Tweet.id < before_id)
+        return list(cast(Sequence[int], session.scalars(
+            query.order_by(Tweet.id.desc()).limit(limit)).all()))
+
+    def _pull(
+            self,
+            session: Session,
+            user_id: int,
+            celebrities: Set[int],
+            limit: int,
+            before_id: Optional[int],
+    ) -> List[int]:
+        """Выбирает свежие твиты знаменитостей, на которых подписан user"""
+        followed = select(Follow.following_id).where(
+            cast(ColumnElement[bool], user_id == Follow.follower_id),
+            Follow.following_id.in_(celebrities),
+        )
+        query = select(Tweet.id).where(Tweet.user_id.in_(followed))
+        if before_id is not None:
+            query = query.where(Tweet.id < before_id)
+        return list(cast(Sequence[int], session.scalars(
+            query.order_by(Tweet.id.desc()).limit(limit)).all()))
+
+    @staticmethod
+    def _follower_ids(session: Session, author_id: int) -> Sequence[int]:
+        """Возвращает id подписчиков автора"""
+        return cast(Sequence[int], session.scalars(
+            select(Follow.follower_id).where(
+                cast(ColumnElement[bool], author_id == Follow.following_id))
+        ).all())
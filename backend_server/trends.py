@@ -0,0 +1,221 @@
+"""
+Хэштеги, упоминания и тренды.
+
+Хэштеги новых твитов учитываются в скользящем окне из
+TRENDS_WINDOW_BUCKETS интервалов по TRENDS_BUCKET_SECONDS секунд.
+У каждого интервала свой count-min sketch, сумма скетчей окна
+обновляется вместе с ними и оценивает частоту хэштега за окно.
+Кандидаты в тренды - ограниченный набор самых частых хэштегов,
+из него куча выбирает первые k. Состояние живёт в памяти процесса
+и раз в TRENDS_SNAPSHOT_INTERVAL секунд сохраняется в БД,
+при запуске снимок восстанавливается. Запросы трендов
+не читают таблицу твитов.
+"""
+import hashlib
+import io
+import logging
+import os
+import re
+import threading
+import time
+from heapq import nsmallest
+from typing import Callable, Dict, Iterable, List, Tuple, cast
+
+import numpy as np
+import numpy.typing as npt
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from backend_server.models import TrendSnapshot
+
+logger = logging.getLogger(__name__)
+
+TRENDS_BUCKET_SECONDS = float(os.environ.get('TRENDS_BUCKET_SECONDS', '300'))
+TRENDS_WINDOW_BUCKETS = int(os.environ.get('TRENDS_WINDOW_BUCKETS', '12'))
+TRENDS_SNAPSHOT_INTERVAL = float(
+    os.environ.get('TRENDS_SNAPSHOT_INTERVAL', '60'))
+# Сколько хэштегов-кандидатов отслеживается точнее скетча
+TRENDS_CANDIDATES = 256
+SKETCH_WIDTH = 4096
+SKETCH_DEPTH = 4
+SNAPSHOT_NAME = 'hashtags'
+
+HASHTAG_PATTERN = re.compile(r'(?<!\w)#(\w+)')
+MENTION_PATTERN = re.compile(r'(?<![\w@])@(\w+)')
+
+IntArray = npt.NDArray[np.int64]
+
+
+def extract_hashtags(text: str) -> List[str]:
+    """Хэштеги текста в нижнем регистре без повторов"""
+    return list(dict.fromkeys(
+        tag.lower() for tag in HASHTAG_PATTERN.findall(text)))
+
+
+def extract_mentions(text: str) -> List[str]:
+    """Имена пользователей, упомянутых в тексте через @, без повторов"""
+    return list(dict.fromkeys(MENTION_PATTERN.findall(text)))
+
+
+def sketch_columns(key: str, width: int, depth: int) -> IntArray:
+    """
+    Столбцы ключа в строках count-min sketch.
+    Хэш не зависит от процесса, поэтому снимки переносимы.
+    """
+    digest = hashlib.blake2b(key.encode(), digest_size=8 * depth).digest()
+    return np.frombuffer(digest, dtype=np.uint64).astype(np.int64) % width
+
+
+class TrendingTopics:
+    """
+    Частые хэштеги скользящего окна: count-min sketch на интервал
+    окна и набор кандидатов с оценками их частоты за окно.
+    Безопасен для вызова из любого потока.
+    """
+
+    def __init__(
+            self,
+            bucket_seconds: float = TRENDS_BUCKET_SECONDS,
+            window_buckets: int = TRENDS_WINDOW_BUCKETS,
+            snapshot_interval: float = TRENDS_SNAPSHOT_INTERVAL,
+            candidates: int = TRENDS_CANDIDATES,
+            width: int = SKETCH_WIDTH,
+            depth: int = SKETCH_DEPTH,
+            clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.bucket_seconds = bucket_seconds
+        self.snapshot_interval = snapshot_interval
+        self.capacity = candidates
+        self.width = width
+        self.depth = depth
+        self.clock = clock
+        self.recorded = 0
+        self.snapshots = 0
+        self._rows = np.arange(depth)
+        # Скетчи интервалов по кругу, их сумма и номера интервалов
+        self._buckets = np.zeros((window_buckets, depth, width), np.int64)
+        self._window = np.zeros((depth, width), np.int64)
+        self._bucket_ids = np.full(window_buckets, -1, np.int64)
+        self._current = -1
+        self._candidates: Dict[str, int] = {}
+        self._loaded = False
+        self._snapshot_at = clock()
+        self._lock = threading.Lock()
+
+    def record(self, tags: Iterable[str]) -> None:
+        """Учитывает хэштеги нового твита в текущем интервале"""
+        with self._lock:
+            slot = self._advance()
+            for tag in tags:
+                columns = sketch_columns(tag, self.width, self.depth)
+                self._buckets[slot, self._rows, columns] += 1
+                self._window[self._rows, columns] += 1
+                self._candidates[tag] = \
+                    int(self._window[self._rows, columns].min())
+                self.recorded += 1
+            while len(self._candidates) > self.capacity:
+                del self._candidates[min(self._candidates,
+                                         key=self._candidates.__getitem__)]
+
+    def top(self, limit: int) -> List[Tuple[str, int]]:
+        """
+        Первые limit хэштегов окна по убыванию оценки частоты,
+        при равенстве - по алфавиту
+        """
+        with self._lock:
+            self._advance()
+            return nsmallest(limit, self._candidates.items(),
+                             key=lambda item: (-item[1], item[0]))
+
+    def _advance(self) -> int:
+        """
+        Переходит к интервалу текущего времени, вычитая из окна
+        вышедшие из него интервалы. Возвращает позицию интервала.
+        """
+        bucket = int(self.clock() // self.bucket_seconds)
+        size = len(self._bucket_ids)
+        if bucket > self._current:
+            for expired in range(max(self._current + 1, bucket - size + 1),
+                                 bucket + 1):
+                slot = expired % size
+                self._window -= self._buckets[slot]
+                self._buckets[slot] = 0
+                self._bucket_ids[slot] = expired
+            self._current = bucket
+            self._reestimate()
+        return bucket % size
+
+    def _reestimate(self) -> None:
+        """Обновляет оценки кандидатов по окну, убирает нулевые"""
+        estimates = {
+            tag: int(self._window[self._rows, sketch_columns(
+                tag, self.width, self.depth)].min())
+            for tag in self._candidates}
+        self._candidates = {tag: estimate for tag, estimate
+                            in estimates.items() if estimate}
+
+    def load(self, my_session: Session) -> None:
+        """
+        Один раз добавляет к окну ещё не устаревшие интервалы
+        сохранённого снимка. Скетчи складываются, поэтому учтённые
+        до загрузки хэштеги не теряются.
+        """
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+        snapshot = my_session.get(TrendSnapshot, SNAPSHOT_NAME)
+        if snapshot is None:
+            return
+        with np.load(io.BytesIO(cast(bytes, snapshot.data))) as arrays:
+            buckets, bucket_ids = arrays['buckets'], arrays['bucket_ids']
+            tags = [str(tag) for tag in arrays['tags']]
+        if buckets.shape != self._buckets.shape:
+            return
+        with self._lock:
+            self._advance()
+            for slot, bucket in enumerate(bucket_ids):
+                if bucket >= 0 and bucket == self._bucket_ids[slot]:
+                    self._buckets[slot] += buckets[slot]
+                    self._window += buckets[slot]
+            self._candidates.update(dict.fromkeys(tags, 0))
+            self._reestimate()
+
+    def snapshot_due(self, my_session: Session) -> bool:
+        """
+        Сохраняет снимок, если истёк интервал сохранения.
+        Ошибка записи не прерывает вызывающую операцию.
+        """
+        with self._lock:
+            if self.clock() - self._snapshot_at < self.snapshot_interval:
+                return False
+        try:
+            self.snapshot(my_session)
+        except SQLAlchemyError:
+            my_session.rollback()
+            logger.exception('Failed to save trends snapshot')
+            return False
+        return True
+
+    def snapshot(self, my_session: Session) -> None:
+        """Сохраняет интервалы окна и кандидатов в БД"""
+        buffer = io.BytesIO()
+        with self._lock:
+            self._snapshot_at = now = self.clock()
+            np.savez_compressed(buffer, buckets=self._buckets,
+                                bucket_ids=self._bucket_ids,
+                                tags=np.array(list(self._candidates), str))
+        my_session.merge(TrendSnapshot(name=SNAPSHOT_NAME, saved_at=int(now),
+                                       data=buffer.getvalue()))
+        my_session.commit()
+        with self._lock:
+            self.snapshots += 1
+
+    def statistics(self) -> Dict[str, int]:
+        """Возвращает число учтённых хэштегов, кандидатов и снимков"""
+        with self._lock:
+            return {
+                'recorded': self.recorded,
+                'candidates': len(self._candidates),
+                'snapshots': self.snapshots,
+            }
@@ -0,0 +1,165 @@
+"""
+Подписчики, подписки и краткие профили пользователей.
+
+Списки подписчиков и подписок отдаются страницами по курсору:
+страница - срез индекса таблицы follow от больших id к меньшим,
+поэтому её стоимость не зависит от числа подписчиков.
+Краткий профиль содержит только счётчики и первые
+PROFILE_PREVIEW_SIZE подписчиков и подписок. Он кэшируется
+в памяти процесса уже закодированным в JSON и сбрасывается
+при подписке и отписке у обоих пользователей.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Final, List, Literal, Optional, Tuple, cast
+
+from sqlalchemy import ColumnElement, select
+from sqlalchemy.exc import NoResultFound
+from sqlalchemy.orm import Session
+
+from backend_server.counters import (
+    FOLLOWERS_COUNT,
+    FOLLOWING_COUNT,
+    CounterAggregator,
+)
+from backend_server.models import Follow, User
+from backend_server.pagination import encode_cursor
+from backend_server.schemas import (
+    ResultUserSummaryModel,
+    UserModel,
+    UserSummaryModel,
+)
+from backend_server.serializers import dumps
+
+PROFILE_CACHE_SIZE = int(os.environ.get('PROFILE_CACHE_SIZE', '10000'))
+# Сколько подписчиков и подписок входит в краткий профиль
+PROFILE_PREVIEW_SIZE = int(os.environ.get('PROFILE_PREVIEW_SIZE', '10'))
+
+FOLLOWERS: Final = 'followers'
+FOLLOWING: Final = 'following'
+Direction = Literal['followers', 'following']
+
+
+def follow_page(
+        my_session: Session,
+        user_id: int,
+        direction: Direction,
+        limit: int,
+        before_id: Optional[int] = None,
+) -> Tuple[List[UserModel], Optional[str]]:
+    """
+    Возвращает не более limit подписчиков (followers) или подписок
+    (following) пользователя с id меньше before_id, от больших id
+    к меньшим, и курсор следующей страницы
+    """
+    if direction == FOLLOWERS:
+        user_column, owner_column = Follow.follower_id, Follow.following_id
+    else:
+        user_column, owner_column = Follow.following_id, Follow.follower_id
+    query = select(User.id, User.name) \
+        .join(Follow, user_column == User.id) \
+        .where(cast(ColumnElement[bool], user_id == owner_column))
+    if before_id is not None:
+        query = query.where(user_column < before_id)
+    users = [UserModel(id=found_id, name=name)
+             for found_id, name in my_session.execute(
+                 query.order_by(user_column.desc()).limit(limit))]
+    next_cursor = encode_cursor(users[-1].id) \
+        if len(users) == limit else None
+    return users, next_cursor
+
+
+def load_summary(
+        my_session: Session,
+        counters: CounterAggregator,
+        user_id: int,
+        preview_size: int = PROFILE_PREVIEW_SIZE,
+) -> bytes:
+    """
+    Кодирует краткий профиль пользователя в форме
+    ResultUserSummaryModel. Счётчики учитывают ещё не записанные
+    приращения. Возбуждает NoResultFound, если пользователь не найден.
+    """
+    row = my_session.execute(
+        select(User.name, User.followers_count, User.following_count)
+        .where(cast(ColumnElement[bool], user_id == User.id))
+    ).one_or_none()
+    if row is None:
+        raise NoResultFound('No row was found when one was required')
+    name, followers_count, following_count = row
+    followers, followers_cursor = follow_page(
+        my_session, user_id, FOLLOWERS, preview_size)
+    following, following_cursor = follow_page(
+        my_session, user_id, FOLLOWING, preview_size)
+    summary = UserSummaryModel(
+        id=user_id, name=name,
+        followers_count=followers_count
+        + counters.pending(FOLLOWERS_COUNT, user_id),
+        following_count=following_count
+        + counters.pending(FOLLOWING_COUNT, user_id),
+        followers=followers, following=following,
+        followers_cursor=followers_cursor,
+        following_cursor=following_cursor,
+    )
+    return dumps(ResultUserSummaryModel(result=True, user=summary)
+                 .model_dump())
+
+
+class ProfileCache:
+    """
+    LRU-кэш кратких профилей, закодированных в JSON.
+    Профиль, прочитанный из БД до сброса какого-либо профиля,
+    в кэш не попадает, чтобы не вернуть устаревшие подписки.
+    """
+
+    def __init__(self, max_size: int = PROFILE_CACHE_SIZE,
+                 preview_size: int = PROFILE_PREVIEW_SIZE) -> None:
+        self.max_size = max_size
+        self.preview_size = preview_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[int, bytes] = OrderedDict()
+        # Номер сброса, с которым сверяются прочитанные профили
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def summary(self, my_session: Session, counters: CounterAggregator,
+                user_id: int) -> bytes:
+        """
+        Возвращает краткий профиль пользователя, при промахе
+        читает его из БД. Возбуждает NoResultFound,
+        если пользователь не найден.
+        """
+        with self._lock:
+            content = self._entries.get(user_id)
+            if content is not None:
+                self.hits += 1
+                self._entries.move_to_end(user_id)
+                return content
+            self.misses += 1
+            version = self._version
+        content = load_summary(my_session, counters, user_id,
+                               self.preview_size)
+        with self._lock:
+            if version == self._version:
+                self._entries[user_id] = content
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return content
+
+    def invalidate(self, *user_ids: Optional[int]) -> None:
+        """Сбрасывает профили пользователей после смены подписок"""
+        with self._lock:
+            self._version += 1
+            for user_id in user_ids:
+                self._entries.pop(cast(int, user_id), None)
+
+    def statistics(self) -> Dict[str, int]:
+        """Возвращает счётчики попаданий и заполненность кэша"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+            }
@@ -0,0 +1,272 @@
+import asyncio
+import os
+from typing import (
+    Any,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+    cast,
+)
+
+from sqlalchemy import delete, tuple_
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import InstrumentedAttribute, Session
+
+from backend_server import services
+from backend_server.counters import (
+    FOLLOWERS_COUNT,
+    FOLLOWING_COUNT,
+    LIKE_COUNT,
+    CounterAggregator,
+)
+from backend_server.database import (
+    SessionSource,
+    any_session_scope,
+    run_in_session,
+)
+from backend_server.models import Follow, Like
+from backend_server.timeline import HomeTimelineCache
+
+# Режим объединения записей лайков и подписок включается явно
+WRITE_COALESCING = os.environ.get('WRITE_COALESCING', '0') == '1'
+# Сколько ждать другие операции перед записью пачки, секунды
+WRITE_COALESCING_WINDOW = float(os.environ.get('WRITE_COALESCING_WINDOW',
+                                               '0.005'))
+# Пачка такого размера записывается, не дожидаясь конца окна
+WRITE_COALESCING_MAX_BATCH = int(os.environ.get('WRITE_COALESCING_MAX_BATCH',
+                                                '500'))
+
+LIKE = 'like'
+FOLLOW = 'follow'
+# Связь -> (модель, столбец пользователя, столбец цели)
+RELATIONS: Dict[str, Tuple[Any, InstrumentedAttribute[Any],
+                           InstrumentedAttribute[Any]]] = {
+    LIKE: (Like, Like.user_id, Like.tweet_id),
+    FOLLOW: (Follow, Follow.follower_id, Follow.following_id),
+}
+INSERTS: Dict[str, Any] = {'postgresql': postgresql_insert,
+                           'sqlite': sqlite_insert}
+
+WriteKey = Tuple[str, int, int]
+
+
+class Write(NamedTuple):
+    """Операция создания или удаления лайка или подписки"""
+    relation: str
+    user_id: Optional[int]
+    target_id: int
+    insert: bool
+
+
+class _QueuedWrite(NamedTuple):
+    write: Write
+    future: 'asyncio.Future[bool]'
+
+
+class WriteCoalescer:
+    """
+    Объединяет лайки и подписки, пришедшие в течение короткого окна,
+    в многострочные INSERT ... ON CONFLICT DO NOTHING и
+    DELETE ... WHERE (a, b) IN (...). Повторы одной операции
+    (двойное нажатие кнопки) сводятся к одной строке.
+    Каждый вызывающий получает тот же результат, что и при
+    последовательном выполнении операций по одной.
+    """
+
+    def __init__(
+            self,
+            my_session: SessionSource,
+            counters: CounterAggregator,
+            timelines: HomeTimelineCache,
+            window: float = WRITE_COALESCING_WINDOW,
+            max_batch: int = WRITE_COALESCING_MAX_BATCH,
+    ) -> None:
+        self.my_session = my_session
+        self.counters = counters
+        self.timelines = timelines
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self.writes = 0
+        self.statements = 0
+        self._queue: List[_QueuedWrite] = []
+        self._full: Optional[asyncio.Event] = None
+        self._tail: Optional['asyncio.Task[None]'] = None
+
+    async def submit(self, write: Write) -> bool:
+        """Ставит операцию в очередь и ожидает её результат"""
+        future: 'asyncio.Future[bool]' = \
+            asyncio.get_running_loop().create_future()
+        self._queue.append(_QueuedWrite(write, future))
+        if self._full is None:
+            self._full = asyncio.Event()
+            self._tail = asyncio.ensure_future(
+                self._drain(self._tail, self._full))
+        elif len(self._queue) >= self.max_batch:
+            self._full.set()
+        return await future
+
+    async def _drain(self, previous: Optional['asyncio.Task[None]'],
+                     full: asyncio.Event) -> None:
+        """Дожидается конца окна и записывает накопленную пачку"""
+        await _wait(full, self.window)
+        batch, self._queue, self._full = self._queue, [], None
+        # Пачки применяются строго по очереди
+        if previous is not None and not previous.done():
+            await previous
+        try:
+            async with any_session_scope(self.my_session) as session:
+                results = await run_in_session(
+                    session, self.apply, [queued.write for queued in batch])
+        except Exception as exc:
+            for queued in batch:
+                _settle(queued.future, exc)
+            return
+        for queued, result in zip(batch, results):
+            _settle(queued.future, result)
+
+    def apply(self, my_session: Session, writes: Sequence[Write]) -> List[bool]:
+        """
+        Применяет пачку операций и возвращает результат каждой.
+        Если пачка нарушает ограничения БД (например, лайк
+        несуществующего твита), операции выполняются по одной,
+        как и операции неизвестных пользователей.
+        """
+        self.batches += 1
+        self.writes += len(writes)
+        if my_session.get_bind().dialect.name not in INSERTS \
+                or any(write.user_id is None for write in writes):
+            return [self._apply_one(my_session, write) for write in writes]
+        try:
+            results = self._apply_batch(my_session, writes)
+        except IntegrityError:
+            my_session.rollback()
+            return [self._apply_one(my_session, write) for write in writes]
+        self.counters.flush_due(my_session)
+        return results
+
+    def _apply_batch(
+            self, my_session: Session, writes: Sequence[Write]) -> List[bool]:
+        """
+        Выполняет по одному INSERT и DELETE на связь с итоговым
+        состоянием каждой пары. По возвращённым строкам определяет,
+        была ли пара в БД до пачки, и воспроизводит по ней
+        результаты операций в порядке поступления.
+        """
+        results = [False] * len(writes)
+        indexes: Dict[WriteKey, List[int]] = {}
+        for index, write in enumerate(writes):
+            indexes.setdefault(
+                (write.relation, cast(int, write.user_id), write.target_id),
+                [],
+            ).append(index)
+        final_inserts = {key for key, key_indexes in indexes.items()
+                         if writes[key_indexes[-1]].insert}
+        existed: Set[WriteKey] = set()
+        for relation in RELATIONS:
+            existed.update(self._write_relation(
+                my_session, relation,
+                [key for key in indexes
+                 if key[0] == relation and key in final_inserts],
+                [key for key in indexes
+                 if key[0] == relation and key not in final_inserts],
+            ))
+        my_session.commit()
+        for key, key_indexes in indexes.items():
+            exists = key in existed
+            for index in key_indexes:
+                write = writes[index]
+                results[index] = write.insert != exists
+                exists = write.insert
+                if results[index]:
+                    self._account(write)
+        return results
+
+    def _write_relation(
+            self, my_session: Session, relation: str,
+            inserts: List[WriteKey], deletes: List[WriteKey]) -> Set[WriteKey]:
+        """
+        Создаёт и удаляет пары одной связи многострочными запросами.
+        Возвращает пары, которые были в БД до запросов.
+        """
+        model, user_column, target_column = RELATIONS[relation]
+        existed: Set[WriteKey] = set()
+        if inserts:
+            statement = INSERTS[my_session.get_bind().dialect.name](
+                model).values([
+                    {user_column.key: user_id, target_column.key: target_id}
+                    for _, user_id, target_id in inserts
+                ]).on_conflict_do_nothing().returning(
+                    user_column, target_column)
+            inserted = set(my_session.execute(statement).tuples())
+            existed.update(key for key in inserts if key[1:] not in inserted)
+            self.statements += 1
+        if deletes:
+            deleted = my_session.execute(
+                delete(model).where(tuple_(user_column, target_column)
+                                    .in_([key[1:] for key in deletes]))
+                .returning(user_column, target_column)
+            ).tuples()
+            existed.update((relation, *row) for row in deleted)
+            self.statements += 1
+        return existed
+
+    def _apply_one(self, my_session: Session, write: Write) -> bool:
+        """Выполняет одну операцию обычным сервисом"""
+        if write.relation == LIKE:
+            service = services.add_like if write.insert \
+                else services.delete_like
+            return service(my_session, self.counters,
+                           write.user_id, write.target_id).result
+        follow_service = services.add_follow if write.insert \
+            else services.delete_follow
+        return follow_service(my_session, self.timelines, self.counters,
+                              write.user_id, write.target_id).result
+
+    def _account(self, write: Write) -> None:
+        """Обновляет счётчики и ленты после успешной операции"""
+        delta = 1 if write.insert else -1
+        if write.relation == LIKE:
+            self.counters.add(LIKE_COUNT, write.target_id, delta)
+            return
+        self.counters.add(FOLLOWERS_COUNT, write.target_id, delta)
+        self.counters.add(FOLLOWING_COUNT, write.user_id, delta)
+        self.timelines.invalidate(write.user_id)
+
+    def statistics(self) -> Dict[str, int]:
+        """Возвращает число пачек, операций и выполненных запросов"""
+        return {
+            'batches': self.batches,
+            'writes': self.writes,
+            'statements': self.statements,
+            'queued': len(self._queue),
+        }
+
+
+async def _wait(event: asyncio.Event, timeout: float) -> None:
+    """Ждёт события не дольше timeout секунд"""
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+def _settle(future: 'asyncio.Future[bool]',
+            outcome: Union[bool, BaseException]) -> None:
+    """
+    Передаёт ожидающему результат или ошибку пачки. Ожидание
+    отменённого запроса уже завершено, его операция всё равно записана.
+    """
+    if future.done():
+        return
+    if isinstance(outcome, BaseException):
+        future.set_exception(outcome)
+    else:
+        future.set_result(outcome)
@@ -0,0 +1,344 @@
+"""
+Генератор синтетических наборов данных и их пакетная загрузка.
+
+Набор детерминирован зерном: число подписчиков и лайков авторов
+распределено по степенному закону, число твитов и подписок
+пользователя - по Пуассону. Загрузка идёт мимо ORM: COPY
+в PostgreSQL (psycopg2) и executemany пачками в остальных БД.
+Вторичные индексы создаются после загрузки данных,
+счётчики вычисляются при генерации.
+
+    python -m benchmarks.dataset --url postgresql://user@host/db \\
+        --users 200000 --tweets-per-user 25 --likes-per-tweet 2 --seed 1
+"""
+import argparse
+import csv
+import io
+import json
+import struct
+import sys
+import time
+import zlib
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+import numpy as np
+from sqlalchemy import Table, func, insert, select, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.engine.base import Engine
+
+from backend_server.database import Base, make_engine
+from backend_server.media_storage import (
+    LocalMediaStorage,
+    MediaStorage,
+    blob_key,
+)
+from backend_server.models import Follow, Like, Media, Tweet, User
+from backend_server.ranking import IntArray
+
+BATCH_SIZE = 50000
+# Слова твитов, частота слова убывает с его номером
+VOCABULARY = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do '
+    'eiusmod tempor incididunt ut labore et dolore magna aliqua enim ad '
+    'minim veniam quis nostrud exercitation ullamco laboris nisi aliquip '
+    'ex ea commodo consequat duis aute irure in reprehenderit voluptate '
+    'velit esse cillum fugiat nulla pariatur excepteur sint occaecat '
+    'cupidatat non proident sunt culpa qui officia deserunt mollit anim '
+    'id est laborum'
+).split()
+WORD_FREQUENCIES = 1.0 / np.arange(1, len(VOCABULARY) + 1)
+WORD_FREQUENCIES /= WORD_FREQUENCIES.sum()
+WORDS_PER_TWEET = (3, 30)
+CONTENT_BLOCK = 1024
+# Цвета картинок-заглушек медиафайлов
+MEDIA_COLORS = ((230, 57, 70), (69, 123, 157), (42, 157, 143),
+                (233, 196, 106), (38, 70, 83), (244, 162, 97))
+
+Batch = Tuple[Table, Sequence[str], List[Tuple[Any, ...]]]
+
+
+class DatasetConfig(NamedTuple):
+    """Параметры набора данных"""
+    users: int = 1000
+    tweets_per_user: float = 20.0
+    follows_per_user: float = 30.0
+    likes_per_tweet: float = 3.0
+    # Доля твитов с медиафайлом
+    media_share: float = 0.2
+    # Показатель степени популярности авторов: чем он больше,
+    # тем сильнее подписчики и лайки сосредоточены у немногих
+    popularity_exponent: float = 1.1
+    seed: int = 0
+
+
+class Dataset(NamedTuple):
+    """Сгенерированный набор: связи и атрибуты строк массивами"""
+    config: DatasetConfig
+    # Автор твита с id i + 1
+    tweet_authors: IntArray
+    # id медиафайла твита с id i + 1 или 0
+    tweet_media: IntArray
+    # Пары (tweet_id, user_id) в порядке первичного ключа
+    likes: IntArray
+    # Пары (follower_id, following_id) в порядке первичного ключа
+    follows: IntArray
+
+
+def generate(config: DatasetConfig) -> Dataset:
+    """Генерирует связи набора данных векторными операциями"""
+    rng = np.random.default_rng(config.seed)
+    users = config.users
+    popularity = (rng.permutation(users) + 1.0) ** -config.popularity_exponent
+    popularity /= popularity.sum()
+
+    out_degree = rng.poisson(config.follows_per_user, users) \
+        .clip(max=users - 1)
+    followers = np.repeat(np.arange(1, users + 1), out_degree)
+    followees = rng.choice(users, size=len(followers), p=popularity) + 1
+    own = followers == followees
+    follows = _unique_pairs(followers[~own], followees[~own], users)
+
+    tweet_authors = rng.permutation(np.repeat(
+        np.arange(1, users + 1), rng.poisson(config.tweets_per_user, users)))
+    tweet_media = np.zeros(len(tweet_authors), dtype=np.int64)
+    with_media = rng.random(len(tweet_authors)) < config.media_share
+    tweet_media[with_media] = np.arange(1, with_media.sum() + 1)
+
+    like_total = int(len(tweet_authors) * config.likes_per_tweet)
+    likes = np.empty((0, 2), dtype=np.int64)
+    if like_total:
+        tweet_weights = popularity[tweet_authors - 1]
+        liked = rng.choice(len(tweet_authors), size=like_total,
+                           p=tweet_weights / tweet_weights.sum()) + 1
+        likes = _unique_pairs(liked, rng.integers(1, users + 1, like_total),
+                              users)
+    return Dataset(config=config, tweet_authors=tweet_authors,
+                   tweet_media=tweet_media, likes=likes, follows=follows)
+
+
+def _unique_pairs(left: IntArray, right: IntArray, right_max: int) -> IntArray:
+    """Убирает повторы пар и упорядочивает их по (left, right)"""
+    keys = np.unique(left.astype(np.int64) * (right_max + 1) + right)
+    return np.stack([keys // (right_max + 1), keys % (right_max + 1)], axis=1)
+
+
+def media_blob(color: Tuple[int, int, int], size: int = 16) -> bytes:
+    """Картинка-заглушка: PNG заданного цвета"""
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + \
+            struct.pack('>I', zlib.crc32(kind + data))
+
+    row = b'\x00' + bytes(color) * size
+    return b'\x89PNG\r\n\x1a\n' + \
+        chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0)) + \
+        chunk(b'IDAT', zlib.compress(row * size)) + chunk(b'IEND', b'')
+
+
+def tweet_contents(dataset: Dataset, start: int, stop: int) -> List[str]:
+    """
+    Тексты твитов с id start + 1 ... stop. Тексты генерируются блоками
+    по CONTENT_BLOCK твитов с зерном блока, поэтому не хранятся
+    в памяти и не зависят от размера пачки загрузки.
+    """
+    contents: List[str] = []
+    for block in range(start // CONTENT_BLOCK,
+                       (stop - 1) // CONTENT_BLOCK + 1):
+        rng = np.random.default_rng((dataset.config.seed, block))
+        counts = rng.integers(*WORDS_PER_TWEET, CONTENT_BLOCK)
+        words = rng.choice(len(VOCABULARY), size=int(counts.sum()),
+                           p=WORD_FREQUENCIES)
+        block_words = [VOCABULARY[word] for word in words.tolist()]
+        ends = np.cumsum(counts).tolist()
+        first = max(start - block * CONTENT_BLOCK, 0)
+        last = min(stop - block * CONTENT_BLOCK, CONTENT_BLOCK)
+        contents.extend(
+            ' '.join(block_words[end - count:end])
+            for end, count
+            in zip(ends[first:last], counts[first:last].tolist()))
+    return contents
+
+
+def batches(dataset: Dataset, media_keys: Sequence[str], media_size: int,
+            batch_size: int = BATCH_SIZE) -> Iterator[Batch]:
+    """Выдаёт строки всех таблиц пачками в порядке зависимостей"""
+    users = dataset.config.users
+    followers = np.bincount(dataset.follows[:, 1], minlength=users + 1)
+    following = np.bincount(dataset.follows[:, 0], minlength=users + 1)
+    like_counts = np.bincount(dataset.likes[:, 0],
+                              minlength=len(dataset.tweet_authors) + 1)
+    for start in range(0, users, batch_size):
+        stop = min(start + batch_size, users)
+        yield _table(User), ('id', 'api_key', 'name', 'followers_count',
+                             'following_count'), [
+            (user_id, f'key{user_id}', f'user{user_id}',
+             int(followers[user_id]), int(following[user_id]))
+            for user_id in range(start + 1, stop + 1)]
+    for start in range(0, len(dataset.tweet_authors), batch_size):
+        stop = min(start + batch_size, len(dataset.tweet_authors))
+        media = dataset.tweet_media[start:stop].tolist()
+        yield _table(Tweet), ('id', 'content', 'media_ids', 'user_id',
+                              'like_count'), [
+            (tweet_id, content, json.dumps([media_id] if media_id else []),
+             author_id, like_count)
+            for tweet_id, content, media_id, author_id, like_count in zip(
+                range(start + 1, stop + 1),
+                tweet_contents(dataset, start, stop), media,
+                dataset.tweet_authors[start:stop].tolist(),
+                like_counts[start + 1:stop + 1].tolist())]
+        yield _table(Media), ('id', 'sha256', 'size', 'tweet_id'), [
+            (media_id, media_keys[media_id % len(media_keys)], media_size,
+             tweet_id)
+            for tweet_id, media_id in zip(range(start + 1, stop + 1), media)
+            if media_id]
+    for model, pairs, columns in (
+            (Follow, dataset.follows, ('follower_id', 'following_id')),
+            (Like, dataset.likes, ('tweet_id', 'user_id'))):
+        for start in range(0, len(pairs), batch_size):
+            yield _table(model), columns, [
+                (left, right) for left, right
+                in pairs[start:start + batch_size].tolist()]
+
+
+def _table(model: Any) -> Table:
+    return model.__table__  # type: ignore[no-any-return]
+
+
+def load(bench_engine: Engine, dataset: Dataset,
+         media_storage: Optional[MediaStorage] = None,
+         batch_size: int = BATCH_SIZE) -> Dict[str, int]:
+    """
+    Пересоздаёт схему и загружает в неё набор данных.
+    Картинки-заглушки кладутся в media_storage, если оно задано.
+    Возвращает число загруженных строк по таблицам.
+    """
+    blobs = [media_blob(color) for color in MEDIA_COLORS]
+    media_keys = [media_storage.put(blob) if media_storage else blob_key(blob)
+                  for blob in blobs]
+    Base.metadata.drop_all(bench_engine)
+    Base.metadata.create_all(bench_engine)
+    indexes = [index for table in Base.metadata.sorted_tables
+               for index in table.indexes]
+    loaded: Dict[str, int] = {}
+    with bench_engine.begin() as connection:
+        tune_bulk_load(connection)
+        for index in indexes:
+            index.drop(connection)
+        for table, columns, rows in batches(dataset, media_keys,
+                                            len(blobs[0]), batch_size):
+            write_rows(connection, table, columns, rows)
+            loaded[table.name] = loaded.get(table.name, 0) + len(rows)
+        for index in indexes:
+            index.create(connection)
+        if connection.dialect.name == 'postgresql':
+            _reset_sequences(connection)
+    return loaded
+
+
+def tune_bulk_load(connection: Connection) -> None:
+    """
+    Настраивает транзакцию загрузки. SQLite не ждёт записи на диск.
+    В Postgres снимается таймаут запросов DB_STATEMENT_TIMEOUT,
+    который make_engine задаёт соединениям приложения: построение
+    индекса по миллионам строк идёт дольше, а его отмена откатила бы
+    всю загрузку.
+    """
+    if connection.dialect.name == 'sqlite':
+        connection.exec_driver_sql('PRAGMA synchronous = OFF')
+    elif connection.dialect.name == 'postgresql':
+        connection.exec_driver_sql('SET LOCAL statement_timeout = 0')
+
+
+def write_rows(connection: Connection, table: Table,
+               columns: Sequence[str], rows: List[Tuple[Any, ...]]) -> None:
+    """Записывает пачку строк самым быстрым путём драйвера"""
+    if not rows:
+        return
+    preparer = connection.dialect.identifier_preparer
+    target = f'{preparer.quote(table.name)} ' \
+        f'({", ".join(preparer.quote(column) for column in columns)})'
+    if connection.dialect.driver == 'psycopg2':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor: Any = connection.connection.cursor()
+        try:
+            cursor.copy_expert(f'COPY {target} FROM STDIN WITH (FORMAT csv)',
+                               buffer)
+        finally:
+            cursor.close()
+        return
+    placeholder = {'qmark': '?', 'format': '%s', 'pyformat': '%s'}.get(
+        connection.dialect.paramstyle)
+    if placeholder is None:
+        connection.execute(insert(table),
+                           [dict(zip(columns, row)) for row in rows])
+        return
+    connection.exec_driver_sql(
+        f'INSERT INTO {target} VALUES '
+        f'({", ".join([placeholder] * len(columns))})', rows)
+
+
+def _reset_sequences(connection: Connection) -> None:
+    """Продолжает последовательности id после загруженных строк"""
+    for model in (User, Tweet, Media):
+        table = _table(model)
+        last_id = connection.scalar(select(func.max(table.c.id))) or 0
+        connection.execute(
+            text('SELECT setval(pg_get_serial_sequence(:table, :column), '
+                 ':value, :called)'),
+            {'table': f'"{table.name}"', 'column': 'id',
+             'value': max(last_id, 1), 'called': last_id > 0})
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """Точка входа генератора"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    defaults = DatasetConfig()
+    parser.add_argument('--url', default='sqlite:///bench.db')
+    parser.add_argument('--users', type=int, default=defaults.users)
+    parser.add_argument('--tweets-per-user', type=float,
+                        default=defaults.tweets_per_user)
+    parser.add_argument('--follows-per-user', type=float,
+                        default=defaults.follows_per_user)
+    parser.add_argument('--likes-per-tweet', type=float,
+                        default=defaults.likes_per_tweet)
+    parser.add_argument('--media-share', type=float,
+                        default=defaults.media_share)
+    parser.add_argument('--popularity-exponent', type=float,
+                        default=defaults.popularity_exponent)
+    parser.add_argument('--seed', type=int, default=defaults.seed)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--media-root',
+                        help='каталог LocalMediaStorage для картинок')
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    dataset = generate(DatasetConfig(
+        users=args.users, tweets_per_user=args.tweets_per_user,
+        follows_per_user=args.follows_per_user,
+        likes_per_tweet=args.likes_per_tweet, media_share=args.media_share,
+        popularity_exponent=args.popularity_exponent, seed=args.seed))
+    generated = time.perf_counter()
+    loaded = load(make_engine(args.url), dataset,
+                  LocalMediaStorage(args.media_root) if args.media_root
+                  else None, args.batch_size)
+    finished = time.perf_counter()
+    for table_name, rows in loaded.items():
+        print(f'{rows:>12} {table_name}')
+    print(f'generated in {generated - started:.1f} s, '
+          f'loaded in {finished - generated:.1f} s')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
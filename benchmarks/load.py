@@ -0,0 +1,295 @@
+"""
+Нагрузочный бенчмарк HTTP-роутов.
+
+Загружает синтетический набор данных, запускает приложение
+в uvicorn и нагружает его смесью чтений и записей из нескольких
+асинхронных клиентов: ленты, профили, медиафайлы, лайки, подписки
+и новые твиты. Для каждого роута считает задержки p50/p95/p99
+и пропускную способность. С --baseline сравнивает результат
+с прошлым отчётом и завершается с кодом 1 при регрессии
+больше --threshold процентов.
+
+    python -m benchmarks.load --url sqlite:///bench.db --duration 30 \\
+        --output load.json --baseline old_load.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import ExitStack, contextmanager
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+import httpx
+import numpy as np
+from fastapi import FastAPI
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+
+from backend_server.database import make_async_engine, make_engine
+from backend_server.fastapi_api import create_app
+from backend_server.media_storage import LocalMediaStorage
+from backend_server.models import Media, Tweet, User
+from benchmarks.dataset import DatasetConfig, generate, load
+
+# Доли операций в смеси: лента и медиафайлы читаются чаще всего
+MIX: Dict[str, int] = {
+    'GET /api/tweets': 40,
+    'GET /api/tweets?mode=ranked': 5,
+    'GET /api/users/{id}': 10,
+    'GET /api/medias/{id}': 20,
+    'POST /api/tweets/{id}/likes': 8,
+    'DELETE /api/tweets/{id}/likes': 6,
+    'POST /api/users/{id}/follow': 3,
+    'DELETE /api/users/{id}/follow': 3,
+    'POST /api/tweets': 5,
+}
+PERCENTILES = (50, 95, 99)
+STARTUP_TIMEOUT = 30.0
+
+
+class Request(NamedTuple):
+    """Запрос нагрузки"""
+    endpoint: str
+    method: str
+    path: str
+    api_key: str
+    body: Optional[Dict[str, Any]] = None
+
+
+class Workload(NamedTuple):
+    """Границы данных, из которых выбираются цели запросов"""
+    api_keys: List[str]
+    users: int
+    tweets: int
+    medias: int
+
+    def request(self, endpoint: str, rng: random.Random) -> Request:
+        """Строит запрос операции со случайными пользователем и целью"""
+        method, template = endpoint.split(' ', 1)
+        api_key = rng.choice(self.api_keys)
+        target = rng.randint(1, {
+            'tweets': self.tweets, 'users': self.users,
+            'medias': self.medias,
+        }[template.split('/')[2].split('?')[0]] or 1)
+        body = None
+        if endpoint == 'POST /api/tweets':
+            body = {'tweet_data': f'load test {rng.random():.6f}',
+                    'tweet_media_ids': []}
+        return Request(endpoint, method,
+                       template.replace('{id}', str(target)), api_key, body)
+
+
+def read_workload(url: str, max_users: int = 10000) -> Workload:
+    """Читает из БД ключи пользователей и число строк"""
+    with Session(make_engine(url)) as session:
+        return Workload(
+            api_keys=list(session.scalars(
+                select(User.api_key).order_by(User.id).limit(max_users))),
+            users=session.scalar(select(func.max(User.id))) or 0,
+            tweets=session.scalar(select(func.max(Tweet.id))) or 0,
+            medias=session.scalar(select(func.max(Media.id))) or 0,
+        )
+
+
+def make_app() -> FastAPI:
+    """
+    Фабрика приложения для uvicorn --factory.
+    БД и хранилище медиафайлов задаются переменными окружения
+    BENCH_URL, BENCH_ASYNC_URL и BENCH_MEDIA_ROOT.
+    """
+    async_url = os.environ.get('BENCH_ASYNC_URL')
+    return create_app(
+        my_session=async_sessionmaker(make_async_engine(async_url))
+        if async_url else sessionmaker(make_engine(os.environ['BENCH_URL'])),
+        media_storage=LocalMediaStorage(os.environ['BENCH_MEDIA_ROOT']),
+    )
+
+
+@contextmanager
+def serve(url: str, media_root: str,
+          async_url: Optional[str] = None) -> Iterator[str]:
+    """Запускает приложение в отдельном процессе uvicorn, выдаёт его адрес"""
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    env = dict(os.environ, BENCH_URL=url, BENCH_MEDIA_ROOT=media_root)
+    if async_url:
+        env['BENCH_ASYNC_URL'] = async_url
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'benchmarks.load:make_app',
+         '--factory', '--port', str(port), '--log-level', 'warning'],
+        env=env)
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        _wait_ready(base_url, server)
+        yield base_url
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def _wait_ready(base_url: str, server: 'subprocess.Popen[bytes]') -> None:
+    """Ждёт, пока сервер начнёт отвечать"""
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline and server.poll() is None:
+        try:
+            httpx.get(f'{base_url}/api/stats/caches')
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError('Benchmark server did not start')
+
+
+Samples = Dict[str, List[float]]
+
+
+async def run_load(base_url: str, workload: Workload, concurrency: int,
+                   duration: float, warmup: float,
+                   seed: int) -> Tuple[Samples, Dict[str, int], float]:
+    """
+    Нагружает сервер concurrency клиентами с замкнутым циклом.
+    Возвращает задержки и число ошибок по роутам
+    и длительность измерения без прогрева.
+    """
+    samples: Samples = {endpoint: [] for endpoint in MIX}
+    errors: Dict[str, int] = {endpoint: 0 for endpoint in MIX}
+    loop = asyncio.get_running_loop()
+    started = loop.time() + warmup
+    stop = started + duration
+    endpoints, weights = list(MIX), list(MIX.values())
+
+    async def client(rng: random.Random) -> None:
+        async with httpx.AsyncClient(base_url=base_url, timeout=30) as http:
+            while loop.time() < stop:
+                request = workload.request(
+                    rng.choices(endpoints, weights)[0], rng)
+                sent = loop.time()
+                try:
+                    response = await http.request(
+                        request.method, request.path, json=request.body,
+                        headers={'api-key': request.api_key})
+                    failed = response.status_code >= 500
+                except httpx.HTTPError:
+                    failed = True
+                if sent < started:
+                    continue
+                samples[request.endpoint].append(loop.time() - sent)
+                errors[request.endpoint] += failed
+
+    await asyncio.gather(*(client(random.Random(seed * 1000 + worker))
+                           for worker in range(concurrency)))
+    return samples, errors, duration
+
+
+def summarize(samples: Samples, errors: Dict[str, int],
+              elapsed: float) -> Dict[str, Any]:
+    """Считает перцентили задержек в миллисекундах и запросы в секунду"""
+    report: Dict[str, Any] = {}
+    for endpoint, latencies in samples.items():
+        if not latencies:
+            continue
+        values = np.percentile(np.array(latencies) * 1000, PERCENTILES)
+        report[endpoint] = {
+            'requests': len(latencies),
+            'errors': errors[endpoint],
+            'rps': round(len(latencies) / elapsed, 2),
+            **{f'p{percentile}_ms': round(float(value), 3)
+               for percentile, value in zip(PERCENTILES, values)},
+        }
+    return report
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any],
+            threshold: float) -> List[str]:
+    """
+    Возвращает регрессии относительно baseline: рост p95
+    или падение пропускной способности больше threshold процентов
+    и появление ошибок.
+    """
+    regressions = []
+    limit = 1 + threshold / 100
+    for endpoint, result in report.items():
+        old = baseline.get(endpoint)
+        if old is None:
+            continue
+        if result['p95_ms'] > old['p95_ms'] * limit:
+            regressions.append(
+                f'{endpoint}: p95 {old["p95_ms"]} -> {result["p95_ms"]} ms')
+        if result['rps'] * limit < old['rps']:
+            regressions.append(
+                f'{endpoint}: rps {old["rps"]} -> {result["rps"]}')
+        if result['errors'] > old['errors']:
+            regressions.append(
+                f'{endpoint}: errors {old["errors"]} -> {result["errors"]}')
+    return regressions
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """Точка входа бенчмарка. Возвращает 1 при регрессии"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--url', default='sqlite:///bench.db')
+    parser.add_argument('--async-url',
+                        help='URL асинхронного драйвера той же БД')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-seed', action='store_true',
+                        help='использовать уже заполненную БД')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--warmup', type=float, default=3.0)
+    parser.add_argument('--media-root',
+                        help='каталог медиафайлов, по умолчанию временный')
+    parser.add_argument('--output', help='файл отчёта JSON')
+    parser.add_argument('--baseline', help='прошлый отчёт для сравнения')
+    parser.add_argument('--threshold', type=float, default=20.0,
+                        help='допустимая регрессия, проценты')
+    args = parser.parse_args(argv)
+
+    with ExitStack() as stack:
+        media_root = args.media_root or stack.enter_context(
+            tempfile.TemporaryDirectory())
+        if not args.no_seed:
+            load(make_engine(args.url),
+                 generate(DatasetConfig(users=args.users, seed=args.seed)),
+                 LocalMediaStorage(media_root))
+        workload = read_workload(args.url)
+        base_url = stack.enter_context(
+            serve(args.url, media_root, args.async_url))
+        report = summarize(*asyncio.run(run_load(
+            base_url, workload, args.concurrency,
+            args.duration, args.warmup, args.seed)))
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    for endpoint, result in report.items():
+        print(f'{result["rps"]:>9.1f} rps {result["p50_ms"]:>9.3f} '
+              f'{result["p95_ms"]:>9.3f} {result["p99_ms"]:>9.3f} ms  '
+              f'{endpoint}')
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(report, json.load(baseline_file),
+                                  args.threshold)
+    for regression in regressions:
+        print(regression)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
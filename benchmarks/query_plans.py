@@ -0,0 +1,424 @@
+"""
+Бенчмарк планов запросов горячих путей.
+
+Заполняет БД большим набором данных, выполняет сервисы, которые
+вызывают роуты, и записывает все выданные ими SQL-запросы.
+Для каждого запроса сохраняет план EXPLAIN и медианную задержку,
+для каждого сценария - медианную задержку всех его запросов.
+С --baseline сравнивает планы с прошлым отчётом
+и отмечает изменившиеся планы и полные просмотры таблиц.
+
+    python -m benchmarks.query_plans --url sqlite:///bench.db \\
+        --output plans.json --baseline old_plans.json
+"""
+import argparse
+import json
+import re
+import statistics
+import sys
+import time
+from functools import partial
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    cast,
+)
+
+from sqlalchemy import ColumnElement, event, exists, func, select
+from sqlalchemy.engine.base import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from backend_server import services
+from backend_server.auth import ApiKeyResolver
+from backend_server.counters import CounterAggregator
+from backend_server.database import make_engine
+from backend_server.export import encode_rows, export_statement
+from backend_server.follow_graph import FollowGraph
+from backend_server.media_storage import blob_key
+from backend_server.media_variants import MEDIA_FEED_SIZE, ImageInfo
+from backend_server.models import Follow, Media, Tweet, User
+from backend_server.search import (
+    MemorySearchIndex,
+    SearchIndex,
+    make_search_index,
+)
+from backend_server.timeline import HomeTimelineCache
+from backend_server.trends import TrendingTopics
+from backend_server.user_profiles import FOLLOWERS, FOLLOWING, ProfileCache
+from benchmarks.dataset import VOCABULARY, DatasetConfig, generate, load
+
+# Признаки полного просмотра таблицы в планах SQLite и PostgreSQL
+FULL_SCAN_MARKERS = ('Seq Scan',)
+SQLITE_SCAN_PREFIX = 'SCAN '
+SQLITE_INDEX_MARKERS = ('USING INDEX', 'USING COVERING INDEX',
+                        'USING INTEGER PRIMARY KEY')
+
+# Роуты, которые не обращаются к БД и сценариев не требуют
+ROUTES_WITHOUT_QUERIES = frozenset({
+    'GET /api/stats/caches', 'GET /api/stats/pool', 'GET /metrics',
+    'GET /api/profiles', 'GET /api/profiles/{}',
+})
+PATH_PARAMETER = re.compile(r'\{\w+\}')
+SCENARIO_ROUTE = re.compile(r'\b([A-Z]+) (/[^\s?]*)')
+# Слово поисковых запросов - самое частое в наборе данных
+SEARCH_WORD = VOCABULARY[0]
+
+Scenario = Callable[[Session], Any]
+Statement = Tuple[str, Any]
+# Запрос, его параметры и время выполнения в секундах
+TimedStatement = Tuple[str, Any, float]
+
+
+def seed(bench_engine: Engine, users: int, tweets: int,
+         likes: int, follows: int) -> None:
+    """Пересоздаёт схему и загружает синтетический набор данных"""
+    load(bench_engine, generate(DatasetConfig(
+        users=users, tweets_per_user=tweets / users,
+        follows_per_user=follows / users,
+        likes_per_tweet=likes / max(tweets, 1),
+    )))
+
+
+class Subjects(NamedTuple):
+    """Пользователи, твит и медиафайл, на которых выполняются сценарии"""
+    reader: int
+    author: int
+    api_key: str
+    author_name: str
+    followee: int
+    tweet: int
+    media: int
+
+
+def find_subjects(session: Session) -> Subjects:
+    """
+    Выбирает самого активного читателя, самого популярного автора,
+    пользователя, на которого читатель ещё не подписан,
+    и самые новые твит и медиафайл
+    """
+    reader = session.scalar(select(User.id).order_by(
+        User.following_count.desc()).limit(1)) or 1
+    author = session.scalar(select(User.id).order_by(
+        User.followers_count.desc()).limit(1)) or 1
+    followee = session.scalar(
+        select(User.id)
+        .where(User.id != reader)
+        .where(~exists().where(
+            cast(ColumnElement[bool], reader == Follow.follower_id),
+            Follow.following_id == User.id))
+        .limit(1)) or author
+    return Subjects(
+        reader=reader, author=author,
+        api_key=session.scalar(select(User.api_key).where(
+            cast(ColumnElement[bool], reader == User.id))) or '',
+        author_name=session.scalar(select(User.name).where(
+            cast(ColumnElement[bool], author == User.id))) or '',
+        followee=followee,
+        tweet=session.scalar(select(func.max(Tweet.id))) or 1,
+        media=session.scalar(select(func.max(Media.id))) or 1,
+    )
+
+
+def scenarios(session: Session) -> Dict[str, Scenario]:
+    """
+    Сервисы в том виде, в каком их вызывают роуты,
+    для самого активного читателя и самого популярного автора.
+    Имя сценария - вызываемые роуты через ' + ', каждый в виде
+    'МЕТОД /путь', за которым могут идти параметры и пояснение.
+    Индексы в памяти строятся заранее, как при старте приложения,
+    и в запросы сценариев не попадают.
+    """
+    subjects = find_subjects(session)
+    counters = CounterAggregator(flush_interval=0)
+    search, graph = make_search_index(session), FollowGraph()
+    search.load(session)
+    graph.load(session)
+    return {
+        **read_scenarios(subjects, counters),
+        **listing_scenarios(subjects, counters, search, graph),
+        **write_scenarios(subjects, counters),
+    }
+
+
+def read_scenarios(subjects: Subjects,
+                   counters: CounterAggregator) -> Dict[str, Scenario]:
+    """Сценарии чтения лент, профилей и медиафайлов"""
+    reader, author, media = subjects.reader, subjects.author, subjects.media
+    return {
+        'api-key lookup': lambda my_session: ApiKeyResolver().load(
+            my_session, subjects.api_key),
+        'GET /api/tweets': lambda my_session: services.read_feed(
+            my_session, HomeTimelineCache(), counters, reader, 100, None),
+        'GET /api/tweets?mode=ranked':
+            lambda my_session: services.read_ranked_feed(
+                my_session, counters, reader, 100, None),
+        'GET /api/users/me': lambda my_session: services.read_user_by_id(
+            my_session, counters, reader),
+        'GET /api/users/{id}': lambda my_session: services.read_user_by_id(
+            my_session, counters, author),
+        'GET /api/users/{id}?compact=true':
+            lambda my_session: services.read_user_summary(
+                my_session, ProfileCache(), counters, author),
+        'GET /api/medias/{id}': lambda my_session: services.read_media(
+            my_session, media),
+        'GET /api/medias/{id}?size=feed':
+            lambda my_session: services.read_media_variant(
+                my_session, media, 'feed', MEDIA_FEED_SIZE),
+    }
+
+
+def listing_scenarios(
+        subjects: Subjects, counters: CounterAggregator,
+        search: SearchIndex, graph: FollowGraph) -> Dict[str, Scenario]:
+    """Сценарии поиска, упоминаний, подписок, рекомендаций и выгрузки"""
+    reader, author = subjects.reader, subjects.author
+
+    def stream(my_session: Session) -> None:
+        services.read_following_ids(my_session, reader)
+        services.read_tweet_author(my_session, subjects.tweet)
+        services.read_tweet_payload(my_session, counters, subjects.tweet)
+
+    listings: Dict[str, Scenario] = {
+        'GET /api/search': lambda my_session: services.search_tweets(
+            my_session, search, counters, SEARCH_WORD, 100, 0),
+        'GET /api/users/me/mentions':
+            lambda my_session: services.read_mentions(
+                my_session, counters, author, 100, None),
+        'GET /api/users/{id}/followers':
+            lambda my_session: services.read_follows(
+                my_session, author, FOLLOWERS, 100, None),
+        'GET /api/users/{id}/following':
+            lambda my_session: services.read_follows(
+                my_session, reader, FOLLOWING, 100, None),
+        'GET /api/users/me/suggestions':
+            lambda my_session: services.read_suggestions(
+                my_session, graph, reader, 20),
+        'GET /api/trends': lambda my_session: services.read_trends(
+            my_session, TrendingTopics(), 10),
+        'GET /api/stream': stream,
+    }
+    # Выгрузка продолжается с середины таблицы
+    resume_keys = {'tweets': (subjects.tweet // 2, ),
+                   'likes': (subjects.tweet // 2, 0),
+                   'follows': (reader, 0)}
+    for table, after in resume_keys.items():
+        listings[f'GET /api/export/{{table}}?table={table}'] = \
+            partial(export_chunk, table=table, after=after)
+    return listings
+
+
+def export_chunk(my_session: Session, table: str,
+                 after: Sequence[int]) -> bytes:
+    """Читает первую пачку выгрузки таблицы после ключа after"""
+    result = my_session.execute(export_statement(table, after, 100))
+    try:
+        return encode_rows(table, next(result.partitions(), []))
+    finally:
+        result.close()
+
+
+def write_scenarios(subjects: Subjects,
+                    counters: CounterAggregator) -> Dict[str, Scenario]:
+    """Сценарии создания и удаления записей"""
+    reader, tweet, media = subjects.reader, subjects.tweet, subjects.media
+    content = b'bench media'
+
+    def like_unlike(my_session: Session) -> None:
+        services.add_like(my_session, counters, reader, tweet)
+        services.delete_like(my_session, counters, reader, tweet)
+
+    def follow_unfollow(my_session: Session) -> None:
+        timelines = HomeTimelineCache()
+        services.add_follow(my_session, timelines, counters,
+                            reader, subjects.followee)
+        services.delete_follow(my_session, timelines, counters,
+                               reader, subjects.followee)
+
+    def create_delete_tweet(my_session: Session) -> None:
+        timelines, search = HomeTimelineCache(), MemorySearchIndex()
+        result = services.add_tweet(
+            my_session, timelines, search, TrendingTopics(), reader,
+            f'bench #bench @{subjects.author_name}', [media])
+        services.delete_tweet(my_session, timelines, search, reader,
+                              result.tweet_id or 0)
+
+    return {
+        'POST /api/medias': lambda my_session: services.add_media(
+            my_session, blob_key(content), len(content),
+            ImageInfo('image/png', 1, 1)),
+        'POST /api/tweets + DELETE /api/tweets/{id}': create_delete_tweet,
+        'POST /api/tweets/{id}/likes + DELETE /api/tweets/{id}/likes':
+            like_unlike,
+        'POST /api/users/{id}/follow + DELETE /api/users/{id}/follow':
+            follow_unfollow,
+    }
+
+
+def scenario_routes(name: str) -> Set[str]:
+    """
+    Возвращает роуты сценария в виде 'МЕТОД /путь'
+    с параметрами пути, заменёнными на {}.
+    У вспомогательных сценариев вроде 'api-key lookup' роутов нет.
+    """
+    return {f'{method} {PATH_PARAMETER.sub("{}", path)}'
+            for method, path in SCENARIO_ROUTE.findall(name)}
+
+
+def capture(bench_engine: Engine, session: Session,
+            scenario: Scenario) -> List[TimedStatement]:
+    """
+    Выполняет сценарий и возвращает выданные им SQL-запросы
+    со временем выполнения каждого
+    """
+    statements: List[TimedStatement] = []
+
+    def started(conn: Any, cursor: Any, statement: str, parameters: Any,
+                context: Any, executemany: bool) -> None:
+        conn.info['query_started'] = time.perf_counter()
+
+    def finished(conn: Any, cursor: Any, statement: str, parameters: Any,
+                 context: Any, executemany: bool) -> None:
+        statements.append((statement, parameters, time.perf_counter()
+                           - conn.info.pop('query_started')))
+
+    event.listen(bench_engine, 'before_cursor_execute', started)
+    event.listen(bench_engine, 'after_cursor_execute', finished)
+    try:
+        scenario(session)
+    finally:
+        event.remove(bench_engine, 'before_cursor_execute', started)
+        event.remove(bench_engine, 'after_cursor_execute', finished)
+    return statements
+
+
+def explain(bench_engine: Engine, statement: Statement) -> List[str]:
+    """Возвращает план запроса построчно"""
+    sql, parameters = statement
+    prefix = 'EXPLAIN QUERY PLAN ' if bench_engine.dialect.name == 'sqlite' \
+        else 'EXPLAIN '
+    with bench_engine.connect() as connection:
+        rows = connection.exec_driver_sql(prefix + sql, parameters).all()
+        connection.rollback()
+    return [str(row[-1]) for row in rows]
+
+
+def full_scans(plan: Sequence[str]) -> List[str]:
+    """Возвращает строки плана с полным просмотром таблицы"""
+    return [
+        line for line in plan
+        if any(marker in line for marker in FULL_SCAN_MARKERS)
+        or (line.startswith(SQLITE_SCAN_PREFIX)
+            and not any(marker in line for marker in SQLITE_INDEX_MARKERS))
+    ]
+
+
+def measure(bench_engine: Engine, repeats: int) -> Dict[str, Any]:
+    """Собирает планы и медианные задержки сценариев и их запросов"""
+    make_session = sessionmaker(bench_engine)
+    report: Dict[str, Any] = {}
+    with make_session() as session:
+        named_scenarios = scenarios(session)
+    for name, scenario in named_scenarios.items():
+        runs, durations = [], []
+        with make_session() as session:
+            for _ in range(max(repeats, 1)):
+                started = time.perf_counter()
+                runs.append(capture(bench_engine, session, scenario))
+                durations.append(time.perf_counter() - started)
+        timings: Dict[str, List[float]] = {}
+        for run in runs:
+            for sql, _, seconds in run:
+                timings.setdefault(sql, []).append(seconds)
+        report[name] = {
+            'latency_ms': _median_ms(durations),
+            'queries': [
+                {'sql': sql, 'plan': explain(bench_engine, (sql, params)),
+                 'latency_ms': _median_ms(timings[sql])}
+                for sql, params in _distinct(runs[0])
+            ],
+        }
+    return report
+
+
+def _median_ms(timings: Sequence[float]) -> float:
+    return round(statistics.median(timings) * 1000, 3)
+
+
+def _distinct(statements: Sequence[TimedStatement]) -> List[Statement]:
+    """Оставляет по одному экземпляру каждого текста запроса"""
+    seen: Dict[str, Statement] = {}
+    for sql, parameters, _ in statements:
+        seen.setdefault(sql, (sql, parameters))
+    return list(seen.values())
+
+
+def compare(report: Dict[str, Any],
+            baseline: Optional[Dict[str, Any]]) -> List[str]:
+    """Возвращает предупреждения: полные просмотры и изменения планов"""
+    warnings = []
+    for name, result in report.items():
+        old_plans = {
+            query['sql']: query['plan']
+            for query in (baseline or {}).get(name, {}).get('queries', [])
+        }
+        for query in result['queries']:
+            for line in full_scans(query['plan']):
+                warnings.append(f'{name}: full scan: {line}')
+            old_plan = old_plans.get(query['sql'])
+            if old_plan is not None and old_plan != query['plan']:
+                warnings.append(f'{name}: plan changed: {query["sql"]}')
+    return warnings
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    """Печатает задержки сценариев и их запросов"""
+    for name, result in report.items():
+        print(f'{result["latency_ms"]:>10.3f} ms  {name}')
+        for query in result['queries']:
+            sql = ' '.join(query['sql'].split())
+            print(f'{query["latency_ms"]:>10.3f} ms    {sql[:100]}')
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """Точка входа бенчмарка. Возвращает 1 при изменившихся планах"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--url', default='sqlite:///bench.db')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--tweets', type=int, default=100000)
+    parser.add_argument('--likes', type=int, default=300000)
+    parser.add_argument('--follows', type=int, default=50000)
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--no-seed', action='store_true',
+                        help='использовать уже заполненную БД')
+    parser.add_argument('--output', help='файл отчёта JSON')
+    parser.add_argument('--baseline', help='прошлый отчёт для сравнения')
+    args = parser.parse_args(argv)
+
+    bench_engine = make_engine(args.url)
+    if not args.no_seed:
+        seed(bench_engine, args.users, args.tweets, args.likes, args.follows)
+    report = measure(bench_engine, args.repeats)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2, ensure_ascii=False)
+    print_report(report)
+    warnings = compare(report, baseline)
+    for warning in warnings:
+        print(warning)
+    return 1 if any('plan changed' in warning for warning in warnings) \
+        else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,15 +1,21 @@
+from pathlib import Path
+
 import pytest
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.engine.base import Engine
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy.orm.decl_api import DeclarativeMeta
 
-from backend_server.database import Base
+from backend_server.counters import reconcile_counters
+from backend_server.database import Base, make_async_engine, make_engine
 from backend_server.fastapi_api import create_app
+from backend_server.media_storage import LocalMediaStorage
 from backend_server.models import Follow, Media, Tweet, User
 from backend_server.routes import connect_routes
+from tests.sql_budget import sql_recorder  # noqa: F401
 
 
 def input_test_data(
@@ -38,6 +44,7 @@ def input_test_data(
     user1.liked_tweets.append(tweet2)
 
     sqlalchemy_session.commit()
+    reconcile_counters(sqlalchemy_session)
 
 
 @pytest.fixture
@@ -55,13 +62,20 @@ def session(engine: Engine) -> Session:
 
 
 @pytest.fixture
-def app(engine: Engine, session: Session) -> FastAPI:
+def media_storage(tmp_path: Path) -> LocalMediaStorage:
+    """Инициализация хранилища медиафайлов во временном каталоге"""
+    return LocalMediaStorage(str(tmp_path / 'media'))
+
+
+@pytest.fixture
+def app(engine: Engine, session: Session,
+        media_storage: LocalMediaStorage) -> FastAPI:
     """Инициализация экземпляра приложения"""
     input_test_data(base=Base,
                     sqlalchemy_session=session,
                     sqlalchemy_engine=engine)
     _app = create_app()
-    connect_routes(app=_app, my_session=session)
+    connect_routes(app=_app, my_session=session, media_storage=media_storage)
     return _app
 
 
@@ -70,3 +84,32 @@ def client(app: FastAPI) -> TestClient:
     """Инициализация экземпляра тестового клиента"""
     _client = TestClient(app=app)
     return _client
+
+
+@pytest.fixture
+def pooled_client(
+        app: FastAPI, media_storage: LocalMediaStorage) -> TestClient:
+    """
+    Инициализация тестового клиента приложения,
+    открывающего отдельную сессию из пула на каждый запрос
+    """
+    _app = create_app(
+        my_session=sessionmaker(make_engine('sqlite:///test.db')),
+        media_storage=media_storage,
+    )
+    return TestClient(app=_app)
+
+
+@pytest.fixture
+def async_client(
+        app: FastAPI, media_storage: LocalMediaStorage) -> TestClient:
+    """
+    Инициализация тестового клиента приложения
+    в асинхронном режиме на AsyncSession и aiosqlite
+    """
+    _app = create_app(
+        my_session=async_sessionmaker(
+            make_async_engine('sqlite+aiosqlite:///test.db')),
+        media_storage=media_storage,
+    )
+    return TestClient(app=_app)
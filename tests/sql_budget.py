@@ -0,0 +1,109 @@
+"""
+Плагин pytest: бюджет SQL-запросов на HTTP-запрос.
+
+Фикстура sql_recorder подписывается на before_cursor_execute
+и after_cursor_execute двигателя из conftest и относит каждый
+SQL-запрос к выполняющемуся запросу TestClient. Тест проверяет
+бюджет маршрута, например:
+
+    sql_recorder.assert_budget('GET /api/tweets', statements=3)
+"""
+import time
+from typing import Any, Callable, Iterator, List, Optional
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.engine.base import Engine
+
+STARTED_KEY = 'sql_budget_started'
+
+
+class RequestQueries:
+    """SQL-запросы одного HTTP-запроса и суммарное время БД"""
+
+    def __init__(self, route: str) -> None:
+        self.route = route
+        self.statements: List[str] = []
+        self.duration = 0.0
+
+    def __repr__(self) -> str:
+        return f'{self.route}: {len(self.statements)} statements, ' \
+            f'{self.duration * 1000:.3f} ms'
+
+
+class SqlRecorder:
+    """Записывает SQL-запросы двигателя по HTTP-запросам"""
+
+    def __init__(self, engine: Engine) -> None:
+        self.engine = engine
+        self.requests: List[RequestQueries] = []
+        self._current: Optional[RequestQueries] = None
+
+    def start(self) -> None:
+        """Подписывается на события двигателя"""
+        event.listen(self.engine, 'before_cursor_execute', self._before)
+        event.listen(self.engine, 'after_cursor_execute', self._after)
+
+    def stop(self) -> None:
+        """Отписывается от событий двигателя"""
+        event.remove(self.engine, 'before_cursor_execute', self._before)
+        event.remove(self.engine, 'after_cursor_execute', self._after)
+
+    def wrap(self, request: Callable[..., Any]) -> Callable[..., Any]:
+        """Оборачивает TestClient.request записью SQL-запросов"""
+
+        def recorded_request(method: str, url: Any,
+                             *args: Any, **kwargs: Any) -> Any:
+            self._current = RequestQueries(f'{method.upper()} {url}')
+            self.requests.append(self._current)
+            try:
+                return request(method, url, *args, **kwargs)
+            finally:
+                self._current = None
+
+        return recorded_request
+
+    def _before(self, conn: Any, cursor: Any, statement: str,
+                parameters: Any, context: Any, executemany: bool) -> None:
+        if self._current is not None:
+            self._current.statements.append(statement)
+            conn.info[STARTED_KEY] = time.perf_counter()
+
+    def _after(self, conn: Any, cursor: Any, statement: str,
+               parameters: Any, context: Any, executemany: bool) -> None:
+        started = conn.info.pop(STARTED_KEY, None)
+        if self._current is not None and started is not None:
+            self._current.duration += time.perf_counter() - started
+
+    def route(self, route: str) -> List[RequestQueries]:
+        """Возвращает записанные запросы маршрута вида 'GET /api/tweets'"""
+        return [request for request in self.requests
+                if request.route == route]
+
+    def assert_budget(self, route: str, statements: int,
+                      duration: Optional[float] = None) -> None:
+        """
+        Проверяет, что каждый записанный запрос маршрута выполнил
+        не больше statements SQL-запросов и, если задано,
+        провёл в БД не больше duration секунд.
+        """
+        requests = self.route(route)
+        assert requests, f'{route} was not requested'
+        for request in requests:
+            assert len(request.statements) <= statements, \
+                f'{request} > {statements}:\n' + \
+                '\n'.join(request.statements)
+            assert duration is None or request.duration <= duration, \
+                f'{request} > {duration * 1000:.3f} ms'
+
+
+@pytest.fixture
+def sql_recorder(engine: Engine, client: TestClient,
+                 monkeypatch: pytest.MonkeyPatch) -> Iterator[SqlRecorder]:
+    """Записывает SQL-запросы каждого запроса тестового клиента"""
+    recorder = SqlRecorder(engine)
+    monkeypatch.setattr(client, 'request', recorder.wrap(client.request))
+    recorder.start()
+    yield recorder
+    recorder.stop()
@@ -0,0 +1,42 @@
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from backend_server.auth import ApiKeyResolver
+from backend_server.models import User
+
+
+def test_resolver_caches_users(session: Session, client: TestClient) -> None:
+    """Тест кэширования известных и неизвестных ключей"""
+    resolver = ApiKeyResolver()
+    assert resolver.resolve(session, 'test') == 1
+    assert resolver.resolve(session, 'test') == 1
+    assert resolver.resolve(session, 'unknown') is None
+    assert resolver.resolve(session, 'unknown') is None
+    assert resolver.statistics() == {'hits': 2, 'misses': 2, 'entries': 2}
+
+
+def test_resolver_expires_entries(session: Session, client: TestClient) -> None:
+    """Тест истечения срока жизни и вытеснения записей"""
+    resolver = ApiKeyResolver(max_size=1, ttl=0)
+    resolver.resolve(session, 'test')
+    assert resolver.cached('test') == (False, None)
+    resolver.resolve(session, 'test2')
+    assert resolver.statistics()['entries'] == 1
+
+
+def test_resolver_invalidated_on_key_change(
+        session: Session, client: TestClient) -> None:
+    """Тест сброса кэша при смене и создании ключей"""
+    resolver = ApiKeyResolver()
+    assert resolver.resolve(session, 'test') == 1
+    assert resolver.resolve(session, 'new_key') is None
+    user = session.get(User, 1)
+    assert user
+    user.api_key = 'new_key'
+    session.commit()
+    assert resolver.resolve(session, 'test') is None
+    assert resolver.resolve(session, 'new_key') == 1
+    assert resolver.resolve(session, 'third_key') is None
+    session.add(User(api_key='third_key', name='name_three'))
+    session.commit()
+    assert resolver.resolve(session, 'third_key') == 3
@@ -0,0 +1,101 @@
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from backend_server.counters import (
+    FOLLOWERS_COUNT,
+    LIKE_COUNT,
+    CounterAggregator,
+    reconcile_counters,
+)
+from backend_server.models import Tweet, User
+
+
+def test_aggregator_batches_updates(
+        session: Session, client: TestClient) -> None:
+    """Тест суммирования приращений и записи одним UPDATE на счётчик"""
+    counters = CounterAggregator(flush_interval=3600)
+    counters.add(LIKE_COUNT, 1, 1)
+    counters.add(LIKE_COUNT, 1, 1)
+    counters.add(LIKE_COUNT, 2, 1)
+    counters.add(LIKE_COUNT, 2, -1)
+    counters.add(FOLLOWERS_COUNT, 1, 1)
+    assert counters.flush_due(session) == 0
+    assert counters.pending(LIKE_COUNT, 1) == 2
+    assert counters.flush(session) == 2
+    assert counters.statistics() == {'pending': 0, 'flushes': 1,
+                                     'updates': 2}
+    tweet, user = session.get(Tweet, 1), session.get(User, 1)
+    assert tweet and user
+    session.refresh(tweet)
+    session.refresh(user)
+    assert tweet.like_count == 2
+    assert user.followers_count == 1
+
+
+def test_counters_in_responses(client: TestClient) -> None:
+    """Тест счётчиков в ответах с учётом ещё не записанных приращений"""
+    headers = {'api-key': 'test2'}
+    assert client.post('/api/tweets/1/likes', headers=headers
+                       ).json() == {'result': True}
+    assert client.post('/api/users/1/follow', headers=headers
+                       ).json() == {'result': True}
+    tweets = client.get('/api/tweets', headers=headers).json()['tweets']
+    assert [tweet['like_count'] for tweet in tweets] == [1]
+    tweets = client.get('/api/tweets',
+                        headers={'api-key': 'test'}).json()['tweets']
+    assert [tweet['like_count'] for tweet in tweets] == [1]
+    user = client.get('/api/users/1').json()['user']
+    assert (user['followers_count'], user['following_count']) == (1, 1)
+    assert client.delete('/api/users/1/follow', headers=headers
+                         ).json() == {'result': True}
+    user = client.get('/api/users/me', headers=headers).json()['user']
+    assert (user['followers_count'], user['following_count']) == (1, 0)
+
+
+def test_counters_flushed_on_shutdown(
+        app: FastAPI, session: Session) -> None:
+    """Тест записи накопленных счётчиков при остановке приложения"""
+    with TestClient(app=app) as client:
+        client.post('/api/tweets/1/likes', headers={'api-key': 'test2'})
+    tweet = session.get(Tweet, 1)
+    assert tweet
+    session.refresh(tweet)
+    assert tweet.like_count == 1
+
+
+def test_counters_flushed_by_timer(
+        session: Session, client: TestClient) -> None:
+    """Тест записи приращений по таймеру без новых лайков и подписок"""
+    counters = CounterAggregator(flush_interval=0.02)
+
+    async def scenario() -> int:
+        await counters.start(session)
+        counters.add(LIKE_COUNT, 1, 3)
+        await asyncio.sleep(0.2)
+        await counters.stop()
+        return counters.pending(LIKE_COUNT, 1)
+
+    assert asyncio.run(scenario()) == 0
+    assert counters.statistics()['flushes'] >= 1
+    tweet = session.get(Tweet, 1)
+    assert tweet
+    session.refresh(tweet)
+    assert tweet.like_count == 3
+
+
+def test_reconcile_counters(session: Session, client: TestClient) -> None:
+    """Тест пересчёта разошедшихся счётчиков по таблицам like и follow"""
+    session.execute(update(Tweet).values(like_count=7))
+    session.execute(update(User).where(User.id == 2)
+                    .values(followers_count=0))
+    session.commit()
+    assert reconcile_counters(session) == 3
+    assert reconcile_counters(session) == 0
+    assert [tweet.like_count for tweet in session.query(Tweet)
+            .order_by(Tweet.id)] == [0, 1]
+    user = session.get(User, 2)
+    assert user and user.followers_count == 1
@@ -0,0 +1,79 @@
+from pathlib import Path
+from types import SimpleNamespace
+from typing import List
+
+import numpy as np
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session
+
+from backend_server.counters import reconcile_counters
+from backend_server.media_storage import LocalMediaStorage
+from backend_server.models import Follow, Like, Media, Tweet
+from benchmarks.dataset import DatasetConfig, generate, load, tune_bulk_load
+
+CONFIG = DatasetConfig(users=300, tweets_per_user=5, follows_per_user=10,
+                       likes_per_tweet=4, media_share=0.5, seed=7)
+
+
+def test_generate_is_deterministic() -> None:
+    """Тест воспроизводимости набора и формы распределений"""
+    dataset = generate(CONFIG)
+    again = generate(CONFIG)
+    for left, right in zip(dataset[1:], again[1:]):
+        assert np.array_equal(left, right)
+    assert not np.array_equal(generate(CONFIG._replace(seed=8)).follows,
+                              dataset.follows)
+    follows = dataset.follows
+    assert not (follows[:, 0] == follows[:, 1]).any()
+    assert len(np.unique(follows, axis=0)) == len(follows)
+    followers = np.sort(np.bincount(follows[:, 1]))[::-1]
+    # Степенной закон: у 5% самых популярных больше трети подписчиков
+    assert followers[:CONFIG.users // 20].sum() > len(follows) / 3
+
+
+def test_load(tmp_path: Path) -> None:
+    """Тест загрузки: строки, счётчики и картинки медиафайлов"""
+    bench_engine = create_engine(f'sqlite:///{tmp_path / "bench.db"}')
+    dataset = generate(CONFIG)
+    storage = LocalMediaStorage(str(tmp_path / 'media'))
+    loaded = load(bench_engine, dataset, storage, batch_size=100)
+    assert loaded['like'] == len(dataset.likes)
+    assert loaded['tweet'] == len(dataset.tweet_authors)
+    with Session(bench_engine) as session:
+        assert session.scalar(select(func.count()).select_from(Follow)) \
+            == len(dataset.follows)
+        assert session.scalar(select(func.count()).select_from(Like)) \
+            == len(dataset.likes)
+        assert reconcile_counters(session) == 0
+        media_id, sha256 = session.execute(
+            select(Media.id, Media.sha256).limit(1)).one()
+        assert session.scalar(select(Tweet.media_ids).where(
+            Tweet.id == select(Media.tweet_id).where(Media.id == media_id)
+            .scalar_subquery())) == [media_id]
+    assert storage.exists(sha256)
+    with open(storage.path(sha256), 'rb') as blob:
+        assert blob.read(8) == b'\x89PNG\r\n\x1a\n'
+
+
+class RecordingConnection:
+    """Соединение, запоминающее выполненные команды"""
+
+    def __init__(self, dialect: str) -> None:
+        self.dialect = SimpleNamespace(name=dialect)
+        self.statements: List[str] = []
+
+    def exec_driver_sql(self, statement: str) -> None:
+        self.statements.append(statement)
+
+
+def test_bulk_load_lifts_statement_timeout() -> None:
+    """
+    Тест снятия таймаута запросов приложения в транзакции загрузки
+    Postgres: иначе построение индексов отменится и откатит загрузку
+    """
+    connection = RecordingConnection('postgresql')
+    tune_bulk_load(connection)  # type: ignore[arg-type]
+    assert connection.statements == ['SET LOCAL statement_timeout = 0']
+    connection = RecordingConnection('sqlite')
+    tune_bulk_load(connection)  # type: ignore[arg-type]
+    assert connection.statements == ['PRAGMA synchronous = OFF']
@@ -0,0 +1,71 @@
+import gzip
+import json
+from pathlib import Path
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import Session
+
+from backend_server.database import make_async_engine
+from backend_server.export import iter_export, main
+from backend_server.fastapi_api import create_app
+from backend_server.routes import connect_routes_export
+
+
+def test_iter_export_batches(app: FastAPI, session: Session) -> None:
+    """Тест выгрузки по одной строке в пачке и продолжения по ключу"""
+    chunks = list(iter_export(session, 'tweets', batch_size=1))
+    assert [json.loads(chunk) for chunk in chunks] == [
+        {'id': 1, 'user_id': 1, 'content': 'some_text',
+         'media_ids': [1, 2], 'like_count': 0},
+        {'id': 2, 'user_id': 2, 'content': 'some_text2',
+         'media_ids': [2], 'like_count': 1},
+    ]
+    assert list(iter_export(session, 'follows', after=(1, 2))) == []
+
+
+def test_export_route(app: FastAPI, session: Session) -> None:
+    """Тест доступа, ключа продолжения и сжатия выгрузки"""
+    export_app = create_app()
+    connect_routes_export(app=export_app, my_session=session,
+                          admin_keys={'admin'})
+    client = TestClient(export_app)
+    assert client.get('/api/export/likes',
+                      headers={'api-key': 'test'}).status_code == 403
+    headers = {'api-key': 'admin'}
+    assert client.get('/api/export/likes?after=1',
+                      headers=headers).status_code == 400
+
+    response = client.get('/api/export/likes', headers=headers)
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    assert response.text == '{"tweet_id":2,"user_id":1}\n'
+    assert client.get('/api/export/likes?after=2,1',
+                      headers=headers).text == ''
+
+    response = client.get('/api/export/follows?gzip=true', headers=headers)
+    assert response.headers['content-encoding'] == 'gzip'
+    assert response.text == '{"follower_id":1,"following_id":2}\n'
+
+
+def test_export_cli(app: FastAPI, tmp_path: Path) -> None:
+    """Тест выгрузки в сжатый файл из командной строки"""
+    output = tmp_path / 'tweets.ndjson.gz'
+    assert main(['tweets', '--url', 'sqlite:///test.db', '--after', '1',
+                 '--gzip', '--output', str(output)]) == 0
+    with gzip.open(output) as export_file:
+        assert [json.loads(line)['id'] for line in export_file] == [2]
+
+
+def test_export_route_async(app: FastAPI) -> None:
+    """Тест выгрузки серверным курсором AsyncSession"""
+    export_app = create_app()
+    connect_routes_export(
+        app=export_app,
+        my_session=async_sessionmaker(
+            make_async_engine('sqlite+aiosqlite:///test.db')),
+        admin_keys={'admin'},
+    )
+    response = TestClient(export_app).get('/api/export/tweets?after=1',
+                                          headers={'api-key': 'admin'})
+    assert [json.loads(line)['id'] for line in response.iter_lines()] == [2]
@@ -1,10 +1,15 @@
-from typing import cast
+import hashlib
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Union, cast
 
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import ColumnElement
+from sqlalchemy import ColumnElement, event
+from sqlalchemy.engine.base import Engine
 from sqlalchemy.orm import Session
 
+from backend_server import services
+from backend_server.media_storage import LocalMediaStorage
 from backend_server.models import Follow, Like, Media, Tweet, User
 
 
@@ -32,7 +37,8 @@ def test_create_new_tweet(client: TestClient, session: Session) -> None:
         cast(ColumnElement[bool], 3 == Tweet.id)).first() is not None
 
 
-def test_add_new_media(client: TestClient, session: Session) -> None:
+def test_add_new_media(client: TestClient, session: Session,
+                       media_storage: LocalMediaStorage) -> None:
     """Тест загрузки нового медиафайла"""
     file_data = b'abcdefgh'
     resp = client.post('/api/medias', data={'file': file_data})
@@ -43,6 +49,25 @@ def test_add_new_media(client: TestClient, session: Session) -> None:
     assert new_media
     assert new_media.id == 3
     assert new_media.tweet_id is None
+    assert new_media.file is None
+    assert new_media.sha256
+    assert media_storage.exists(new_media.sha256)
+
+
+def test_get_stored_mediafile(client: TestClient) -> None:
+    """Тест потоковой отдачи медиафайла из хранилища"""
+    file_data = b'0123456789'
+    client.post('/api/medias', files={'file': file_data})
+    resp = client.get('/api/medias/3')
+    assert resp.status_code == 200
+    assert resp.content == file_data
+    etag = '"{}"'.format(hashlib.sha256(file_data).hexdigest())
+    assert resp.headers['etag'] == etag
+    resp = client.get('/api/medias/3', headers={'range': 'bytes=2-5'})
+    assert resp.status_code == 206
+    assert resp.content == b'2345'
+    assert resp.headers['content-range'] == 'bytes 2-5/10'
+    assert client.get('/api/medias/100').status_code == 404
 
 
 def test_get_mediafile(client: TestClient, session: Session) -> None:
@@ -181,3 +206,173 @@ def test_get_any_user_info(client: TestClient, session: Session) -> None:
     if user.following:
         assert len(result_json.get('user').get('following')
                    ) == len(user.following)
+
+
+def test_home_timeline_fan_out(client: TestClient) -> None:
+    """Тест рассылки нового твита в ленты подписчиков и его удаления"""
+    assert len(client.get('/api/tweets', headers={'api-key': 'test'}
+                          ).json().get('tweets')) == 1
+    resp = client.post('/api/tweets', headers={'api-key': 'test2'},
+                       json={'tweet_data': 'fresh_text', 'tweet_media_ids': []})
+    tweet_id = resp.json().get('tweet_id')
+    tweets = client.get('/api/tweets', headers={'api-key': 'test'}
+                        ).json().get('tweets')
+    assert [tweet.get('id') for tweet in tweets] == [tweet_id, 2]
+    client.delete(f'/api/tweets/{tweet_id}', headers={'api-key': 'test2'})
+    tweets = client.get('/api/tweets', headers={'api-key': 'test'}
+                        ).json().get('tweets')
+    assert [tweet.get('id') for tweet in tweets] == [2]
+
+
+def test_home_timeline_follow(client: TestClient) -> None:
+    """Тест обновления ленты после подписки и отписки"""
+    assert not client.get('/api/tweets', headers={'api-key': 'test2'}
+                          ).json().get('tweets')
+    client.post('/api/users/1/follow', headers={'api-key': 'test2'})
+    tweets = client.get('/api/tweets', headers={'api-key': 'test2'}
+                        ).json().get('tweets')
+    assert [tweet.get('id') for tweet in tweets] == [1]
+    client.delete('/api/users/1/follow', headers={'api-key': 'test2'})
+    assert not client.get('/api/tweets', headers={'api-key': 'test2'}
+                          ).json().get('tweets')
+
+
+def test_get_tweets_list_pagination(client: TestClient) -> None:
+    """Тест постраничного получения ленты по курсору"""
+    for number in range(5):
+        client.post('/api/tweets', headers={'api-key': 'test2'},
+                    json={'tweet_data': f'text_{number}',
+                          'tweet_media_ids': []})
+    tweet_ids: List[int] = []
+    cursor: Optional[str] = None
+    while True:
+        params: Dict[str, Union[int, str]] = {'limit': 2}
+        if cursor:
+            params['cursor'] = cursor
+        resp_json = client.get('/api/tweets', headers={'api-key': 'test'},
+                               params=params).json()
+        tweet_ids.extend(tweet.get('id') for tweet in resp_json['tweets'])
+        cursor = resp_json.get('next_cursor')
+        if not cursor:
+            break
+    assert tweet_ids == [7, 6, 5, 4, 3, 2]
+
+
+def test_get_tweets_list_invalid_cursor(client: TestClient) -> None:
+    """Тест ошибки при повреждённом курсоре"""
+    resp = client.get('/api/tweets', headers={'api-key': 'test'},
+                      params={'cursor': '!!!'})
+    assert resp.status_code == 400
+    assert 'InvalidCursorError' in resp.json().get('error_type')
+
+
+def test_session_per_request(pooled_client: TestClient) -> None:
+    """Тест роутов с сессией на каждый запрос и статистики пула"""
+    resp = pooled_client.post('/api/tweets/1/likes',
+                              headers={'api-key': 'test'})
+    assert resp.json() == {'result': True}
+    resp = pooled_client.post('/api/tweets/1/likes',
+                              headers={'api-key': 'test'})
+    assert resp.json() == {'result': False}
+    tweets = pooled_client.get('/api/tweets', headers={'api-key': 'test'}
+                               ).json().get('tweets')
+    assert [tweet.get('id') for tweet in tweets] == [2]
+    pool = pooled_client.get('/api/stats/pool').json().get('pool')
+    assert pool.get('checkouts_total') >= 3
+    assert pool.get('checked_out') == 0
+
+
+def test_async_mode(async_client: TestClient) -> None:
+    """Тест основных роутов в асинхронном режиме"""
+    headers = {'api-key': 'test2'}
+    resp = async_client.post('/api/tweets', headers=headers,
+                             json={'tweet_data': 'async_text',
+                                   'tweet_media_ids': [1]})
+    assert resp.json() == {'result': True, 'tweet_id': 3}
+    assert async_client.post('/api/users/1/follow', headers=headers
+                             ).json() == {'result': True}
+    assert async_client.post('/api/tweets/1/likes', headers=headers
+                             ).json() == {'result': True}
+    tweets = async_client.get('/api/tweets', headers=headers
+                              ).json().get('tweets')
+    assert [tweet.get('id') for tweet in tweets] == [1]
+    assert tweets[0].get('likes') == [{'user_id': 2, 'name': 'name_two'}]
+    user = async_client.get('/api/users/me', headers=headers
+                            ).json().get('user')
+    assert len(user.get('following')) == 1
+    assert async_client.delete('/api/tweets/3', headers={'api-key': 'test'}
+                               ).status_code == 403
+    assert async_client.get('/api/medias/1').content
+
+
+def test_async_mode_builds_models_off_loop(
+        async_client: TestClient, monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Тест построения модели ленты в пуле потоков, а не в потоке
+    цикла событий, где run_sync читает твиты
+    """
+    threads: Dict[str, int] = {}
+    load_tweets, tweets_model = services.load_tweets, services.tweets_model
+
+    def record(name: str, func: Any) -> Any:
+        def recorded(*args: Any) -> Any:
+            threads[name] = threading.get_ident()
+            return func(*args)
+        return recorded
+
+    monkeypatch.setattr(services, 'load_tweets', record('query', load_tweets))
+    monkeypatch.setattr(services, 'tweets_model',
+                        record('model', tweets_model))
+    tweets = async_client.get('/api/tweets', headers={'api-key': 'test'}
+                              ).json().get('tweets')
+    assert [tweet.get('id') for tweet in tweets] == [2]
+    assert threads['query'] != threads['model']
+
+
+def test_get_mediafile_cached(client: TestClient, engine: Engine) -> None:
+    """Тест кэширования медиафайла и ответа 304 без обращения к БД"""
+    client.post('/api/medias', files={'file': b'\x89PNG_content'})
+    resp = client.get('/api/medias/3')
+    assert resp.headers['cache-control'] == \
+        'public, max-age=31536000, immutable'
+    etag = resp.headers['etag']
+    statements: List[str] = []
+    event.listen(engine, 'before_cursor_execute',
+                 lambda *args: statements.append(args[2]))
+    resp = client.get('/api/medias/3', headers={'if-none-match': etag})
+    assert resp.status_code == 304
+    assert resp.headers['etag'] == etag
+    resp = client.get('/api/medias/3', headers={'range': 'bytes=0-3'})
+    assert resp.status_code == 206
+    assert resp.content == b'\x89PNG'
+    assert not statements
+    cache_stats = client.get('/api/stats/caches').json()['caches']['media']
+    assert cache_stats['etag_hits'] == 1
+    assert cache_stats['hits'] == 1
+    assert cache_stats['misses'] == 1
+
+
+def test_get_mediafile_conditional_skips_content(
+        client: TestClient, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Тест: условный запрос с совпавшим ETag не читает содержимое"""
+    client.post('/api/medias', files={'file': b'\x89PNG_content'})
+    etag = '"{}"'.format(hashlib.sha256(b'\x89PNG_content').hexdigest())
+    reads: List[str] = []
+    read_range = LocalMediaStorage.read_range
+
+    def recording_read_range(storage: LocalMediaStorage, key: str,
+                             start: int, end: int) -> Iterator[bytes]:
+        reads.append(key)
+        return read_range(storage, key, start, end)
+
+    monkeypatch.setattr(LocalMediaStorage, 'read_range',
+                        recording_read_range)
+    for _ in range(2):
+        resp = client.get('/api/medias/3', headers={'if-none-match': etag})
+        assert resp.status_code == 304
+        assert resp.headers['etag'] == etag
+    assert not reads
+    cache_stats = client.get('/api/stats/caches').json()['caches']['media']
+    assert cache_stats['etag_hits'] == 1 and cache_stats['entries'] == 0
+    assert client.get('/api/medias/3').content == b'\x89PNG_content'
+    assert reads
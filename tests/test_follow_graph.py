@@ -0,0 +1,86 @@
+from typing import List
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from backend_server.follow_graph import FollowGraph
+from backend_server.models import Follow, User
+
+
+def add_users(session: Session, count: int) -> List[int]:
+    """Добавляет пользователей с ключами key<id>, возвращает их id"""
+    users = [User(api_key=f'new{number}', name=f'new{number}')
+             for number in range(count)]
+    session.add_all(users)
+    session.commit()
+    for user in users:
+        user.api_key = f'key{user.id}'
+    session.commit()
+    return [int(user.id) for user in users]  # type: ignore[arg-type]
+
+
+def test_follow_graph(app: FastAPI, session: Session) -> None:
+    """Тест построения графа, изменений поверх CSR и пересборки"""
+    add_users(session, 4)
+    session.add_all([Follow(follower_id=2, following_id=3),
+                     Follow(follower_id=2, following_id=4),
+                     Follow(follower_id=5, following_id=3)])
+    session.commit()
+    graph = FollowGraph(compact_edges=100)
+    graph.follow(1, 6, following=True)
+    graph.load(session)
+    assert graph.follows(1, 2) and not graph.follows(1, 6)
+    graph.follow(1, 5, following=True)
+    graph.follow(5, 6, following=True)
+    assert graph.suggest(1, 10) == [(3, 2), (4, 1), (6, 1)]
+    assert graph.suggest(1, 1) == [(3, 2)]
+    graph.follow(1, 2, following=False)
+    assert not graph.follows(1, 2) and graph.follows(1, 5)
+    assert graph.suggest(1, 10) == [(3, 1), (6, 1)]
+    assert graph.suggest(6, 10) == []
+    graph.compact()
+    assert graph.suggest(1, 10) == [(3, 1), (6, 1)]
+    assert graph.follows(5, 6) and not graph.follows(1, 2)
+    stats = graph.statistics()
+    assert stats['edges'] == 5 and stats['changes'] == 0
+    assert stats['compactions'] == 1 and stats['bytes'] == 7 * 8 + 5 * 4
+
+
+def test_compact_with_new_follower(app: FastAPI, session: Session) -> None:
+    """Тест пересборки с подписчиком, которого нет в построенном графе"""
+    add_users(session, 1)
+    session.add(Follow(follower_id=2, following_id=1))
+    session.commit()
+    graph = FollowGraph(compact_edges=1)
+    graph.load(session)
+    graph.follow(10, 1, True)
+    graph.follow(11, 2, True)
+    graph.follow(11, 2, False)
+    graph.load(session)
+    assert graph.statistics()['compactions'] == 1
+    assert graph.follows(10, 1) and not graph.follows(11, 2)
+    assert graph.suggest(10, 5) == [(2, 1)]
+
+
+def test_suggestions_route(client: TestClient, session: Session) -> None:
+    """Тест рекомендаций с учётом подписок через API"""
+    user_ids = add_users(session, 3)
+    headers = {'api-key': 'test'}
+    assert client.get('/api/users/me/suggestions',
+                      headers=headers).json()['users'] == []
+    for api_key, following_id in (('test2', user_ids[0]),
+                                  ('test2', user_ids[1]),
+                                  (f'key{user_ids[2]}', user_ids[1]),
+                                  ('test', user_ids[2])):
+        assert client.post(f'/api/users/{following_id}/follow',
+                           headers={'api-key': api_key}).json()['result']
+    users = client.get('/api/users/me/suggestions', headers=headers).json()
+    assert users['users'] == [
+        {'id': user_ids[1], 'name': 'new1', 'mutual_count': 2},
+        {'id': user_ids[0], 'name': 'new0', 'mutual_count': 1}]
+    client.delete(f'/api/users/{user_ids[2]}/follow', headers=headers)
+    users = client.get('/api/users/me/suggestions', headers=headers).json()
+    assert [user['id'] for user in users['users']] == user_ids[:2]
+    assert client.get('/api/users/me/suggestions',
+                      headers={'api-key': 'missing'}).status_code == 400
@@ -0,0 +1,123 @@
+import asyncio
+import time
+from typing import Any, Dict, List
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.engine.base import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from backend_server.jobs import FAILED, QUEUED, JobQueue
+from backend_server.media_storage import LocalMediaStorage
+from backend_server.models import Job, Tweet
+from backend_server.routes import connect_routes
+
+
+class Clock:
+    """Управляемые тестом часы"""
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_job_retries(app: FastAPI, session: Session) -> None:
+    """Тест повтора упавшей задачи с задержкой и окончательного отказа"""
+    clock = Clock()
+    jobs = JobQueue(session, max_attempts=2, backoff=10, clock=clock)
+    calls: List[Dict[str, Any]] = []
+
+    def flaky(my_session: Session, payload: Dict[str, Any]) -> None:
+        calls.append(payload)
+        if len(calls) == 1 or payload['fail']:
+            raise ValueError('boom')
+
+    jobs.register('flaky', flaky)
+    jobs.enqueue(session, 'flaky', {'fail': False})
+    jobs.enqueue(session, 'flaky', {'fail': True}, delay=100)
+    session.commit()
+    assert jobs.run_pending(session) == 1
+    job = session.scalars(select(Job).order_by(Job.id)).first()
+    assert job is not None and job.state == QUEUED
+    assert job.run_at == 1010 and job.last_error == 'ValueError: boom'
+    assert jobs.run_pending(session) == 0
+    clock.now = 1200
+    assert jobs.run_pending(session) == 2
+    job = session.scalars(select(Job)).one()
+    assert job.state == QUEUED and job.run_at == 1210
+    clock.now = 1300
+    assert jobs.run_pending(session) == 1
+    session.refresh(job)
+    assert job.state == FAILED and job.attempts == 2
+    assert jobs.run_pending(session) == 0
+    stats = jobs.statistics()
+    assert stats['completed'] == 1 and stats['retried'] == 2
+    assert stats['failed'] == 1 and stats['wait_ms_max'] == 300000
+
+
+def test_claim_reclaims_expired_jobs(app: FastAPI, session: Session) -> None:
+    """Тест выборки задач: без повторной выдачи до истечения срока"""
+    clock = Clock()
+    jobs = JobQueue(session, lease=60, clock=clock)
+    for number in range(3):
+        jobs.enqueue(session, 'noop', {'number': number})
+    session.commit()
+    claimed = jobs.claim(session, 2)
+    assert [job.payload['number'] for job in claimed] == [0, 1]
+    assert jobs.statistics()['ready'] == 1
+    assert [job.payload['number'] for job in jobs.claim(session, 2)] == [2]
+    assert jobs.claim(session, 2) == []
+    clock.now += 61
+    assert [job.attempts for job in jobs.claim(session, 5)] == [2, 2, 2]
+
+
+def test_claim_statement_skips_locked_rows(
+        app: FastAPI, session: Session) -> None:
+    """Тест выборки задач в Postgres через FOR UPDATE SKIP LOCKED"""
+    jobs = JobQueue(session)
+    dialect = make_url('postgresql://').get_dialect()()
+    statement = str(jobs.claim_statement(0, 4, skip_locked=True).compile(
+        dialect=dialect))
+    assert statement.startswith('UPDATE job SET')
+    assert 'FOR UPDATE SKIP LOCKED' in statement
+    assert 'SKIP LOCKED' not in str(jobs.claim_statement(
+        0, 4, skip_locked=False).compile(dialect=dialect))
+
+
+def test_compute_in_process_pool(app: FastAPI, session: Session) -> None:
+    """Тест вычислений обработчика в пуле процессов"""
+    jobs = JobQueue(session, executor='process', executor_workers=1)
+    try:
+        assert asyncio.run(jobs.compute(pow, 2, 10)) == 1024
+    finally:
+        jobs.close()
+    assert jobs.statistics()['computed'] == 1
+
+
+def test_remove_tweet_in_background(
+        app: FastAPI, engine: Engine,
+        media_storage: LocalMediaStorage) -> None:
+    """Тест удаления твита фоновой задачей после ответа роута"""
+    factory = sessionmaker(engine)
+    _app = FastAPI()
+    connect_routes(app=_app, my_session=factory,
+                   media_storage=media_storage, background_jobs=True)
+    with TestClient(app=_app) as client:
+        assert client.delete('/api/tweets/2', headers={'api-key': 'test'}
+                             ).status_code == 403
+        response = client.delete('/api/tweets/1', headers={'api-key': 'test'})
+        assert response.json() == {'result': True}
+        deadline = time.monotonic() + 5
+        with factory() as session:
+            while session.scalars(select(Job)).all() \
+                    and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert session.get(Tweet, 1) is None
+        stats = client.get('/api/stats/caches').json()['caches']['jobs']
+    assert stats['enqueued'] == 1 and stats['completed'] == 1
+    assert client.delete('/api/tweets/1', headers={'api-key': 'test'}
+                         ).json() == {'result': False}
@@ -0,0 +1,34 @@
+import json
+from pathlib import Path
+
+from benchmarks import load
+
+
+def test_compare_thresholds() -> None:
+    """Тест обнаружения регрессий задержки, пропускной способности и ошибок"""
+    baseline = {'GET /api/tweets': {'p95_ms': 10.0, 'rps': 100.0,
+                                    'errors': 0}}
+    within = {'GET /api/tweets': {'p95_ms': 11.9, 'rps': 85.0, 'errors': 0}}
+    assert load.compare(within, baseline, threshold=20) == []
+    worse = {'GET /api/tweets': {'p95_ms': 12.5, 'rps': 80.0, 'errors': 2},
+             'POST /api/tweets': {'p95_ms': 99.0, 'rps': 1.0, 'errors': 0}}
+    assert load.compare(worse, baseline, threshold=20) == [
+        'GET /api/tweets: p95 10.0 -> 12.5 ms',
+        'GET /api/tweets: rps 100.0 -> 80.0',
+        'GET /api/tweets: errors 0 -> 2',
+    ]
+
+
+def test_load_report(tmp_path: Path) -> None:
+    """Тест короткого прогона бенчмарка против uvicorn"""
+    output = tmp_path / 'load.json'
+    args = ['--url', f'sqlite:///{tmp_path / "bench.db"}', '--users', '50',
+            '--concurrency', '4', '--duration', '1', '--warmup', '0.2',
+            '--media-root', str(tmp_path / 'media'), '--output', str(output)]
+    assert load.main(args) == 0
+    report = json.loads(output.read_text())
+    feed = report['GET /api/tweets']
+    assert feed['requests'] > 0 and feed['errors'] == 0
+    assert feed['p50_ms'] <= feed['p95_ms'] <= feed['p99_ms']
+    assert load.main(['--no-seed', '--baseline', str(output),
+                      '--threshold', '100000'] + args[:-2]) == 0
@@ -0,0 +1,123 @@
+import hashlib
+from io import BytesIO
+from typing import Any, Dict, Optional, Tuple
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from backend_server.media_cache import ENTRY_OVERHEAD, MediaCache
+from backend_server.media_storage import (
+    LocalMediaStorage,
+    MediaFile,
+    S3MediaStorage,
+    migrate_legacy_media,
+    parse_range,
+)
+from backend_server.models import Media
+
+
+class NotFoundError(Exception):
+    """Ошибка отсутствия объекта в формате клиента boto3"""
+    response = {'Error': {'Code': '404'}}
+
+
+class LocalS3Client(object):
+    """Локальная замена клиента S3 с хранением объектов в памяти"""
+
+    def __init__(self) -> None:
+        self.objects: Dict[Tuple[str, str], bytes] = {}
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes) -> None:
+        self.objects[(Bucket, Key)] = Body
+
+    def head_object(self, Bucket: str, Key: str) -> Dict[str, Any]:
+        if (Bucket, Key) not in self.objects:
+            raise NotFoundError
+        return {'ContentLength': len(self.objects[(Bucket, Key)])}
+
+    def get_object(self, Bucket: str, Key: str,
+                   Range: Optional[str] = None) -> Dict[str, Any]:
+        data = self.objects[(Bucket, Key)]
+        if Range:
+            start, end = Range.removeprefix('bytes=').split('-')
+            data = data[int(start):int(end) + 1]
+        return {'Body': BytesIO(data)}
+
+
+@pytest.mark.parametrize(('header', 'expected'), [
+    (None, None), ('bytes=0-3', (0, 4)), ('bytes=4-', (4, 10)),
+    ('bytes=-3', (7, 10)), ('bytes=8-100', (8, 10)),
+    ('bytes=20-30', None), ('bytes=0-1,4-5', None), ('items=0-1', None),
+])
+def test_parse_range(header: Optional[str],
+                     expected: Optional[Tuple[int, int]]) -> None:
+    """Тест разбора заголовка Range"""
+    assert parse_range(header, 10) == expected
+
+
+def test_local_storage_deduplicates(tmp_path: Any) -> None:
+    """Тест хранения одинакового содержимого в одном экземпляре"""
+    storage = LocalMediaStorage(str(tmp_path))
+    first_key = storage.put(b'same bytes')
+    second_key = storage.put(b'same bytes')
+    assert first_key == second_key == hashlib.sha256(b'same bytes').hexdigest()
+    assert b''.join(storage.read_range(first_key, 5, 10)) == b'bytes'
+    assert len(list(tmp_path.rglob('*'))) == 3
+
+
+def test_s3_storage() -> None:
+    """Тест хранилища S3 на локальной замене клиента"""
+    client = LocalS3Client()
+    storage = S3MediaStorage(client, bucket='bucket', prefix='media/')
+    key = storage.put(b'0123456789')
+    assert storage.put(b'0123456789') == key
+    assert list(client.objects) == [('bucket', 'media/' + key)]
+    assert not storage.exists('missing')
+    assert b''.join(storage.read_range(key, 2, 6)) == b'2345'
+
+
+def test_migrate_legacy_media(client: TestClient, session: Session,
+                              media_storage: LocalMediaStorage) -> None:
+    """Тест переноса содержимого из столбца media.file в хранилище"""
+    legacy = session.query(Media).order_by(Media.id).all()
+    contents = [media.file for media in legacy]
+    assert migrate_legacy_media(session, media_storage, batch_size=1) == 2
+    assert migrate_legacy_media(session, media_storage) == 0
+    for media, content in zip(legacy, contents):
+        session.refresh(media)
+        assert media.file is None
+        assert media.size == len(content or b'')
+        resp = client.get(f'/api/medias/{media.id}')
+        assert resp.content == content
+        assert resp.headers['etag'] == f'"{media.sha256}"'
+
+
+def test_media_cache_eviction(tmp_path: Any) -> None:
+    """Тест вытеснения записей кэша по бюджету байт"""
+    storage = LocalMediaStorage(str(tmp_path))
+    cache = MediaCache(max_bytes=ENTRY_OVERHEAD * 2 + 20, max_item_bytes=10)
+    for media_id, content in enumerate([b'a' * 10, b'b' * 10, b'c' * 30]):
+        media = MediaFile(sha256=storage.put(content), size=len(content))
+        cache.fill(media_id, media, storage)
+    assert cache.get(0) is None
+    assert cache.get(1) == MediaFile(storage.put(b'b' * 10), 10, b'b' * 10)
+    cached_large = cache.get(2)
+    assert cached_large is not None
+    assert cached_large.content is None
+    assert cache.statistics()['bytes'] == ENTRY_OVERHEAD * 2 + 10
+    assert (cache.hits, cache.misses) == (2, 1)
+    # ETag вытесненной записи остаётся известен
+    assert cache.etag(0) == f'"{storage.put(b"a" * 10)}"'
+
+
+def test_media_cache_etags_limit() -> None:
+    """Тест вытеснения ETag сверх их числа"""
+    cache = MediaCache(max_etags=2)
+    for media_id in range(3):
+        cache.remember(media_id, f'sha{media_id}')
+    assert cache.etag(0) is None
+    assert cache.etag(1) == '"sha1"'
+    cache.remember(3, 'sha3')
+    assert cache.etag(2) is None and cache.etag(1) == '"sha1"'
+    assert cache.statistics()['etags'] == 2
@@ -0,0 +1,160 @@
+import asyncio
+import io
+import threading
+import time
+from typing import Dict, List
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from PIL import Image
+from sqlalchemy import func, select
+from sqlalchemy.engine.base import Engine
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+
+from backend_server.database import make_async_engine
+from backend_server.media_storage import LocalMediaStorage
+from backend_server.media_variants import (
+    ImageInfo,
+    MediaProcessor,
+    render_variants,
+    sniff_image,
+)
+from backend_server.models import Media, MediaVariant
+from backend_server.routes import connect_routes
+from backend_server.services import add_media
+
+
+def image_bytes(size: tuple[int, int], mode: str = 'RGB',
+                image_format: str = 'PNG') -> bytes:
+    """Кодирует однотонное изображение заданного размера"""
+    buffer = io.BytesIO()
+    Image.new(mode, size, 'red').save(buffer, image_format)
+    return buffer.getvalue()
+
+
+def test_sniff_image() -> None:
+    """Тест определения типа и размеров изображения по заголовку"""
+    with open('tests/img_1.png', 'rb') as img:
+        assert sniff_image(img.read()) == ImageInfo('image/png', 1280, 720)
+    assert sniff_image(image_bytes((30, 20), image_format='JPEG')) \
+        == ImageInfo('image/jpeg', 30, 20)
+    assert sniff_image(b'\x89PNG_content') is None
+
+
+def test_render_variants() -> None:
+    """Тест построения вариантов меньше оригинала"""
+    sizes = {'thumb': 150, 'feed': 1080}
+    rendered = render_variants(image_bytes((1600, 900)), sizes)
+    assert [(variant.name, variant.info) for variant in rendered] == [
+        ('feed', ImageInfo('image/jpeg', 1080, 608)),
+        ('thumb', ImageInfo('image/jpeg', 150, 84)),
+    ]
+    assert sniff_image(rendered[1].content) == rendered[1].info
+    rendered = render_variants(image_bytes((400, 300), 'RGBA'), sizes)
+    assert [(variant.name, variant.info) for variant in rendered] == [
+        ('thumb', ImageInfo('image/png', 150, 113))]
+    assert render_variants(image_bytes((100, 100)), sizes) == []
+
+
+def test_derive_in_process_pool(
+        app: FastAPI, session: Session,
+        media_storage: LocalMediaStorage) -> None:
+    """Тест построения вариантов в пуле процессов обработчиком задачи"""
+    processor = MediaProcessor(media_storage, processes=1)
+    content = image_bytes((1600, 900))
+    result = add_media(session, media_storage.put(content), len(content),
+                       sniff_image(content))
+
+    async def derive_twice() -> List[int]:
+        return [await processor.derive_async(session, result.media_id or 0)
+                for _ in range(2)]
+
+    try:
+        assert asyncio.run(derive_twice()) == [2, 0]
+    finally:
+        processor.close()
+    assert session.scalar(select(func.count()).select_from(
+        MediaVariant)) == 2
+    assert processor.statistics()['variants'] == 2
+
+
+def test_media_variants_routes(
+        app: FastAPI, engine: Engine,
+        media_storage: LocalMediaStorage) -> None:
+    """
+    Тест загрузки изображения с построением вариантов в фоне
+    и отдачи вариантов с их типом
+    """
+    factory = sessionmaker(engine)
+    _app = FastAPI()
+    connect_routes(app=_app, my_session=factory, media_storage=media_storage)
+    with open('tests/img_1.png', 'rb') as img:
+        content = img.read()
+    with TestClient(app=_app) as client:
+        response = client.post('/api/medias', files={'file': content})
+        assert response.json() == {'result': True, 'media_id': 3}
+        deadline = time.monotonic() + 10
+        with factory() as session:
+            while len(session.scalars(select(MediaVariant)).all()) < 2 \
+                    and time.monotonic() < deadline:
+                time.sleep(0.01)
+            media = session.get(Media, 3)
+            assert media is not None
+            assert (media.mime, media.width, media.height) \
+                == ('image/png', 1280, 720)
+        thumb = client.get('/api/medias/3?size=thumb')
+        assert thumb.headers['content-type'] == 'image/jpeg'
+        assert sniff_image(thumb.content) == ImageInfo('image/jpeg', 150, 84)
+        original = client.get('/api/medias/3')
+        assert original.headers['content-type'] == 'image/png'
+        assert original.content == content
+        assert thumb.headers['etag'] != original.headers['etag']
+        legacy = client.get('/api/medias/1?size=feed')
+        assert legacy.headers['content-type'] == 'image/png'
+        assert client.get('/api/medias/9?size=thumb').status_code == 404
+        assert client.get('/api/medias/3?size=huge').status_code == 422
+        tweets = client.get('/api/tweets', headers={'api-key': 'test'})
+        stats = client.get('/api/stats/caches').json()['caches']
+    assert [tweet['attachments'] for tweet in tweets.json()['tweets']] \
+        == [['/api/medias/2?size=feed']]
+    assert stats['media_variants']['variants'] == 2
+
+
+def test_media_variants_job_on_async_session(
+        app: FastAPI, media_storage: LocalMediaStorage,
+        monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Тест построения вариантов задачей очереди в асинхронном режиме:
+    оригинал читается не в потоке цикла событий
+    """
+    _app = FastAPI()
+    connect_routes(app=_app, my_session=async_sessionmaker(
+        make_async_engine('sqlite+aiosqlite:///test.db')),
+        media_storage=media_storage, background_jobs=True)
+    threads: Dict[str, int] = {}
+
+    async def remember_loop() -> None:
+        threads['loop'] = threading.get_ident()
+
+    def read(processor: MediaProcessor, sha256: str, size: int) -> bytes:
+        threads['read'] = threading.get_ident()
+        return b''.join(processor.storage.read_range(sha256, 0, size))
+
+    _app.add_event_handler('startup', remember_loop)
+    monkeypatch.setattr(MediaProcessor, 'read', read)
+    with TestClient(app=_app) as client:
+        response = client.post('/api/medias',
+                               files={'file': image_bytes((1600, 900))})
+        assert response.json() == {'result': True, 'media_id': 3}
+        deadline = time.monotonic() + 10
+        while client.get('/api/stats/caches').json()['caches']['jobs'][
+                'completed'] < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        stats = client.get('/api/stats/caches').json()['caches']
+        thumb = client.get('/api/medias/3?size=thumb')
+    assert stats['media_variants']['variants'] == 2
+    assert stats['jobs']['computed'] == 1
+    assert sniff_image(thumb.content) == ImageInfo('image/jpeg', 150, 84)
+    assert threads['read'] != threads['loop']
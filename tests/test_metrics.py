@@ -0,0 +1,61 @@
+from typing import Dict
+
+from fastapi.testclient import TestClient
+
+from backend_server.metrics import Counter, Histogram
+
+
+def samples(text: str) -> Dict[str, float]:
+    """Разбирает строки метрик в словарь 'имя{метки}' -> значение"""
+    return {line.rsplit(' ', 1)[0]: float(line.rsplit(' ', 1)[1])
+            for line in text.splitlines() if not line.startswith('#')}
+
+
+def test_histogram_render() -> None:
+    """Тест накопительных интервалов, суммы и экранирования меток"""
+    histogram = Histogram('latency', 'Latency', ('route', ), (0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(('/a"b', ), value)
+    assert list(histogram.render()) == [
+        '# HELP latency Latency',
+        '# TYPE latency histogram',
+        'latency_bucket{route="/a\\"b",le="0.1"} 2',
+        'latency_bucket{route="/a\\"b",le="1"} 3',
+        'latency_bucket{route="/a\\"b",le="+Inf"} 4',
+        'latency_sum{route="/a\\"b"} 3.65',
+        'latency_count{route="/a\\"b"} 4',
+    ]
+    gauge = Counter('in_flight', 'In flight', ('route', ), kind='gauge')
+    gauge.add(('/a', ))
+    gauge.add(('/a', ), -1)
+    assert list(gauge.render())[1:] == ['# TYPE in_flight gauge',
+                                        'in_flight{route="/a"} 0']
+
+
+def test_metrics_route(client: TestClient) -> None:
+    """Тест метрик роутов, SQL-запросов, пула и кэшей"""
+    headers = {'api-key': 'test'}
+    client.get('/api/users/1')
+    client.get('/api/users/2')
+    client.get('/api/tweets', headers=headers)
+    client.get('/api/tweets', headers=headers)
+    client.delete('/api/tweets/2', headers=headers)
+    client.get('/api/missing')
+    response = client.get('/metrics')
+    assert response.headers['content-type'].startswith('text/plain')
+    metrics = samples(response.text)
+    user_route = 'method="GET",route="/api/users/{user_id}"'
+    assert metrics[
+        'http_request_duration_seconds_count{' + user_route + '}'] == 2
+    assert metrics['db_queries_per_request_sum{' + user_route + '}'] == 6
+    assert metrics['db_time_per_request_seconds_sum{' + user_route + '}'] > 0
+    assert metrics['http_responses_total{method="DELETE",'
+                   'route="/api/tweets/{tweet_id}",status="403"}'] == 1
+    assert metrics['http_responses_total{method="GET",'
+                   'route="<unmatched>",status="404"}'] == 1
+    assert metrics['http_requests_in_flight{' + user_route + '}'] == 0
+    assert metrics['http_requests_in_flight{method="GET",'
+                   'route="/metrics"}'] == 1
+    assert metrics['cache_hit_ratio{cache="auth"}'] == 2 / 3
+    assert 'component_stat{component="counters",stat="flushes"}' in metrics
+    assert 'db_pool{engine="0",stat="checked_out"}' in metrics
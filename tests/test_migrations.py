@@ -0,0 +1,14 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.engine.base import Engine
+
+from backend_server.migrations import upgrade_schema
+
+
+def test_upgrade_schema_creates_indexes(engine: Engine, app: object) -> None:
+    """Тест создания недостающих индексов и повторного запуска миграции"""
+    with engine.begin() as connection:
+        connection.execute(text('DROP INDEX ix_tweet_user_id_id'))
+    upgrade_schema(engine)
+    upgrade_schema(engine)
+    indexes = {index['name'] for index in inspect(engine).get_indexes('tweet')}
+    assert 'ix_tweet_user_id_id' in indexes
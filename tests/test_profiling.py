@@ -0,0 +1,71 @@
+import marshal
+from pathlib import Path
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from backend_server.profiling import Profiler
+from backend_server.routes import connect_profiling
+
+
+def test_profile_by_header(app: FastAPI, session: Session,
+                           tmp_path: Path) -> None:
+    """Тест профилирования по заголовку, хронологии SQL и роутов профилей"""
+    connect_profiling(app, session, Profiler(tokens={'secret'},
+                                             dump_dir=str(tmp_path)))
+    client = TestClient(app)
+    response = client.get('/api/tweets', headers={'api-key': 'test'})
+    assert 'x-profile-id' not in response.headers
+    response = client.get('/api/tweets', headers={'api-key': 'test',
+                                                  'x-profile': 'secret'})
+    assert response.status_code == 200
+    profile_id = response.headers['x-profile-id']
+    assert (tmp_path / f'{profile_id}.prof').exists()
+
+    assert client.get('/api/profiles').status_code == 403
+    assert client.get('/api/profiles',
+                      headers={'x-profile': 'wrong'}).status_code == 403
+    admin = {'x-profile': 'secret'}
+    profiles = client.get('/api/profiles', headers=admin).json()['profiles']
+    assert [item['id'] for item in profiles] == [profile_id]
+    assert profiles[0]['path'] == '/api/tweets'
+    assert profiles[0]['status'] == 200 and profiles[0]['sql_count'] > 0
+
+    profile = client.get(f'/api/profiles/{profile_id}',
+                         headers=admin).json()['profile']
+    assert len(profile['sql']) == profile['sql_count']
+    assert all(item['start_ms'] >= 0 for item in profile['sql'])
+    # Работа сервиса в пуле потоков попадает в профиль запроса
+    assert any('services.py' in item['function']
+               for item in profile['functions'])
+    stats = marshal.loads(client.get(
+        f'/api/profiles/{profile_id}?format=pstats', headers=admin).content)
+    assert any(filename.endswith('services.py')
+               for filename, _, _ in stats)
+    assert client.get('/api/profiles/missing',
+                      headers=admin).status_code == 404
+
+
+def test_profile_sampling(app: FastAPI, session: Session) -> None:
+    """Тест случайного отбора запросов и вытеснения старых профилей"""
+    profiler = Profiler(tokens={'secret'}, sample_rate=1.0, keep=2)
+    connect_profiling(app, session, profiler)
+    client = TestClient(app)
+    ids = [client.get(f'/api/users/{user_id}').headers['x-profile-id']
+           for user_id in (1, 2, 1)]
+    assert [item['id'] for item in profiler.list()] == ids[:0:-1]
+
+
+def test_stream_is_not_profiled(app: FastAPI, session: Session) -> None:
+    """Тест: потоковые пути не занимают профилировщик"""
+    profiler = Profiler(tokens={'secret'}, sample_rate=1.0)
+    headers = {'x-profile': 'secret'}
+    assert not profiler.start({'type': 'http', 'path': '/api/stream',
+                               'headers': [(b'x-profile', b'secret')]})
+    connect_profiling(app, session, profiler)
+    client = TestClient(app)
+    assert 'x-profile-id' in client.get('/api/users/1',
+                                        headers=headers).headers
+    assert 'x-profile-id' in client.get('/api/users/2',
+                                        headers=headers).headers
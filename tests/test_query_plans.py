@@ -0,0 +1,50 @@
+import json
+from pathlib import Path
+
+from fastapi import FastAPI
+from fastapi.routing import APIRoute
+from sqlalchemy.orm import Session
+
+from backend_server.media_storage import LocalMediaStorage
+from backend_server.routes import connect_routes
+from benchmarks import query_plans
+
+
+def test_query_plans_report(tmp_path: Path) -> None:
+    """Тест отчёта бенчмарка планов запросов на небольшом наборе данных"""
+    output = tmp_path / 'plans.json'
+    args = ['--url', f'sqlite:///{tmp_path / "bench.db"}',
+            '--users', '20', '--tweets', '200', '--likes', '300',
+            '--follows', '50', '--repeats', '1', '--output', str(output)]
+    assert query_plans.main(args) == 0
+    report = json.loads(output.read_text())
+    assert {'GET /api/tweets', 'api-key lookup', 'POST /api/medias',
+            'GET /api/search', 'GET /api/export/{table}?table=likes',
+            'POST /api/tweets + DELETE /api/tweets/{id}'} <= set(report)
+    assert report['GET /api/search']['queries']
+    assert all(query['latency_ms'] >= 0 for result in report.values()
+               for query in result['queries'])
+    plans = [line for query in report['GET /api/users/{id}']['queries']
+             for line in query['plan']]
+    assert any('ix_follow_following_id_follower_id' in line
+               for line in plans)
+    assert query_plans.main(args[:-2] + ['--no-seed',
+                                         '--baseline', str(output)]) == 0
+
+
+def test_every_route_has_scenario(
+        app: FastAPI, session: Session,
+        media_storage: LocalMediaStorage) -> None:
+    """Тест: у каждого роута, обращающегося к БД, есть сценарий"""
+    _app = FastAPI()
+    connect_routes(app=_app, my_session=session, media_storage=media_storage,
+                   metrics=True, profiling=True, background_jobs=True)
+    routes = {
+        f'{method} {query_plans.PATH_PARAMETER.sub("{}", route.path)}'
+        for route in _app.routes if isinstance(route, APIRoute)
+        for method in route.methods
+    }
+    covered = set().union(*map(query_plans.scenario_routes,
+                               query_plans.scenarios(session)))
+    assert covered <= routes
+    assert routes - covered == query_plans.ROUTES_WITHOUT_QUERIES
@@ -0,0 +1,108 @@
+import time
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+from backend_server.pagination import encode_cursor
+from backend_server.ranking import Candidates, rank, score_candidates
+
+
+def test_score_candidates() -> None:
+    """Тест влияния признаков на оценку кандидатов"""
+    candidates = Candidates(
+        tweet_ids=np.array([10, 11, 12, 13], dtype=np.int64),
+        author_ids=np.array([1, 2, 3, 3], dtype=np.int64),
+        like_counts=np.array([5, 0, 0, 0], dtype=np.int64),
+        followee_likes=np.array([0, 2, 0, 0], dtype=np.int64),
+    )
+    scores = score_candidates(
+        candidates,
+        followed_ids=np.array([3], dtype=np.int64),
+        affinity_ids=np.array([2, 4], dtype=np.int64),
+        affinity_likes=np.array([3, 7], dtype=np.int64),
+        half_life=100.0,
+    )
+    assert scores[3] > scores[2]
+    page = rank(candidates, scores, 4)
+    assert page[0] == (scores[1], 11)
+    assert rank(candidates, scores, 2, after=page[0]) == page[1:3]
+    assert rank(candidates, scores, 4, after=page[-1]) == []
+
+
+def test_scores_keep_with_newer_candidates() -> None:
+    """Тест: новый твит не меняет оценок остальных кандидатов"""
+    candidates = Candidates(
+        tweet_ids=np.array([10, 11, 12], dtype=np.int64),
+        author_ids=np.array([1, 2, 3], dtype=np.int64),
+        like_counts=np.array([5, 0, 1], dtype=np.int64),
+        followee_likes=np.array([0, 2, 0], dtype=np.int64),
+    )
+    newer = Candidates(*(np.append(column, 0) for column in candidates))
+    newer.tweet_ids[-1] = 500
+    empty = np.array([], dtype=np.int64)
+    scores = score_candidates(candidates, empty, empty, empty)
+    assert (score_candidates(newer, empty, empty, empty)[:3]
+            == scores).all()
+
+
+def test_score_candidates_speed() -> None:
+    """Тест времени ранжирования 10 000 кандидатов"""
+    rng = np.random.default_rng(0)
+    size = 10000
+    candidates = Candidates(
+        tweet_ids=np.arange(size, dtype=np.int64),
+        author_ids=rng.integers(0, 1000, size, dtype=np.int64),
+        like_counts=rng.integers(0, 1000, size, dtype=np.int64),
+        followee_likes=rng.integers(0, 10, size, dtype=np.int64),
+    )
+    followed_ids = np.arange(0, 1000, 7, dtype=np.int64)
+    affinity_ids = np.arange(0, 1000, 3, dtype=np.int64)
+    affinity_likes = rng.integers(1, 50, len(affinity_ids), dtype=np.int64)
+    timings = []
+    for _ in range(5):
+        started = time.perf_counter()
+        scores = score_candidates(candidates, followed_ids,
+                                  affinity_ids, affinity_likes)
+        rank(candidates, scores, 100)
+        timings.append(time.perf_counter() - started)
+    assert min(timings) < 0.005
+
+
+def test_get_tweets_ranked(client: TestClient) -> None:
+    """Тест ранжированной ленты и её пагинации"""
+    for content in ('third', 'fourth'):
+        client.post('/api/tweets', headers={'api-key': 'test'},
+                    json={'tweet_data': content, 'tweet_media_ids': []})
+    client.post('/api/tweets/1/likes', headers={'api-key': 'test2'})
+    headers = {'api-key': 'test2'}
+    resp = client.get('/api/tweets', headers=headers,
+                      params={'mode': 'ranked', 'limit': 2})
+    assert resp.status_code == 200
+    page = resp.json()
+    assert [tweet['id'] for tweet in page['tweets']] == [1, 4]
+    # Новый твит между страницами не сдвигает следующую страницу
+    client.post('/api/tweets', headers={'api-key': 'test'},
+                json={'tweet_data': 'fifth', 'tweet_media_ids': []})
+    resp = client.get('/api/tweets', headers=headers,
+                      params={'mode': 'ranked', 'limit': 2,
+                              'cursor': page['next_cursor']})
+    assert [tweet['id'] for tweet in resp.json()['tweets']] == [3]
+    assert resp.json()['next_cursor'] is None
+    resp = client.get('/api/tweets', headers=headers,
+                      params={'cursor': page['next_cursor']})
+    assert resp.status_code == 400
+    resp = client.get('/api/tweets', headers=headers,
+                      params={'mode': 'ranked', 'cursor': encode_cursor(4)})
+    assert resp.status_code == 400
+    resp = client.get('/api/tweets', headers=headers,
+                      params={'mode': 'popular'})
+    assert resp.status_code == 422
+
+
+def test_get_tweets_ranked_empty(client: TestClient) -> None:
+    """Тест ранжированной ленты без кандидатов"""
+    client.delete('/api/tweets/1', headers={'api-key': 'test'})
+    client.post('/api/tweets/2/likes', headers={'api-key': 'test2'})
+    resp = client.get('/api/tweets', headers={'api-key': 'test2'},
+                      params={'mode': 'ranked'})
+    assert resp.json() == {'result': True, 'tweets': [], 'next_cursor': None}
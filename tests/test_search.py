@@ -0,0 +1,97 @@
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend_server.models import Tweet
+from backend_server.search import InvertedIndex, tokenize
+
+
+def test_inverted_index() -> None:
+    """Тест поиска всех слов, оценки BM25, удаления и ограничения кандидатов"""
+    assert tokenize('Привет, World! re-tweet') == \
+        ['привет', 'world', 're', 'tweet']
+    index = InvertedIndex()
+    index.add(1, 'cat dog')
+    index.add(2, 'cat cat cat dog and many other words here')
+    index.add(3, 'cat cat dog')
+    index.add(4, 'dog only')
+    assert index.search(['cat', 'dog'], limit=10, offset=0) == [3, 1, 2]
+    assert index.search(['dog', 'cat'], limit=2, offset=1) == [1, 2]
+    assert index.search(['cat', 'bird'], limit=10, offset=0) == []
+    # Из частых совпадений оцениваются только самые новые
+    assert index.search(['cat'], limit=10, offset=0, candidates=2) == [3, 2]
+    index.remove(3)
+    index.add(1, 'bird')
+    assert index.search(['cat'], limit=10, offset=0) == [2]
+    assert index.search(['bird'], limit=10, offset=0) == [1]
+    assert 'cat' in index.postings and 'only' in index.postings
+    index.remove(4)
+    assert 'only' not in index.postings
+    assert index.total_length == sum(index.lengths.values()) == 10
+
+
+def wait_for_index(client: TestClient) -> None:
+    """Дожидается фонового построения индекса после запуска приложения"""
+    deadline = time.monotonic() + 5
+    while not client.get('/api/stats/caches').json()['caches']['search'][
+            'builds'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_search_unavailable_until_built(client: TestClient) -> None:
+    """Тест ответа 503, пока индекс не построен"""
+    response = client.get('/api/search', params={'q': 'SOME_TEXT'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert response.json()['result'] is False
+
+
+def test_search_index_built_on_async_session(
+        async_client: TestClient) -> None:
+    """Тест фонового построения индекса в асинхронном режиме"""
+    with async_client:
+        wait_for_index(async_client)
+        response = async_client.get('/api/search', params={'q': 'SOME_TEXT'})
+    assert [tweet['id'] for tweet in response.json()['tweets']] == [1]
+
+
+def test_search_route(app: FastAPI) -> None:
+    """Тест поиска с пагинацией и обновления индекса при записи"""
+    headers = {'api-key': 'test'}
+    with TestClient(app=app) as client:
+        wait_for_index(client)
+        response = client.get('/api/search', params={'q': 'SOME_TEXT'})
+        assert [tweet['id'] for tweet in response.json()['tweets']] == [1]
+        tweet_ids = [client.post('/api/tweets', headers=headers, json={
+            'tweet_data': f'hello search {number}', 'tweet_media_ids': []})
+            .json()['tweet_id']
+            for number in range(3)]
+        page = client.get('/api/search', params={'q': 'hello', 'limit': 2})
+        first = [tweet['id'] for tweet in page.json()['tweets']]
+        page = client.get('/api/search', params={
+            'q': 'hello', 'limit': 2, 'cursor': page.json()['next_cursor']})
+        assert first + [tweet['id'] for tweet in page.json()['tweets']] == \
+            tweet_ids[::-1]
+        assert page.json()['next_cursor'] is None
+        client.delete(f'/api/tweets/{tweet_ids[1]}', headers=headers)
+        response = client.get('/api/search', params={'q': 'search hello'})
+        assert [tweet['id'] for tweet in response.json()['tweets']] == \
+            [tweet_ids[2], tweet_ids[0]]
+        assert client.get('/api/search', params={'q': 'missing'}) \
+            .json()['tweets'] == []
+        assert client.get('/api/search', params={'q': '!!'}).json()['tweets'] \
+            == []
+        assert client.get('/api/search', params={
+            'q': 'hello', 'cursor': 'broken'}).status_code == 400
+        stats = client.get('/api/stats/caches').json()['caches']['search']
+        assert stats['builds'] == 1 and stats['documents'] == 4
+
+
+def test_postgres_index_ddl() -> None:
+    """Тест GIN-индекса tsvector, создаваемого только в Postgres"""
+    index = next(index for index in Tweet.__table__.indexes
+                 if index.name == 'ix_tweet_content_tsv')
+    assert index.dialect_options['postgresql']['using'] == 'gin'
+    assert str(index.expressions[0]) == \
+        "to_tsvector('simple'::regconfig, tweet.content)"
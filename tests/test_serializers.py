@@ -0,0 +1,53 @@
+from typing import Dict, List, Tuple, Union
+
+from fastapi.testclient import TestClient
+from sqlalchemy.engine.base import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from backend_server.counters import reconcile_counters
+from backend_server.fastapi_api import create_app
+from backend_server.media_storage import LocalMediaStorage
+from backend_server.routes import connect_routes
+
+
+def make_client(engine: Engine, media_storage: LocalMediaStorage,
+                fast_json: bool) -> TestClient:
+    """Создаёт клиента приложения с быстрой сериализацией или без неё"""
+    app = create_app()
+    connect_routes(app=app, my_session=sessionmaker(engine),
+                   media_storage=media_storage, fast_json=fast_json)
+    return TestClient(app=app)
+
+
+def test_fast_json_byte_compatible(
+        engine: Engine, session: Session, client: TestClient,
+        media_storage: LocalMediaStorage) -> None:
+    """Тест побайтового совпадения ответов быстрой и обычной сериализации"""
+    for api_key, content in (('test', 'Привет, "мир" \\ ✓'),
+                             ('test2', 'tab\there')):
+        client.post('/api/tweets', headers={'api-key': api_key},
+                    json={'tweet_data': content, 'tweet_media_ids': []})
+    client.post('/api/tweets/1/likes', headers={'api-key': 'test2'})
+    client.post('/api/tweets/4/likes', headers={'api-key': 'test'})
+    client.post('/api/users/1/follow', headers={'api-key': 'test2'})
+    reconcile_counters(session)
+    slow = make_client(engine, media_storage, fast_json=False)
+    fast = make_client(engine, media_storage, fast_json=True)
+    requests: List[Tuple[str, Dict[str, str], Dict[str, Union[str, int]]]] = [
+        ('/api/tweets', {'api-key': 'test'}, {}),
+        ('/api/tweets', {'api-key': 'test2'}, {'limit': 1}),
+        ('/api/tweets', {'api-key': 'test2'}, {'mode': 'ranked'}),
+        ('/api/tweets', {'api-key': 'unknown'}, {}),
+        ('/api/users/me', {'api-key': 'test'}, {}),
+        ('/api/users/1', {}, {}),
+        ('/api/users/2', {}, {}),
+    ]
+    for route, headers, params in requests:
+        slow_resp = slow.get(route, headers=headers, params=params)
+        fast_resp = fast.get(route, headers=headers, params=params)
+        assert fast_resp.status_code == slow_resp.status_code
+        assert fast_resp.headers['content-type'] == \
+            slow_resp.headers['content-type']
+        assert fast_resp.content == slow_resp.content
+    assert 'Привет'.encode() in fast.get(
+        '/api/tweets', headers={'api-key': 'test2'}).content
@@ -0,0 +1,68 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from backend_server.counters import reconcile_counters
+from backend_server.models import Follow, Like, Media, Tweet, User
+from tests.sql_budget import SqlRecorder
+
+HEADERS = {'api-key': 'test'}
+
+
+def add_activity(session: Session, size: int) -> None:
+    """
+    Добавляет size пользователей, подписанных на name_one и взаимно,
+    и по твиту каждого с медиафайлом и size лайками
+    """
+    users = range(10, 10 + size)
+    session.execute(insert(User), [
+        {'id': user_id, 'api_key': f'key{user_id}', 'name': f'user{user_id}'}
+        for user_id in users])
+    session.execute(insert(Tweet), [
+        {'id': user_id, 'content': f'tweet {user_id}',
+         'media_ids': [user_id], 'user_id': user_id} for user_id in users])
+    session.execute(insert(Media), [
+        {'id': user_id, 'sha256': f'{user_id:064x}', 'size': 1,
+         'tweet_id': user_id} for user_id in users])
+    session.execute(insert(Like), [
+        {'tweet_id': tweet_id, 'user_id': user_id}
+        for tweet_id in users for user_id in users])
+    session.execute(insert(Follow), [
+        {'follower_id': follower, 'following_id': following}
+        for user_id in users
+        for follower, following in ((1, user_id), (user_id, 1))])
+    session.commit()
+    reconcile_counters(session)
+
+
+@pytest.mark.parametrize('size', [1, 10, 40])
+@pytest.mark.parametrize('route, statements', [
+    ('/api/tweets', 4),
+    ('/api/tweets?mode=ranked', 8),
+    ('/api/users/me', 4),
+    ('/api/users/1', 3),
+    ('/api/users/1?compact=true', 3),
+    ('/api/users/1/followers', 1),
+])
+def test_route_sql_budget(client: TestClient, session: Session,
+                          sql_recorder: SqlRecorder, route: str,
+                          statements: int, size: int) -> None:
+    """Тест числа SQL-запросов роутов, не зависящего от объёма данных"""
+    add_activity(session, size)
+    for _ in range(2):
+        assert client.get(route, headers=HEADERS).status_code == 200
+    sql_recorder.assert_budget(f'GET {route}', statements)
+
+
+def test_recorder_attributes_statements(
+        client: TestClient, sql_recorder: SqlRecorder) -> None:
+    """Тест отнесения запросов к HTTP-запросам и учёта времени БД"""
+    client.get('/api/users/2')
+    client.get('/api/stats/caches')
+    user_request, stats_request = sql_recorder.requests
+    assert user_request.route == 'GET /api/users/2'
+    assert user_request.statements and user_request.duration > 0
+    assert stats_request.statements == []
+    with pytest.raises(AssertionError, match='GET /api/users/2'):
+        sql_recorder.assert_budget('GET /api/users/2', statements=0)
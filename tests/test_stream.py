@@ -0,0 +1,111 @@
+import asyncio
+import threading
+from typing import List
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from backend_server.auth import ApiKeyResolver
+from backend_server.fastapi_api import create_app
+from backend_server.routes import connect_routes_stream, publish_like
+from backend_server.stream import (
+    RESYNC,
+    StreamFullError,
+    StreamHub,
+    format_event,
+    sse_events,
+)
+
+
+def test_hub_routes_events_to_followers() -> None:
+    """Тест доставки твитов, лайков и удалений только подписчикам автора"""
+
+    async def scenario() -> List[List[str]]:
+        hub = StreamHub()
+        reader = hub.subscribe(1, [2])
+        other = hub.subscribe(3, [])
+        stranger = hub.subscribe(4, [5])
+        hub.publish_tweet(2, {'id': 10})
+        hub.follow(3, 2, following=True)
+        hub.publish_tweet(2, {'id': 11})
+        hub.publish_like(2, 10, 1)
+        hub.publish_delete(2, 11)
+        hub.publish_like(5, 12, 1)
+        return [[name for name, _ in await subscription.next_events(0.1)]
+                for subscription in (reader, other, stranger)]
+
+    assert asyncio.run(scenario()) == [['tweet', 'tweet', 'like', 'delete'],
+                                       ['tweet', 'like', 'delete'],
+                                       ['like']]
+
+
+def test_publish_like_reads_author(app: FastAPI, session: Session) -> None:
+    """Тест публикации лайка подписчикам автора, найденного в БД"""
+
+    async def scenario() -> List[List[str]]:
+        hub = StreamHub()
+        follower = hub.subscribe(1, [2])
+        other = hub.subscribe(2, [1])
+        await publish_like(session, hub, 2, 1)
+        await publish_like(session, hub, 99, 1)
+        return [[name for name, _ in await subscription.next_events(0.1)]
+                for subscription in (follower, other)]
+
+    assert asyncio.run(scenario()) == [['like'], []]
+
+
+def test_slow_subscriber_gets_resync() -> None:
+    """Тест сброса переполненной очереди в одно событие resync"""
+
+    async def scenario() -> List[object]:
+        hub = StreamHub(max_subscribers=1, queue_size=2)
+        subscription = hub.subscribe(1, [2])
+        with pytest.raises(StreamFullError):
+            hub.subscribe(2, [])
+        for tweet_id in range(5):
+            hub.publish_delete(2, tweet_id)
+        events = await subscription.next_events(1)
+        empty = await subscription.next_events(0.01)
+        return [events, empty, hub.statistics()['dropped']]
+
+    assert asyncio.run(scenario()) == [[RESYNC], [], 5]
+
+
+def test_sse_events_format_and_unsubscribe() -> None:
+    """Тест кодирования событий, пинга и отписки по завершении"""
+
+    async def scenario() -> List[bytes]:
+        hub = StreamHub()
+        subscription = hub.subscribe(1, [2])
+        hub.publish_like(2, 7, -1)
+        chunks = [chunk async for chunk in sse_events(
+            hub, subscription, heartbeat=0.02, max_duration=0.05)]
+        assert hub.statistics()['subscribers'] == 0
+        return chunks
+
+    chunks = asyncio.run(scenario())
+    assert chunks[0] == b'retry: 1000\n\n'
+    assert chunks[1] == format_event(('like', b'{"tweet_id":7,"delta":-1}'))
+    assert chunks[1] == b'event: like\ndata: {"tweet_id":7,"delta":-1}\n\n'
+    assert b': ping\n\n' in chunks[2:]
+
+
+def test_stream_route(app: FastAPI, session: Session) -> None:
+    """Тест роута потока: неизвестный ключ и доставка события"""
+    stream_app = create_app()
+    hub = StreamHub()
+    connect_routes_stream(app=stream_app, my_session=session, hub=hub,
+                          resolver=ApiKeyResolver(), max_duration=0.5)
+    client = TestClient(stream_app)
+    assert client.get('/api/stream',
+                      headers={'api-key': 'unknown'}).status_code == 400
+
+    timer = threading.Timer(0.2, hub.publish_tweet, (2, {'id': 2}))
+    timer.start()
+    response = client.get('/api/stream', headers={'api-key': 'test'})
+    timer.join()
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/event-stream')
+    assert b'event: tweet\ndata: {"id":2}\n\n' in response.content
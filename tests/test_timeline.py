@@ -0,0 +1,77 @@
+from typing import List, cast
+
+from fastapi import FastAPI
+from sqlalchemy import event
+from sqlalchemy.engine.base import Engine
+from sqlalchemy.orm import Session
+
+from backend_server.models import Tweet
+from backend_server.timeline import HomeTimelineCache
+
+
+def add_tweets(session: Session, count: int) -> List[int]:
+    """Добавляет твиты пользователя 2, на которого подписан пользователь 1"""
+    tweets = [Tweet(content=f'tweet {number}', user_id=2)
+              for number in range(count)]
+    session.add_all(tweets)
+    session.commit()
+    return [cast(int, tweet.id) for tweet in tweets]
+
+
+def test_page_past_timeline_tail(
+        app: FastAPI, session: Session, engine: Engine) -> None:
+    """Тест: страницы старше хвоста ленты дочитываются из БД"""
+    tweet_ids = [2] + add_tweets(session, 4)
+    newest = tweet_ids[::-1]
+    timelines = HomeTimelineCache(max_size=3)
+    assert timelines.page(session, 1, limit=2) == newest[:2]
+    assert timelines.page(session, 1, limit=2,
+                          before_id=newest[1]) == newest[2:4]
+    assert timelines.page(session, 1, limit=5,
+                          before_id=newest[2]) == newest[3:]
+    statements: List[str] = []
+    event.listen(engine, 'before_cursor_execute',
+                 lambda *args: statements.append(args[2]))
+    assert timelines.page(session, 1, limit=3) == newest[:3]
+    assert not statements
+
+
+def test_complete_timeline_skips_database(
+        app: FastAPI, session: Session, engine: Engine) -> None:
+    """Тест: полная лента читается без БД, пока не переполнится"""
+    timelines = HomeTimelineCache(max_size=3)
+    assert timelines.page(session, 1, limit=5) == [2]
+    statements: List[str] = []
+    event.listen(engine, 'before_cursor_execute',
+                 lambda *args: statements.append(args[2]))
+    assert timelines.page(session, 1, limit=5, before_id=2) == []
+    assert not statements
+    tweet_ids = add_tweets(session, 3)
+    for tweet_id in tweet_ids:
+        timelines.fan_out(session, tweet_id, 2)
+    assert timelines.page(session, 1, limit=5) == tweet_ids[::-1] + [2]
+
+
+def test_fan_out_out_of_order(app: FastAPI, session: Session) -> None:
+    """Тест: твиты, разосланные не по порядку, встают на место по id"""
+    timelines = HomeTimelineCache(max_size=3)
+    assert timelines.page(session, 1, limit=5) == [2]
+    first, second, third = add_tweets(session, 3)
+    for tweet_id in (second, third, first, third):
+        timelines.fan_out(session, tweet_id, 2)
+    assert timelines.page(session, 1, limit=3) == [third, second, first]
+    timelines.remove(session, second, 2)
+    assert timelines.page(session, 1, limit=2) == [third, first]
+
+
+def test_timelines_evicted_by_user(app: FastAPI, session: Session) -> None:
+    """Тест вытеснения лент давно не читавших пользователей"""
+    timelines = HomeTimelineCache(max_users=1)
+    timelines.page(session, 1, limit=5)
+    timelines.page(session, 2, limit=5)
+    stats = timelines.statistics()
+    assert stats['users'] == 1 and stats['evictions'] == 1
+    tweet_id, = add_tweets(session, 1)
+    timelines.fan_out(session, tweet_id, 2)
+    assert timelines.statistics()['tweets'] == 0
+    assert timelines.page(session, 1, limit=5) == [tweet_id, 2]
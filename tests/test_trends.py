@@ -0,0 +1,83 @@
+from typing import List
+
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from backend_server.trends import (
+    TrendingTopics,
+    extract_hashtags,
+    extract_mentions,
+)
+
+
+def test_extract_tags() -> None:
+    """Тест разбора хэштегов и упоминаний"""
+    text = '#Python and #python, a#b #fast_api @name_one mail@host @@x'
+    assert extract_hashtags(text) == ['python', 'fast_api']
+    assert extract_mentions(text) == ['name_one']
+
+
+def test_sliding_window() -> None:
+    """Тест оценок частоты, вытеснения кандидатов и устаревания интервалов"""
+    now: List[float] = [100.0]
+    trends = TrendingTopics(bucket_seconds=10, window_buckets=3,
+                            candidates=2, clock=lambda: now[0])
+    for tags in (['a', 'b'], ['a'], ['a', 'c'], ['c'], ['d']):
+        trends.record(tags)
+    # b вытеснен c, а d - сам собой как кандидат с наименьшей оценкой
+    assert trends.top(5) == [('a', 3), ('c', 2)]
+    assert trends.top(1) == [('a', 3)]
+    now[0] = 125.0
+    trends.record(['c'])
+    assert trends.top(2) == [('a', 3), ('c', 3)]
+    now[0] = 131.0
+    assert trends.top(5) == [('c', 1)]
+    now[0] = 200.0
+    assert trends.top(5) == []
+    assert trends.statistics()['recorded'] == 8
+
+
+def test_snapshot_restore(session: Session) -> None:
+    """Тест сохранения снимка и восстановления неустаревших интервалов"""
+    now: List[float] = [100.0]
+    trends = TrendingTopics(bucket_seconds=10, window_buckets=3,
+                            clock=lambda: now[0])
+    trends.record(['old'])
+    now[0] = 115.0
+    trends.record(['new', 'old'])
+    trends.snapshot(session)
+
+    restored = TrendingTopics(bucket_seconds=10, window_buckets=3,
+                              clock=lambda: now[0])
+    restored.record(['new'])
+    restored.load(session)
+    assert restored.top(5) == [('new', 2), ('old', 2)]
+    now[0] = 131.0
+    late = TrendingTopics(bucket_seconds=10, window_buckets=3,
+                          clock=lambda: now[0])
+    late.load(session)
+    assert late.top(5) == [('new', 1), ('old', 1)]
+
+
+def test_mentions_and_trends_routes(client: TestClient) -> None:
+    """Тест ленты упоминаний и трендов по новым твитам"""
+    tweet_ids = [client.post('/api/tweets', headers={'api-key': 'test'}, json={
+        'tweet_data': f'hi @name_two #FastAPI #tag{number}',
+        'tweet_media_ids': []}).json()['tweet_id'] for number in range(3)]
+    trends = client.get('/api/trends', params={'limit': 2}).json()['trends']
+    assert trends[0] == {'tag': 'fastapi', 'count': 3} and len(trends) == 2
+
+    headers = {'api-key': 'test2'}
+    page = client.get('/api/users/me/mentions', headers=headers,
+                      params={'limit': 2}).json()
+    assert [tweet['id'] for tweet in page['tweets']] == tweet_ids[:0:-1]
+    page = client.get('/api/users/me/mentions', headers=headers, params={
+        'limit': 2, 'cursor': page['next_cursor']}).json()
+    assert [tweet['id'] for tweet in page['tweets']] == tweet_ids[:1]
+    client.delete(f'/api/tweets/{tweet_ids[0]}', headers={'api-key': 'test'})
+    page = client.get('/api/users/me/mentions', headers=headers).json()
+    assert [tweet['id'] for tweet in page['tweets']] == tweet_ids[:0:-1]
+    assert client.get('/api/users/me/mentions',
+                      headers={'api-key': 'test'}).json()['tweets'] == []
+    assert client.get('/api/users/me/mentions',
+                      headers={'api-key': 'missing'}).status_code == 400
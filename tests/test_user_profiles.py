@@ -0,0 +1,66 @@
+from typing import List, Optional
+
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from backend_server.counters import reconcile_counters
+from backend_server.models import Follow, User
+
+
+def add_followers(session: Session, count: int) -> None:
+    """Добавляет count пользователей с id от 10, подписанных на name_two"""
+    users = range(10, 10 + count)
+    session.execute(insert(User), [
+        {'id': user_id, 'api_key': f'key{user_id}', 'name': f'user{user_id}'}
+        for user_id in users])
+    session.execute(insert(Follow), [
+        {'follower_id': user_id, 'following_id': 2} for user_id in users])
+    session.commit()
+    reconcile_counters(session)
+
+
+def test_followers_pages(client: TestClient, session: Session) -> None:
+    """Тест постраничного списка подписчиков и подписок по курсору"""
+    add_followers(session, 5)
+    ids: List[int] = []
+    cursor: Optional[str] = None
+    while True:
+        page = client.get('/api/users/2/followers',
+                          params={'limit': 2, 'cursor': cursor}).json()
+        ids.extend(user['id'] for user in page['users'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert ids == [14, 13, 12, 11, 10, 1]
+    assert client.get('/api/users/1/following').json() == {
+        'result': True, 'users': [{'id': 2, 'name': 'name_two'}],
+        'next_cursor': None}
+    assert client.get('/api/users/2/following').json()['users'] == []
+    assert client.get('/api/users/99/followers').status_code == 400
+    assert client.get('/api/users/2/followers',
+                      params={'cursor': '!'}).status_code == 400
+
+
+def test_compact_profile_cache(client: TestClient, session: Session) -> None:
+    """Тест краткого профиля, его кэширования и сброса при подписке"""
+    add_followers(session, 12)
+    user = client.get('/api/users/2', params={'compact': True}).json()['user']
+    assert user['followers_count'] == 13 and user['following_count'] == 0
+    assert [follower['id'] for follower in user['followers']] == \
+        list(range(21, 11, -1))
+    assert user['followers_cursor'] and user['following_cursor'] is None
+    page = client.get('/api/users/2/followers', params={
+        'cursor': user['followers_cursor']}).json()
+    assert [follower['id'] for follower in page['users']] == [11, 10, 1]
+    client.get('/api/users/2', params={'compact': True})
+    stats = client.get('/api/stats/caches').json()['caches']['profiles']
+    assert stats == {'hits': 1, 'misses': 1, 'entries': 1}
+    assert client.delete('/api/users/2/follow',
+                         headers={'api-key': 'key21'}).json()['result']
+    user = client.get('/api/users/2', params={'compact': True}).json()['user']
+    assert user['followers_count'] == 12 and user['followers'][0]['id'] == 20
+    me = client.get('/api/users/me', params={'compact': True},
+                    headers={'api-key': 'key21'}).json()['user']
+    assert me['following'] == [] and me['following_count'] == 0
+    assert 'followers_cursor' not in client.get('/api/users/2').json()['user']
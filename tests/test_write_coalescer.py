@@ -0,0 +1,104 @@
+import asyncio
+from typing import List
+
+from fastapi.testclient import TestClient
+from sqlalchemy.engine.base import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from backend_server.counters import (
+    FOLLOWERS_COUNT,
+    LIKE_COUNT,
+    CounterAggregator,
+)
+from backend_server.fastapi_api import create_app
+from backend_server.media_storage import LocalMediaStorage
+from backend_server.models import Follow, Like
+from backend_server.routes import connect_routes
+from backend_server.timeline import HomeTimelineCache
+from backend_server.write_coalescer import FOLLOW, LIKE, Write, WriteCoalescer
+
+
+def test_apply_batch(session: Session, client: TestClient) -> None:
+    """Тест результатов операций пачки и числа выполненных запросов"""
+    counters = CounterAggregator(flush_interval=3600)
+    coalescer = WriteCoalescer(session, counters, HomeTimelineCache())
+    results = coalescer.apply(session, [
+        Write(LIKE, 1, 1, insert=True),
+        Write(LIKE, 1, 1, insert=True),
+        Write(LIKE, 1, 2, insert=False),
+        Write(LIKE, 1, 2, insert=True),
+        Write(FOLLOW, 1, 1, insert=True),
+        Write(FOLLOW, 1, 2, insert=False),
+        Write(FOLLOW, 2, 1, insert=False),
+    ])
+    assert results == [True, False, True, True, True, True, False]
+    assert coalescer.statistics()['statements'] == 3
+    assert sorted(session.query(Like.user_id, Like.tweet_id).tuples()) == \
+        [(1, 1), (1, 2)]
+    assert sorted(session.query(Follow.follower_id, Follow.following_id)
+                  .tuples()) == [(1, 1)]
+    assert counters.pending(LIKE_COUNT, 1) == 1
+    assert counters.pending(LIKE_COUNT, 2) == 0
+    assert counters.pending(FOLLOWERS_COUNT, 2) == -1
+
+
+def test_submit_coalesces_double_taps(
+        engine: Engine, client: TestClient) -> None:
+    """Тест объединения одновременных операций в одну пачку"""
+    coalescer = WriteCoalescer(sessionmaker(engine), CounterAggregator(),
+                               HomeTimelineCache(), window=0.05)
+
+    async def tap() -> List[bool]:
+        return list(await asyncio.gather(
+            coalescer.submit(Write(LIKE, 2, 1, insert=True)),
+            coalescer.submit(Write(LIKE, 2, 1, insert=True)),
+            coalescer.submit(Write(FOLLOW, 2, 1, insert=True)),
+        ))
+
+    assert asyncio.run(tap()) == [True, False, True]
+    assert coalescer.statistics() == {'batches': 1, 'writes': 3,
+                                      'statements': 2, 'queued': 0}
+
+
+def test_cancelled_submit_keeps_batch(
+        engine: Engine, client: TestClient) -> None:
+    """Тест: отмена одного ожидающего не мешает остальным в пачке"""
+    coalescer = WriteCoalescer(sessionmaker(engine), CounterAggregator(),
+                               HomeTimelineCache(), window=0.05)
+
+    async def cancel_first() -> List[bool]:
+        first = asyncio.ensure_future(
+            coalescer.submit(Write(LIKE, 2, 1, insert=True)))
+        others = asyncio.gather(
+            coalescer.submit(Write(FOLLOW, 2, 1, insert=True)),
+            coalescer.submit(Write(LIKE, 1, 1, insert=True)),
+        )
+        await asyncio.sleep(0)
+        first.cancel()
+        return list(await asyncio.wait_for(others, 1))
+
+    assert asyncio.run(cancel_first()) == [True, True]
+    assert coalescer.statistics()['writes'] == 3
+
+
+def test_coalesced_routes(
+        engine: Engine, client: TestClient,
+        media_storage: LocalMediaStorage) -> None:
+    """Тест роутов лайков и подписок в режиме объединения записей"""
+    app = create_app()
+    connect_routes(app=app, my_session=sessionmaker(engine),
+                   media_storage=media_storage, coalesce_writes=True)
+    coalesced_client = TestClient(app=app)
+    headers = {'api-key': 'test2'}
+    for method, route, result in [
+        ('post', '/api/tweets/1/likes', True),
+        ('post', '/api/tweets/1/likes', False),
+        ('delete', '/api/tweets/1/likes', True),
+        ('delete', '/api/tweets/1/likes', False),
+        ('post', '/api/users/1/follow', True),
+        ('delete', '/api/users/1/follow', True),
+    ]:
+        resp = coalesced_client.request(method, route, headers=headers)
+        assert resp.json() == {'result': result}
+    stats = coalesced_client.get('/api/stats/caches').json()['caches']
+    assert stats['writes']['writes'] == 6